@@ -0,0 +1,106 @@
+import argparse
+import glob
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+import build_data
+import ops_plan
+
+# Runs many .ops files in parallel against one loaded copy of the data set.
+# The parent loads the table and its index, then forks the workers, which
+# share it copy-on-write (the numeric columns are a read-only memory map of
+# the compiled table, so those pages are shared outright).  Each script's
+# output is written to <output directory>/<script name>.out, the same
+# output hw4.py would print for it, and the files are written in sorted
+# script order whatever order the workers finish in.
+#
+# Usage:
+#   python batch_ops.py <directory or glob> [...] [-j JOBS] [-o OUTPUT_DIR]
+
+
+# Find the .ops files named by directories and glob patterns.
+# input: the directories and patterns as a list of strings
+# output: the file paths, sorted and without duplicates
+def find_scripts(patterns: list[str]) -> list[str]:
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.ops')
+        paths.update(path for path in glob.glob(pattern)
+                     if os.path.isfile(path))
+    return sorted(paths)
+
+
+# Run one script against the data set loaded in this process.
+# input: the path of the .ops file
+# output: (path, the script's output as a string)
+def run_file(path: str) -> tuple[str, str]:
+    out = io.StringIO()
+    with open(path, 'r') as file:
+        text = file.read()
+    ops_plan.run_script(text, build_data.get_data(), out,
+                        build_data.get_index())
+    return path, out.getvalue()
+
+
+# Run scripts in a pool of worker processes and write their outputs.
+# input: the paths of the .ops files
+# input: the directory to write the outputs to
+# input: the number of worker processes
+# output: the number of seconds the scripts took
+def run_batch(paths: list[str], output_dir: str, jobs: int) -> float:
+    names = [os.path.basename(path) + '.out' for path in paths]
+    if len(set(names)) != len(names):
+        raise ValueError('two scripts have the same file name; '
+                         'their outputs would overwrite each other')
+    os.makedirs(output_dir, exist_ok=True)
+
+    build_data.get_index()
+    start = time.perf_counter()
+    if jobs == 1:
+        results = map(run_file, paths)
+        pool = None
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+                'fork' if 'fork' in methods else None)
+        pool = context.Pool(jobs)
+        results = pool.imap(run_file, paths,
+                            chunksize=max(1, len(paths) // (jobs * 4)))
+    try:
+        for name, (_, output) in zip(names, results):
+            with open(os.path.join(output_dir, name), 'w') as file:
+                file.write(output)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Run many .ops files against one loaded data set.')
+    parser.add_argument('scripts', nargs='+',
+                        help='.ops files, directories of them, or globs')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('-o', '--output-dir', default='batch_output',
+                        help='directory to write the outputs to')
+    args = parser.parse_args()
+
+    paths = find_scripts(args.scripts)
+    if not paths:
+        print("No .ops files found")
+        sys.exit(1)
+    jobs = max(1, min(args.jobs or 1, len(paths)))
+    seconds = run_batch(paths, args.output_dir, jobs)
+    print(f"Ran {len(paths)} scripts in {seconds:.3f}s with {jobs} workers "
+          f"({len(paths) / seconds:.1f} scripts/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
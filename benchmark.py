@@ -0,0 +1,575 @@
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+import copy
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import build_data
+import county_demographics
+import ops_plan
+import output_writers
+import parallel
+import quantiles
+import table_cache
+import table_index
+from county_table import CountyTable
+
+# A benchmark suite for the .ops engine at several data sizes.
+#
+# For each scale, a synthetic data set of scale times the real number of
+# counties is generated by drawing counties (with replacement) from the
+# real report, so it has every section and field of the get_report()
+# schema and realistic values; only the county names are new.  It is
+# written out as a compiled table in a temporary directory, and then a
+# fresh process loads it, builds its index and runs the inputs/*.ops
+# scripts and a few stress scripts against it several times, recording:
+#   generate_seconds, compile_seconds   building and writing the data set
+#   load_seconds, index_seconds         loading it and indexing it
+#   scripts                             per script: the best time, the
+#                                       number of operations, operations
+#                                       per second, and the time and rows
+#                                       in/out of every plan step
+#   peak_rss_kb                         the peak resident memory of the
+#                                       process that loaded and queried it
+#   scripts_per_second                  throughput over all the scripts
+#
+# Results are written as JSON.  Two results files can be compared; any
+# metric that got worse by more than the threshold is flagged and the
+# comparison exits with status 1.
+#
+# Usage:
+#   python benchmark.py run [--scales 1 10 100 1000] [--workers 4]
+#                           [-o results.json]
+#   python benchmark.py compare old.json new.json [--threshold 0.1]
+#   python benchmark.py startup [--import-budget 0.1] [--run-budget 0.5]
+#   python benchmark.py records
+#   python benchmark.py quantiles [--scale 10] [--trials 50] [--bound 0.017]
+#
+# The startup check guards the cost of starting hw4.py: importing it (which
+# must not load any data; see python -X importtime) and running a small
+# script from a fresh process, each the best of several tries.  It exits
+# with status 1 if either is over its budget in seconds.
+#
+# The quantiles check measures how far the sketched quantiles of
+# selections (see quantiles; hw4 only sketches selections too large to
+# sort) are from the exact ones, on a synthetic data set: for random
+# selections of random sizes and several fields, the rank error of each
+# quantile is how far (as a fraction of the selection) the returned
+# value's rank is from the requested one.  It exits with status 1 if any
+# error is over the bound.
+#
+# The records measurement reports the memory kept by the
+# data.CountyDemographics objects of the whole report, once the report
+# dictionaries they were converted from are gone.
+#
+# With --workers, every script runs with a parallel.ShardPool of that many
+# worker processes, so a run with and without it can be compared.
+#
+# The 1000x data set has about 3 million counties; its compiled table
+# takes about 2 GB of disk, and running it takes a few minutes and about
+# 3 GB of memory.
+
+SCALES = (1, 10, 100, 1000)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INPUTS = os.path.join(ROOT, 'inputs')
+
+# The script the startup check runs, and the default budgets in seconds
+# for importing hw4 and for running the script (tests/test_startup.py
+# holds the import to its budget too).
+STARTUP_SCRIPT = os.path.join(INPUTS, 'pop.ops')
+IMPORT_BUDGET = 0.1
+RUN_BUDGET = 0.5
+
+# Scripts that stress one part of the engine each.
+STRESS_SCRIPTS = {
+        'stress_aggregates': '\n'.join(
+                ['population-total'] +
+                [f'{operation}:{field}'
+                 for field in ("Education.Bachelor's Degree or Higher",
+                               'Education.High School or Higher',
+                               'Ethnicities.Hispanic or Latino',
+                               'Ethnicities.White Alone',
+                               'Ethnicities.Black Alone',
+                               'Income.Persons Below Poverty Level',
+                               'Housing.Homeownership Rate',
+                               'Miscellaneous.Foreign Born')
+                 for operation in ('population', 'percent')]),
+        'stress_filters': '\n'.join(
+                [f'filter-gt:Education.High School or Higher:{10 + i}\n'
+                 f'filter-lt:Ethnicities.Hispanic or Latino:{90 - i}\n'
+                 f'percent:Income.Persons Below Poverty Level'
+                 for i in range(10)]),
+        'stress_groups': '\n'.join(
+                ['group-by:State', 'population-total',
+                 'percent:Income.Persons Below Poverty Level',
+                 "percent:Education.Bachelor's Degree or Higher",
+                 'population:Ethnicities.Hispanic or Latino',
+                 'top:Income.Persons Below Poverty Level:100',
+                 'percent:Income.Persons Below Poverty Level',
+                 'bottom:Education.High School or Higher:10',
+                 'display'])
+    }
+
+
+# Generate a synthetic table of scale times as many counties as the real
+# data set, by drawing rows of the real table at random.
+# input: how many times the real number of counties to generate
+# input: the seed for the random draws
+# output: the CountyTable
+def synthetic_table(scale: int, seed: int = 0) -> CountyTable:
+    source = build_data.get_data()
+    picks = random.Random(seed).choices(range(len(source)),
+                                        k=len(source) * scale)
+    states = [source.states[row] for row in picks]
+    counties = [f'County{i} County' for i in range(len(picks))]
+
+    def load_section(section):
+        source.columns.load(section)
+        columns = {}
+        for label in source.labels(section):
+            name = section + '.' + label
+            column = source.columns[name]
+            columns[name] = array('d', map(column.__getitem__, picks))
+        return columns, source.integral.intersection(columns)
+
+    return CountyTable(counties, states, source.sections, load_section)
+
+
+# Time a function call.
+# input: the function and its arguments
+# output: (the result, the seconds it took)
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+# Generate a scaled data set and write it out as a compiled table.
+# input: the scale
+# input: the seed
+# input: the path to write the compiled table to
+# output: dictionary of the rows and seconds taken
+def generate(scale: int, seed: int, path: str) -> dict:
+    table, generate_seconds = timed(synthetic_table, scale, seed)
+    _, load_seconds = timed(table.load_all)
+    _, compile_seconds = timed(table_cache.write_table, table, path)
+    return {'rows': len(table),
+            'generate_seconds': generate_seconds + load_seconds,
+            'compile_seconds': compile_seconds}
+
+
+# The scripts to run: inputs/*.ops and the stress scripts.
+# output: dictionary mapping script name to its text
+def scripts() -> dict[str, str]:
+    texts = {}
+    for path in sorted(glob.glob(os.path.join(INPUTS, '*.ops'))):
+        with open(path, 'r') as file:
+            texts[os.path.basename(path)] = file.read()
+    texts.update(STRESS_SCRIPTS)
+    return texts
+
+
+# Run one script against a table, timing every plan step.
+# input: the script's text
+# input: the CountyTable
+# input: its TableIndex
+# input: the stream to write the output to
+# input: a parallel.ShardPool of the table, or None
+# output: (total seconds, list of per-step dictionaries)
+def run_script(text: str, table: CountyTable, index, stream,
+               shards=None) -> tuple:
+    steps = []
+
+    def observe(step, seconds, rows_in, rows_out):
+        steps.append({'step': type(step).__name__,
+                      'ops': len(ops_plan.step_lines(step)),
+                      'seconds': seconds,
+                      'rows_in': rows_in,
+                      'rows_out': rows_out})
+
+    out = output_writers.TextWriter(stream)
+    start = time.perf_counter()
+    ops_plan.run_plan(ops_plan.plan_stream(map(
+            ops_plan.compile_line, ops_plan.validate_lines(
+                    text.splitlines(), out))),
+            table, out, index, observer=observe, shards=shards)
+    return time.perf_counter() - start, steps
+
+
+# Load a compiled table and run every script against it, keeping each
+# script's best of several runs.
+# input: the path of the compiled table
+# input: how many times to run each script
+# input: how many worker processes to run the scripts with (0 for none)
+# output: dictionary of the measurements
+def measure(path: str, repeat: int, workers: int = 0) -> dict:
+    table, load_seconds = timed(table_cache.load_table, path)
+    if table is None:
+        raise RuntimeError(f'could not load {path}')
+    index, index_seconds = timed(table_index.TableIndex, table)
+    shards = None
+    if workers > 1:
+        shards = parallel.ShardPool(table, workers, index)
+
+    results = {}
+    total = 0.0
+    with open(os.devnull, 'w') as stream:
+        for name, text in scripts().items():
+            best = None
+            for _ in range(repeat):
+                gc.collect()
+                seconds, steps = run_script(text, table, index, stream,
+                                            shards)
+                if best is None or seconds < best[0]:
+                    best = (seconds, steps)
+            seconds, steps = best
+            ops = sum(step['ops'] for step in steps)
+            total += seconds
+            results[name] = {'seconds': seconds, 'ops': ops,
+                             'ops_per_second': ops / seconds if seconds else 0,
+                             'steps': steps}
+    if shards is not None:
+        shards.close()
+    return {'load_seconds': load_seconds,
+            'index_seconds': index_seconds,
+            'scripts': results,
+            'scripts_per_second': len(results) / total if total else 0,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+# Run a step of the benchmark in a fresh process, so its memory use and
+# timings are not affected by earlier steps.
+# input: the arguments for the worker as a list of strings
+# output: the dictionary the worker printed
+def run_worker(arguments: list[str]) -> dict:
+    result = subprocess.run([sys.executable, os.path.abspath(__file__),
+                             'worker'] + arguments,
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+
+# Run the benchmark at every scale.
+# input: the scales as a list of ints
+# input: the seed for the synthetic data
+# input: how many times to run each script
+# input: how many worker processes to run the scripts with (0 for none)
+# output: the results as a dictionary
+def run_benchmark(scales, seed: int, repeat: int, workers: int = 0) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            path = os.path.join(directory, f'scale{scale}.table')
+            print(f"{scale}x: generating", file=sys.stderr)
+            result = run_worker(['generate', str(scale), str(seed), path])
+            print(f"{scale}x: {result['rows']} counties, running scripts",
+                  file=sys.stderr)
+            result.update(run_worker(['measure', path, str(repeat),
+                                      str(workers)]))
+            os.remove(path)
+            results[str(scale)] = result
+    return {'meta': {'date': datetime.datetime.now().isoformat(),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'cpus': os.cpu_count(),
+                     'seed': seed,
+                     'repeat': repeat,
+                     'workers': workers},
+            'results': results}
+
+
+# The environment to start hw4.py in for the startup check: tracing off.
+# output: the environment as a dictionary
+def startup_environment() -> dict:
+    environ = dict(os.environ, PYTHONPATH=ROOT)
+    environ.pop('HW4_TRACE', None)
+    environ.pop('HW4_TRACE_FILE', None)
+    return environ
+
+
+# Import hw4 in a fresh process with python -X importtime.
+# input: the environment to run it in
+# output: dictionary of the cumulative seconds each module took to import,
+#         by module name (hw4's is the whole import)
+def import_times(environ: dict) -> dict:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import sys; sys.path.insert(0, sys.argv[1]); '
+                             'import hw4', INPUTS],
+                            env=environ, check=True, capture_output=True,
+                            text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+# Measure how long hw4.py takes to import and to run a small script, each
+# in fresh processes, keeping the best of several tries.
+# input: how many times to try each
+# output: dictionary of the seconds taken and the slowest imported modules
+def measure_startup(repeat: int) -> dict:
+    environ = startup_environment()
+    import_seconds = run_seconds = None
+    modules = {}
+    for _ in range(repeat):
+        times = import_times(environ)
+        seconds = times['hw4']
+        if import_seconds is None or seconds < import_seconds:
+            import_seconds = seconds
+            modules = times
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(INPUTS, 'hw4.py'),
+                        STARTUP_SCRIPT], env=environ, check=True,
+                       stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        if run_seconds is None or seconds < run_seconds:
+            run_seconds = seconds
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[1:6]
+    return {'import_seconds': import_seconds, 'run_seconds': run_seconds,
+            'slowest_imports': dict(slowest)}
+
+
+# Measure the memory kept by converting the whole report into
+# CountyDemographics objects, once the report they came from is gone.
+# output: dictionary of the number of counties and the bytes they keep
+def measure_records() -> dict:
+    report = county_demographics.get_report()
+    gc.collect()
+    tracemalloc.start()
+    copied = copy.deepcopy(report)
+    counties = [build_data.convert_county(county) for county in copied]
+    del copied
+    gc.collect()
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'counties': len(counties), 'bytes': kept,
+            'bytes_per_county': kept / len(counties)}
+
+
+# The fields and quantiles the quantiles check tries.
+QUANTILE_FIELDS = (('Income', 'Per Capita Income'),
+                   ('Income', 'Persons Below Poverty Level'),
+                   ('Education', 'High School or Higher'),
+                   ('Population', '2014 Population'))
+QUANTILE_POINTS = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+# Estimate a quantile of a column over some rows with a KllSketch, the way
+# column_engine does for selections too large to sort.
+# input: the column
+# input: the rows, in order
+# input: the quantile as a float from 0 to 1
+# output: the estimate
+def _sketch_quantile(column, rows, q: float):
+    sketch = quantiles.KllSketch()
+    sketch.extend(value for value in map(column.__getitem__, rows)
+                  if value == value)
+    return sketch.quantile(q)
+
+
+# Measure the rank error of the sketched quantiles of random selections
+# against the exact quantiles.
+# input: the scale of the synthetic data set
+# input: how many random selections to try
+# input: the seed for the data set and the selections
+# output: dictionary of the errors, the selection sizes and the seconds
+#         taken by the sketch and by sorting
+def measure_quantiles(scale: int, trials: int, seed: int = 0) -> dict:
+    table = synthetic_table(scale, seed)
+    draw = random.Random(seed)
+    errors = []
+    sizes = []
+    sketch_seconds = sort_seconds = 0.0
+    for _ in range(trials):
+        rows = sorted(draw.sample(range(len(table)),
+                                  draw.randint(1, len(table) - 1)))
+        section, label = draw.choice(QUANTILE_FIELDS)
+        column = table.column(section, label)
+        start = time.perf_counter()
+        exact = sorted(value for value in map(column.__getitem__, rows)
+                       if value == value)
+        sort_seconds += time.perf_counter() - start
+        sizes.append(len(exact))
+        for q in QUANTILE_POINTS:
+            value, seconds = timed(_sketch_quantile, column, rows, q)
+            sketch_seconds += seconds / len(QUANTILE_POINTS)
+            target = quantiles.quantile_position(len(exact), q)
+            first = bisect_left(exact, value)
+            last = bisect_right(exact, value) - 1
+            error = 0 if first <= target <= last else \
+                    min(abs(first - target), abs(target - last))
+            errors.append(error / len(exact))
+    errors.sort()
+    return {'rows': len(table), 'trials': trials,
+            'largest_selection': max(sizes),
+            'max_error': errors[-1],
+            'p99_error': errors[int(len(errors) * 0.99)],
+            'median_error': errors[len(errors) // 2],
+            'sketch_seconds': sketch_seconds / trials,
+            'sort_seconds': sort_seconds / trials}
+
+
+# Flatten the results of one scale into named metrics.
+def _metrics(result: dict) -> dict[str, float]:
+    metrics = {name: result[name] for name in
+               ('load_seconds', 'index_seconds', 'peak_rss_kb')}
+    for name, script in result['scripts'].items():
+        metrics[f'{name} seconds'] = script['seconds']
+    return metrics
+
+
+# Compare two benchmark runs.  A metric regressed if it grew by more than
+# the threshold (and, for times, by more than a millisecond, to ignore
+# noise in very fast operations).
+# input: the old results as a dictionary
+# input: the new results as a dictionary
+# input: the largest allowed relative growth, such as 0.1 for 10%
+# output: (the report as a list of lines, the number of regressions)
+def compare(old: dict, new: dict, threshold: float) -> tuple[list[str], int]:
+    lines = []
+    regressions = 0
+    for scale, result in new['results'].items():
+        if scale not in old['results']:
+            lines.append(f"{scale}x: not in the old results")
+            continue
+        before = _metrics(old['results'][scale])
+        for name, value in _metrics(result).items():
+            if name not in before:
+                continue
+            previous = before[name]
+            change = (value - previous) / previous if previous else 0.0
+            noise = name.endswith('seconds') and value - previous < 0.001
+            flag = ''
+            if change > threshold and not noise:
+                flag = '  REGRESSION'
+                regressions += 1
+            elif change < -threshold and not noise:
+                flag = '  improved'
+            lines.append(f"{scale}x {name}: {previous:.6g} -> {value:.6g} "
+                         f"({change:+.1%}){flag}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark the .ops engine on scaled data sets.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run the benchmark')
+    run.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                     help='data set sizes, in multiples of the real data')
+    run.add_argument('--seed', type=int, default=0,
+                     help='seed for the synthetic data')
+    run.add_argument('--repeat', type=int, default=3,
+                     help='runs of each script (the best is kept)')
+    run.add_argument('--workers', type=int, default=0,
+                     help='worker processes to run the scripts with')
+    run.add_argument('-o', '--output', default='benchmark_results.json',
+                     help='file to write the results to')
+    check = commands.add_parser('compare', help='compare two results files')
+    check.add_argument('old')
+    check.add_argument('new')
+    check.add_argument('--threshold', type=float, default=0.1,
+                       help='relative growth that counts as a regression')
+    startup = commands.add_parser('startup',
+                                  help='check the startup time of hw4.py')
+    startup.add_argument('--import-budget', type=float,
+                         default=IMPORT_BUDGET,
+                         help='allowed seconds to import hw4')
+    startup.add_argument('--run-budget', type=float, default=RUN_BUDGET,
+                         help='allowed seconds to run ' +
+                              os.path.basename(STARTUP_SCRIPT))
+    startup.add_argument('--repeat', type=int, default=5,
+                         help='tries of each (the best is kept)')
+    commands.add_parser('records', help='measure the memory of the '
+                        'CountyDemographics objects of the report')
+    accuracy = commands.add_parser('quantiles', help='check the accuracy '
+                                   'of the sketched quantiles')
+    accuracy.add_argument('--scale', type=int, default=10,
+                          help='data set size, in multiples of the real data')
+    accuracy.add_argument('--trials', type=int, default=50,
+                          help='random selections to try')
+    accuracy.add_argument('--seed', type=int, default=0,
+                          help='seed for the data and the selections')
+    accuracy.add_argument('--bound', type=float, default=0.017,
+                          help='largest allowed rank error, as a fraction')
+    worker = commands.add_parser('worker')
+    worker.add_argument('task', choices=('generate', 'measure'))
+    worker.add_argument('arguments', nargs='*')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmark(args.scales, args.seed, args.repeat,
+                                args.workers)
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=1)
+        for scale, result in results['results'].items():
+            print(f"{scale}x: {result['rows']} counties, load "
+                  f"{result['load_seconds']:.3f}s, "
+                  f"{result['scripts_per_second']:.1f} scripts/s, "
+                  f"peak RSS {result['peak_rss_kb'] / 1024:.0f} MB")
+        print(f"Results written to {args.output}")
+    elif args.command == 'compare':
+        with open(args.old, 'r') as file:
+            old = json.load(file)
+        with open(args.new, 'r') as file:
+            new = json.load(file)
+        lines, regressions = compare(old, new, args.threshold)
+        for line in lines:
+            print(line)
+        print(f"{regressions} regressions")
+        sys.exit(1 if regressions else 0)
+    elif args.command == 'startup':
+        result = measure_startup(args.repeat)
+        over = 0
+        for name, budget in (('import', args.import_budget),
+                             ('run', args.run_budget)):
+            seconds = result[f'{name}_seconds']
+            flag = ''
+            if seconds > budget:
+                flag = '  OVER BUDGET'
+                over += 1
+            print(f"{name}: {seconds * 1000:.1f} ms "
+                  f"(budget {budget * 1000:.0f} ms){flag}")
+        for module, seconds in result['slowest_imports'].items():
+            print(f"  {module}: {seconds * 1000:.1f} ms")
+        sys.exit(1 if over else 0)
+    elif args.command == 'records':
+        result = measure_records()
+        print(f"{result['counties']} counties keep {result['bytes'] / 1024:.0f}"
+              f" KB ({result['bytes_per_county']:.0f} bytes per county)")
+    elif args.command == 'quantiles':
+        result = measure_quantiles(args.scale, args.trials, args.seed)
+        print(f"{result['trials']} selections of up to "
+              f"{result['largest_selection']} of {result['rows']} counties")
+        print(f"rank error: max {result['max_error']:.2%}, 99th percentile "
+              f"{result['p99_error']:.2%}, median "
+              f"{result['median_error']:.2%} (bound {args.bound:.2%})")
+        print(f"per quantile: sketch {result['sketch_seconds'] * 1000:.1f} "
+              f"ms, exact sort {result['sort_seconds'] * 1000:.1f} ms")
+        sys.exit(1 if result['max_error'] > args.bound else 0)
+    elif args.task == 'generate':
+        scale, seed, path = args.arguments
+        print(json.dumps(generate(int(scale), int(seed), path)))
+    else:
+        path, repeat, workers = args.arguments
+        print(json.dumps(measure(path, int(repeat), int(workers))))
+
+
+if __name__ == '__main__':
+    main()
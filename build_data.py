@@ -1,40 +1,200 @@
+import os
+
 import county_demographics
+import sampling
+import table_cache
+import table_index
 
+from county_table import CountyTable, EXTRA_SECTIONS
 from data import CountyDemographics
 
+# The pickled report shipped with county_demographics, and the compiled
+# columnar copy of it that get_data keeps alongside.
+SOURCE_PATH = os.path.join(os.path.dirname(county_demographics.__file__),
+                           'county_demographics.data')
+COMPILED_PATH = os.path.join(os.path.dirname(county_demographics.__file__),
+                             'county_demographics.table')
+
 
 # Given county demographics in dictionary form, convert to an object.
 # input: county demographics information as an inconsistently typed dictionary
 # output: the county demographics information as a CountyDemographics object
 #
 # Note that this function assumes the dictionary is properly structured.
+# The dictionary is left as it is: it belongs to the cached report, so the
+# misspelled "Median Houseold Income" label is fixed in a copy (where, as
+# before, the corrected label comes last).
 def convert_county(county) -> CountyDemographics:
-    if 'Median Houseold Income' in county['Income']:
-        county['Income']['Median Household Income'] =\
+    income = county['Income']
+    if 'Median Houseold Income' in income:
+        income = {label: value for label, value in income.items()
+                  if label != 'Median Houseold Income'}
+        income['Median Household Income'] = \
                 county['Income']['Median Houseold Income']
-        del county['Income']['Median Houseold Income']
     return CountyDemographics(
             county['Age'],
             county['County'],
             county['Education'],
             county['Ethnicities'],
-            county['Income'],
+            income,
             county['Population'],
             county['State']
         )
 
 
+# Flatten a section of the report, turning nested groups of fields into
+# dotted labels ({'Firms': {'Total': 5}} becomes {'Firms.Total': 5}).
+# input: the section as a dictionary
+# input: the prefix to put in front of every label
+# output: the flattened section as a dictionary
+def flatten_section(section: dict, prefix: str = '') -> dict:
+    flat = {}
+    for label, value in section.items():
+        if isinstance(value, dict):
+            flat.update(flatten_section(value, prefix + label + '.'))
+        else:
+            flat[prefix + label] = value
+    return flat
+
+
+# Convert the full report into a CountyTable, keeping the sections that
+# CountyDemographics leaves out as well.
+# input: an optional tracing.Tracer to record the loading and converting in
+# output: the converted data set as a CountyTable
+def build_table(tracer=None) -> CountyTable:
+    if tracer is None:
+        report = county_demographics.get_report()
+    else:
+        with tracer.span("get_report", "phase"):
+            report = county_demographics.get_report()
+        span = tracer.start("convert_county", "phase", rows_in=len(report))
+    counties = []
+    for county in report:
+        converted = convert_county(county)
+        entry = {
+                'Age': converted.age,
+                'County': converted.county,
+                'Education': converted.education,
+                'Ethnicities': converted.ethnicities,
+                'Income': converted.income,
+                'Population': converted.population,
+                'State': converted.state
+            }
+        for section in EXTRA_SECTIONS:
+            if section in county:
+                entry[section] = flatten_section(county[section])
+        counties.append(entry)
+    table = CountyTable.from_counties(counties)
+    if tracer is not None:
+        tracer.finish(span, rows_out=len(table))
+    return table
+
+
+# Convert the full report and write it out as a compiled table file, so
+# later calls of get_data can skip unpickling and converting it.
+# input: an optional tracing.Tracer to record the steps in
+# output: the converted data set as a CountyTable
+def compile_data(tracer=None) -> CountyTable:
+    table = build_table(tracer)
+    if tracer is None:
+        table_cache.write_table(table, COMPILED_PATH, SOURCE_PATH)
+    else:
+        with tracer.span("write compiled table", "phase"):
+            table_cache.write_table(table, COMPILED_PATH, SOURCE_PATH)
+    return table
+
+
 # To avoid reprocessing the full data set on multiple calls of get_data.
 _converted = None
 
 
-# This function retrieves the full demographics data set and converts
-# it to store each entry as a CountyDemographics object.
-# input: no input
-# output: county information as a list of CountyDemographics objects
-def get_data() -> list[CountyDemographics]:
+# This function retrieves the full demographics data set as a
+# column-oriented CountyTable.  Indexing or iterating over the table gives
+# row views that behave like CountyDemographics objects.  The compiled
+# table file is used when it is up to date with the source data, and is
+# (re)built otherwise.
+# input: an optional tracing.Tracer to record the loading steps in
+# output: county information as a CountyTable
+def get_data(tracer=None) -> CountyTable:
     global _converted
     if not _converted:
-       report = county_demographics.get_report()
-       _converted = [convert_county(county) for county in report]
+       if tracer is None:
+           _converted = table_cache.load_table(COMPILED_PATH, SOURCE_PATH)
+       else:
+           with tracer.span("load compiled table", "phase"):
+               _converted = table_cache.load_table(COMPILED_PATH, SOURCE_PATH)
+       if _converted is None:
+           try:
+               _converted = compile_data(tracer)
+           except OSError:
+               _converted = build_table(tracer)
     return _converted
+
+
+# The last stamp data_stamp computed, and the mtime and size of the source
+# file it was computed for.
+_stamp = None
+
+
+# Identify the version of the data get_data returns, so results computed
+# from it can be saved and safely reused by later runs.  The stamp is the
+# size and digest of the source data, so it does not change when the
+# compiled table is rebuilt or re-stamped (see table_cache); the source is
+# hashed once per process, unless it changes.  Without the source, the
+# compiled table's mtime and size are used.
+# input: no input
+# output: a tuple that changes whenever the data does
+def data_stamp() -> tuple:
+    global _stamp
+    get_data()
+    if not os.path.exists(SOURCE_PATH):
+        stat = os.stat(COMPILED_PATH)
+        return (COMPILED_PATH, stat.st_mtime_ns, stat.st_size)
+    stat = os.stat(SOURCE_PATH)
+    if _stamp is None or _stamp[0] != (stat.st_mtime_ns, stat.st_size):
+        _stamp = ((stat.st_mtime_ns, stat.st_size),
+                  (stat.st_size, table_cache.file_digest(SOURCE_PATH)))
+    return _stamp[1]
+
+
+# To avoid rebuilding the indexes on multiple calls of get_index.
+_index = None
+
+
+# This function builds (once) the indexes over the full data set: the
+# state index right away, and each field's sorted ordering the first time
+# that field is filtered on.
+# input: an optional tracing.Tracer to record building the index in
+# output: the TableIndex of get_data()
+def get_index(tracer=None) -> table_index.TableIndex:
+    global _index
+    if _index is None:
+        data = get_data(tracer)
+        if tracer is None:
+            _index = table_index.TableIndex(data)
+        else:
+            with tracer.span("build index", "phase"):
+                _index = table_index.TableIndex(data)
+    return _index
+
+
+# To avoid redrawing the same sample on multiple calls of get_sample.
+_samples = {}
+
+
+# This function draws (once per size and seed) a population-weighted,
+# state-stratified sample of the full data set for approximate queries.
+# input: how many counties to draw in total
+# input: the seed for the random draws
+# output: the sampling.StratifiedSample of get_data()
+def get_sample(size: int = 1000, seed: int = 0) -> sampling.StratifiedSample:
+    sample = _samples.get((size, seed))
+    if sample is None:
+        sample = _samples[size, seed] = sampling.StratifiedSample(
+                get_data(), size, seed, get_index())
+    return sample
+
+
+if __name__ == '__main__':
+    compile_data()
+    print(f"Compiled {COMPILED_PATH}")
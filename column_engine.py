@@ -0,0 +1,429 @@
+from functools import reduce
+import heapq
+from itertools import compress, repeat
+import operator
+
+import predicates
+import quantiles
+from county_table import CountyTable, POPULATION, column_name, headcount_name
+
+# Batched versions of the assignment's population, percent and filter
+# functions that work on a CountyTable instead of a list of county objects.
+# A set of counties is represented by a sequence of row numbers (in table
+# order), and every function here is built out of map/compress over whole
+# columns so the per-county work stays out of the interpreter loop.
+#
+# Sums are accumulated left to right in row order, exactly like the
+# original loops, so the results match them bit for bit.
+#
+# The filters optionally take a table_index.TableIndex.  With one, a filter
+# on the whole table is answered from the index (a dict hit for a state, a
+# bisect for a threshold), and a filter on an already filtered set
+# intersects the index's matches with it when there are few enough of them.
+#
+# Sub-populations are sums over the table's precomputed head-count columns
+# (percent / 100 * population for each county), and aggregates over the
+# whole table or over exactly one state's counties are read from the
+# table's stored totals without looking at any county.
+#
+# Quantiles are exact over the whole table and estimated with a bounded
+# memory sketch over any other selection; histograms are always exact (see
+# quantiles).
+
+
+# Get the row numbers of every county in a table.
+# input: the CountyTable
+# output: the row numbers as a range
+def all_rows(table: CountyTable) -> range:
+    return range(len(table))
+
+
+# Read a column at the given rows, without copying when the rows cover the
+# whole table.
+# input: the column as a sequence of floats
+# input: the row numbers
+# output: an iterator over the selected values
+def _values(column, rows):
+    if isinstance(rows, range) and rows == range(len(column)):
+        return iter(column)
+    return map(column.__getitem__, rows)
+
+
+# Add up numbers strictly left to right, starting from the int 0 the way
+# the original loops do.
+# input: an iterable of numbers
+# output: the total
+def _sequential_sum(values):
+    return reduce(operator.add, values, 0)
+
+
+# Check whether a set of row numbers is the whole table.
+def _is_all(table: CountyTable, rows) -> bool:
+    return isinstance(rows, range) and rows == range(len(table))
+
+
+# Decide whether narrowing rows down to an index's matches is cheaper than
+# scanning the rows.
+# input: the CountyTable
+# input: the row numbers being filtered
+# input: the row numbers the index matched
+# output: True if the index should be used
+def _use_index(table: CountyTable, rows, matches) -> bool:
+    if _is_all(table, rows):
+        return len(matches) <= len(rows) // 2
+    return len(matches) < len(rows) // 4
+
+
+# Keep the rows that also appear in an index's matches, in row order.
+# input: the CountyTable
+# input: the row numbers being filtered (in table order)
+# input: the row numbers the index matched (in any order)
+# output: the row numbers in both, in table order
+def _intersect(table: CountyTable, rows, matches) -> list[int]:
+    if _is_all(table, rows):
+        return sorted(matches)
+    if isinstance(rows, range):
+        return sorted(filter(rows.__contains__, matches))
+    member = set(matches)
+    return list(filter(member.__contains__, rows))
+
+
+# Filters counties by the specified state abbreviation
+# input: the CountyTable
+# input: the row numbers to filter
+# input: two-letter state abbreviation to filter counties by
+# input: an optional TableIndex of the table
+# output: the row numbers of the counties in that state
+def filter_by_state(table: CountyTable, rows, state: str, index=None):
+    if index is not None:
+        matches = index.state_rows(state)
+        if _is_all(table, rows):
+            return matches
+        if len(matches) < len(rows):
+            return _intersect(table, rows, matches)
+    return list(compress(rows, map(state.__eq__, _values(table.states, rows))))
+
+
+# Look up the column for a filter, raising KeyError for an unknown field
+# the same way a dictionary lookup on the first county would.
+def _filter_column(table: CountyTable, rows, section: str, label: str):
+    if section + '.' + label in table.columns:
+        return table.column(section, label)
+    if len(rows) > 0:
+        raise KeyError(label)
+    return None
+
+
+# Filters counties whose field value is strictly greater than a threshold
+# input: the CountyTable
+# input: the row numbers to filter
+# input: the section name (for example "Education")
+# input: the field label within the section
+# input: the threshold as a float
+# input: an optional TableIndex of the table
+# output: the row numbers of the counties above the threshold
+def field_greater_than(table: CountyTable, rows, section: str, label: str,
+                       threshold: float, index=None) -> list[int]:
+    column = _filter_column(table, rows, section, label)
+    if column is None:
+        return []
+    if index is not None:
+        matches = index.greater_than(section, label, threshold)
+        if _use_index(table, rows, matches):
+            return _intersect(table, rows, matches)
+    return list(compress(rows, map(threshold.__lt__, _values(column, rows))))
+
+
+# Filters counties whose field value is strictly less than a threshold
+# input: the CountyTable
+# input: the row numbers to filter
+# input: the section name (for example "Education")
+# input: the field label within the section
+# input: the threshold as a float
+# input: an optional TableIndex of the table
+# output: the row numbers of the counties below the threshold
+def field_less_than(table: CountyTable, rows, section: str, label: str,
+                    threshold: float, index=None) -> list[int]:
+    column = _filter_column(table, rows, section, label)
+    if column is None:
+        return []
+    if index is not None:
+        matches = index.less_than(section, label, threshold)
+        if _use_index(table, rows, matches):
+            return _intersect(table, rows, matches)
+    return list(compress(rows, map(threshold.__gt__, _values(column, rows))))
+
+
+# Get the counties an index says pass one test of a filter expression, if
+# the index can answer it.
+# input: the predicates.Comparison or predicates.StateIn
+# input: the TableIndex
+# output: the row numbers (in any order), or None
+def _index_matches(test, index):
+    if isinstance(test, predicates.StateIn):
+        if test.negated:
+            return None
+        return [row for state in test.states
+                for row in index.state_rows(state)]
+    if isinstance(test, predicates.Comparison):
+        if test.op == '>':
+            return index.greater_than(test.section, test.label, test.value)
+        if test.op == '<':
+            return index.less_than(test.section, test.label, test.value)
+    return None
+
+
+# Filters counties by a filter expression (see predicates) in one pass:
+# the expression's tests are ordered by the table's column statistics and
+# compiled into a single short-circuiting test per county.  With an index,
+# the first test of the expression (after ordering) is answered from the
+# index instead when it matches few enough counties.
+# input: the CountyTable
+# input: the row numbers to filter
+# input: the expression
+# input: an optional TableIndex of the table
+# output: the row numbers of the counties the expression keeps
+def filter_expression(table: CountyTable, rows, expression,
+                      index=None) -> list[int]:
+    for comparison in predicates.comparisons(expression):
+        if _filter_column(table, rows, comparison.section,
+                          comparison.label) is None:
+            return []
+    expression = predicates.order(expression, table)
+    if index is not None:
+        tests = expression.operands \
+                if isinstance(expression, predicates.AllOf) else (expression,)
+        matches = _index_matches(tests[0], index)
+        if matches is not None and _use_index(table, rows, matches):
+            rows = _intersect(table, rows, matches)
+            if len(tests) == 1:
+                return rows
+            expression = predicates.AllOf(tests[1:]) if len(tests) > 2 \
+                    else tests[1]
+    return list(filter(predicates.row_predicate(expression, table), rows))
+
+
+# Selects the counties with the k largest (or smallest) values of a field,
+# by heap selection in O(n log k); counties missing the field are left
+# out, and ties are broken in table order.
+# input: the CountyTable
+# input: the row numbers to select from
+# input: the section name (for example "Income")
+# input: the field label within the section
+# input: how many counties to select
+# input: True for the largest values, False for the smallest
+# input: an optional TableIndex of the table
+# output: the row numbers of the selected counties, largest (or smallest)
+#         value first
+def top_k(table: CountyTable, rows, section: str, label: str, k: int,
+          largest: bool = True, index=None) -> list[int]:
+    column = _filter_column(table, rows, section, label)
+    if column is None:
+        return []
+    if index is not None and _is_all(table, rows):
+        rows = index.extremes(section, label, k, largest)
+    values = list(_values(column, rows))
+    rows = compress(rows, map(operator.eq, values, values))
+    select = heapq.nlargest if largest else heapq.nsmallest
+    return select(k, rows, key=column.__getitem__)
+
+
+# Get the values of a field that the selected counties have, sorted, when
+# the selection is every county of the table (in any order).
+# input: the CountyTable
+# input: the row numbers of the selection
+# input: the field's column
+# input: the section name and field label
+# input: an optional TableIndex of the table
+# output: the sorted values, or None if the selection is not the whole table
+def _sorted_values(table: CountyTable, rows, column, section: str,
+                   label: str, index):
+    if len(rows) != len(table):
+        return None
+    if index is not None:
+        return index.field_order(section, label)[1]
+    return sorted(value for value in column if value == value)
+
+
+# Finds the q-quantile of a field over the selected counties (see
+# quantiles): exact over the whole table or a selection of at most
+# quantiles.EXACT_COUNTIES counties, and estimated with a KllSketch over
+# larger selections.  Counties missing the field are skipped.
+# input: the CountyTable
+# input: the row numbers of the selection
+# input: the section name (for example "Income")
+# input: the field label within the section
+# input: the quantile as a float from 0 to 1
+# input: an optional TableIndex of the table
+# output: (the value (an int for integral columns), whether it is exact),
+#         or None if no selected county has the field
+def field_quantile(table: CountyTable, rows, section: str, label: str,
+                   q: float, index=None):
+    column = _filter_column(table, rows, section, label)
+    if column is None:
+        return None
+    values = _sorted_values(table, rows, column, section, label, index)
+    if values is None and len(rows) <= quantiles.EXACT_COUNTIES:
+        values = sorted(value for value in _values(column, rows)
+                        if value == value)
+    if values is None:
+        sketch = quantiles.KllSketch()
+        sketch.extend(value for value in _values(column, rows)
+                      if value == value)
+        value = sketch.quantile(q)
+    else:
+        value = quantiles.sorted_quantile(values, q) if len(values) else None
+    if value is None:
+        return None
+    if table.is_integral(section, label):
+        value = int(value)
+    return value, values is not None
+
+
+# Counts the selected counties in equal-width bins of a field's values,
+# from the smallest value to the largest (see quantiles.bin_edges).
+# Counties missing the field are skipped.
+# input: the CountyTable
+# input: the row numbers of the selection
+# input: the section name (for example "Income")
+# input: the field label within the section
+# input: how many bins (at least 1)
+# input: an optional TableIndex of the table
+# output: (the bins' edges, the counts of the bins), or None if no selected
+#         county has the field
+def field_histogram(table: CountyTable, rows, section: str, label: str,
+                    bins: int, index=None):
+    column = _filter_column(table, rows, section, label)
+    if column is None:
+        return None
+    values = _sorted_values(table, rows, column, section, label, index)
+    if values is not None:
+        if not len(values):
+            return None
+        edges = quantiles.bin_edges(values[0], values[-1], bins)
+        return edges, quantiles.count_sorted_bins(edges, values)
+    present = [value for value in _values(column, rows) if value == value]
+    if not present:
+        return None
+    edges = quantiles.bin_edges(min(present), max(present), bins)
+    return edges, quantiles.count_bins(edges, present)
+
+
+# Calculates the total 2014 population of the selected counties
+# input: the CountyTable
+# input: the row numbers to add up
+# output: the total population (an int when the source data held ints)
+def population_total(table: CountyTable, rows):
+    if _is_all(table, rows):
+        total = table.total(column_name(*POPULATION))
+    else:
+        total = _sequential_sum(_values(table.column(*POPULATION), rows))
+    if table.is_integral(*POPULATION):
+        return int(total)
+    return total
+
+
+# Calculates the sub-population for a percentage field of the selected
+# counties; counties missing the field are skipped.
+# input: the CountyTable
+# input: the row numbers to add up
+# input: the section name (for example "Ethnicities")
+# input: the field label within the section
+# output: the total sub-population as a float (0 if nothing matched)
+def population_by_field(table: CountyTable, rows, section: str, label: str):
+    return aggregate_fields(table, rows, [(section, label)])[1][section, label]
+
+
+# Add up the values of a column at the given rows, skipping missing ones.
+def _sum_present(column, rows):
+    values = list(_values(column, rows))
+    present = list(map(operator.eq, values, values))
+    if not all(present):
+        values = compress(values, present)
+    return _sequential_sum(values)
+
+
+# Calculates the sub-population for a field from its percentages and the
+# already gathered 2014 populations of the selected counties, for fields
+# that have no head-count column.
+def _derived_sub_population(table: CountyTable, rows, section: str,
+                            label: str, populations: list):
+    percents = list(_values(table.column(section, label), rows))
+    present = list(map(operator.eq, percents, percents))
+    if not all(present):
+        percents = list(compress(percents, present))
+        populations = compress(populations, present)
+    return _sequential_sum(map(operator.mul,
+                               map(operator.truediv, percents, repeat(100)),
+                               populations))
+
+
+# Calculates a sub-population as a percentage of the total population of
+# the selected counties
+# input: the CountyTable
+# input: the row numbers to add up
+# input: the section name (for example "Education")
+# input: the field label within the section
+# output: the percentage as a float
+def percent_by_field(table: CountyTable, rows, section: str,
+                     label: str) -> float:
+    total_population, sub_populations = aggregate_fields(
+            table, rows, [(section, label)])
+    return percent_of(sub_populations[section, label], total_population)
+
+
+# Calculates the total population and the sub-populations of several
+# percentage fields of the selected counties.  Each sub-population is a
+# plain sum of the field's head-count column; when the rows are the whole
+# table, or are exactly the counties of the given state, every result is
+# read from the table's stored totals instead.
+# input: the CountyTable
+# input: the row numbers to add up
+# input: the fields as a list of (section, label) pairs
+# input: the state whose counties the rows are, if they are exactly that
+#        (as after a single filter-state), or None
+# output: (total population, dictionary mapping each (section, label) pair
+#         to its sub-population)
+def aggregate_fields(table: CountyTable, rows, fields, state=None) -> tuple:
+    stored = state is not None or _is_all(table, rows)
+    if not isinstance(rows, range):
+        rows = list(rows)
+    populations = None
+    if stored:
+        total = table.total(column_name(*POPULATION), state)
+    else:
+        populations = list(_values(table.column(*POPULATION), rows))
+        total = _sequential_sum(populations)
+    if table.is_integral(*POPULATION):
+        total = int(total)
+
+    sub_populations = {}
+    for section, label in fields:
+        if (section, label) in sub_populations:
+            continue
+        name = headcount_name(section, label)
+        if name in table.columns:
+            if stored:
+                sub = table.total(name, state)
+            else:
+                sub = _sum_present(table.columns[name], rows)
+        elif column_name(section, label) in table.columns:
+            if populations is None:
+                populations = list(_values(table.column(*POPULATION), rows))
+            sub = _derived_sub_population(table, rows, section, label,
+                                          populations)
+        else:
+            sub = 0
+        sub_populations[section, label] = sub
+    return total, sub_populations
+
+
+# Turns a sub-population into a percentage of a total population, the same
+# way percent_by_field does.
+# input: the sub-population
+# input: the total population
+# output: the percentage as a float
+def percent_of(sub_population, total_population) -> float:
+    if total_population == 0:
+        return 0.0
+    return sub_population / total_population * 100
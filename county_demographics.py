@@ -109,18 +109,6 @@ class DatasetException(Exception):
     
 _Constants._DATABASE_NAME = _os.path.join(_os.path.dirname(__file__),
                                           "county_demographics.data")
-if not _os.access(_Constants._DATABASE_NAME, _os.F_OK):
-    raise DatasetException(("Error! Could not find a \"{0}\" file. "
-                           "Make sure that there is a \"{0}\" in the "
-                           "same directory as \"{1}.py\"! Spelling is "
-                           "very important here."
-                           ).format(_Constants._DATABASE_NAME, __name__))
-elif not _os.access(_Constants._DATABASE_NAME, _os.R_OK):
-    raise DatasetException(("Error! Could not read the \"{0}\" file. "
-                            "Make sure that it readable by changing its "
-                            "permissions. You may need to get help from "
-                            "your instructor."
-                            ).format(_Constants._DATABASE_NAME, __name__))
 
 
 _Constants._DATASET = None
@@ -130,6 +118,18 @@ def get_report():
     Retrieves all of the report.
     """
     if _Constants._DATASET is None:
+        if not _os.access(_Constants._DATABASE_NAME, _os.F_OK):
+            raise DatasetException(("Error! Could not find a \"{0}\" file. "
+                                   "Make sure that there is a \"{0}\" in the "
+                                   "same directory as \"{1}.py\"! Spelling is "
+                                   "very important here."
+                                   ).format(_Constants._DATABASE_NAME, __name__))
+        elif not _os.access(_Constants._DATABASE_NAME, _os.R_OK):
+            raise DatasetException(("Error! Could not read the \"{0}\" file. "
+                                    "Make sure that it readable by changing its "
+                                    "permissions. You may need to get help from "
+                                    "your instructor."
+                                    ).format(_Constants._DATABASE_NAME, __name__))
         with open(_Constants._DATABASE_NAME, 'rb') as _:
             _Constants._DATASET = _pickle.load(_)
     return _Constants._DATASET
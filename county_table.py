@@ -0,0 +1,457 @@
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from itertools import repeat
+import operator
+import sys
+
+
+# The demographic sections kept for each county, in the order that
+# CountyDemographics takes them.
+SECTIONS = ('Age', 'Education', 'Ethnicities', 'Income', 'Population')
+
+# The sections of the report that CountyDemographics leaves out.  Nested
+# groups of fields are flattened into dotted labels, so the women-owned
+# firms of a county are the "Firms.Women-Owned" field of Employment.
+EXTRA_SECTIONS = ('Employment', 'Housing', 'Miscellaneous', 'Sales')
+
+# The 2014 population column, and the fields that are percentages of it:
+# every field of these sections, and these fields of Income.
+POPULATION = ('Population', '2014 Population')
+PERCENT_SECTIONS = ('Education', 'Ethnicities')
+PERCENT_INCOME = ('Persons Below Poverty Level',)
+
+# The derived section holding, for each percentage field, the absolute
+# number of people it covers (percent / 100 * 2014 population).  Its
+# labels are the dotted names of the percentage fields, so the head counts
+# of "Education.Bachelor's Degree or Higher" are in the column
+# "Headcounts.Education.Bachelor's Degree or Higher".
+HEADCOUNTS = 'Headcounts'
+
+# How many evenly spaced order statistics column_statistics keeps.
+QUANTILES = 32
+
+
+# Given a section name and field label, build the dotted column name used
+# throughout the ops files (for example "Education.High School or Higher").
+# input: section name as a string
+# input: field label as a string
+# output: the dotted column name as a string
+def column_name(section: str, label: str) -> str:
+    return section + '.' + label
+
+
+# Check whether a field is a percentage of the 2014 population.
+# input: section name as a string
+# input: field label as a string
+# output: True if the field is a percentage
+def is_percentage(section: str, label: str) -> bool:
+    return section in PERCENT_SECTIONS or \
+            (section == 'Income' and label in PERCENT_INCOME)
+
+
+# Given a percentage field, build the name of its head-count column.
+# input: section name as a string
+# input: field label as a string
+# output: the dotted column name as a string
+def headcount_name(section: str, label: str) -> str:
+    return column_name(HEADCOUNTS, column_name(section, label))
+
+
+# A read-only dictionary-style view of one section of one county.  Values
+# are read straight out of the table's columns; nothing is copied.
+class SectionView(Mapping):
+    __slots__ = ('_table', '_section', '_row')
+
+    # Initialize a new SectionView.
+    # input: the CountyTable holding the data
+    # input: the section name as a string
+    # input: the row number of the county
+    def __init__(self, table, section: str, row: int):
+        self._table = table
+        self._section = section
+        self._row = row
+
+
+    # Look up a single field of this section.
+    # input: the field label as a string
+    # output: the value, as an int if the source column held ints
+    def __getitem__(self, label: str):
+        value = self._table.value(self._section, label, self._row)
+        if value is None:
+            raise KeyError(label)
+        return value
+
+
+    # Iterate over the field labels that have a value for this county.
+    def __iter__(self):
+        table = self._table
+        for label in table.labels(self._section):
+            if table.value(self._section, label, self._row) is not None:
+                yield label
+
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+    # Match the formatting of the dictionary this view replaces.
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# A lightweight stand-in for a CountyDemographics object that reads its
+# values out of a CountyTable row.
+class CountyRow:
+    __slots__ = ('_table', '_row')
+
+    # Initialize a new CountyRow.
+    # input: the CountyTable holding the data
+    # input: the row number of the county
+    def __init__(self, table, row: int):
+        self._table = table
+        self._row = row
+
+    @property
+    def row(self) -> int:
+        return self._row
+
+    @property
+    def county(self) -> str:
+        return self._table.counties[self._row]
+
+    @property
+    def state(self) -> str:
+        return self._table.states[self._row]
+
+    @property
+    def age(self) -> SectionView:
+        return SectionView(self._table, 'Age', self._row)
+
+    @property
+    def education(self) -> SectionView:
+        return SectionView(self._table, 'Education', self._row)
+
+    @property
+    def ethnicities(self) -> SectionView:
+        return SectionView(self._table, 'Ethnicities', self._row)
+
+    @property
+    def income(self) -> SectionView:
+        return SectionView(self._table, 'Income', self._row)
+
+    @property
+    def population(self) -> SectionView:
+        return SectionView(self._table, 'Population', self._row)
+
+    @property
+    def employment(self) -> SectionView:
+        return SectionView(self._table, 'Employment', self._row)
+
+    @property
+    def housing(self) -> SectionView:
+        return SectionView(self._table, 'Housing', self._row)
+
+    @property
+    def miscellaneous(self) -> SectionView:
+        return SectionView(self._table, 'Miscellaneous', self._row)
+
+    @property
+    def sales(self) -> SectionView:
+        return SectionView(self._table, 'Sales', self._row)
+
+
+    # Provide the same string representation as CountyDemographics.
+    def __repr__(self):
+        return 'CountyDemographics({}, {}, {}, {}, {}, {}, {})'.format(
+                self.age,
+                self.county,
+                self.education,
+                self.ethnicities,
+                self.income,
+                self.population,
+                self.state
+            )
+
+
+# The numeric columns of a CountyTable, keyed by dotted column name.  A
+# section's columns are only built (by the table's loader) the first time
+# one of them is looked up, and the loads are counted so it is possible to
+# see which sections a workload actually touched.
+class LazyColumns(Mapping):
+    # Initialize a new LazyColumns.
+    # input: the field labels of each section, as a dictionary mapping
+    #        section name to a list of labels
+    # input: a function that takes a section name and returns a dictionary
+    #        mapping dotted column name to column, and the set of those
+    #        names whose source values were all ints
+    # input: the set to add the names of integral columns to
+    def __init__(self, sections: dict[str, list[str]], loader, integral: set):
+        self._sections = sections
+        self._loader = loader
+        self._integral = integral
+        self._columns = {}
+        self.loads = Counter()
+
+
+    # Build the columns of a section if they have not been built yet.
+    # input: the section name as a string
+    def load(self, section: str):
+        if section in self._sections and section not in self.loads:
+            columns, integral = self._loader(section)
+            self._columns.update(columns)
+            self._integral.update(integral)
+            self.loads[section] += 1
+
+
+    def __getitem__(self, name: str):
+        column = self._columns.get(name)
+        if column is None:
+            self.load(name.split('.', 1)[0])
+            column = self._columns[name]
+        return column
+
+
+    def __contains__(self, name):
+        section, _, label = name.partition('.')
+        return label in self._sections.get(section, ())
+
+
+    def __iter__(self):
+        for section, labels in self._sections.items():
+            for label in labels:
+                yield column_name(section, label)
+
+
+    def __len__(self):
+        return sum(len(labels) for labels in self._sections.values())
+
+
+# Column-oriented storage of the county demographics data.  Every numeric
+# field is kept as one contiguous array of doubles (missing values are NaN)
+# and the county and state names are kept as lists of interned strings.
+# Indexing the table gives a CountyRow, so code written against a list of
+# CountyDemographics objects keeps working.
+#
+# Sections are materialized lazily: a section's columns are built the first
+# time any of them is needed, and materialized_sections() reports which
+# ones have been.
+class CountyTable:
+    # Initialize a new CountyTable.
+    # input: the county names as a list of strings
+    # input: the state abbreviations as a list of strings
+    # input: the field labels of each section, as a dictionary mapping
+    #        section name to a list of labels in display order
+    # input: a function that takes a section name and returns a dictionary
+    #        mapping dotted column name to a sequence of floats, and the set
+    #        of those names whose source values were all ints
+    def __init__(self,
+                 counties: list[str],
+                 states: list[str],
+                 sections: dict[str, list[str]],
+                 loader):
+        self.counties = counties
+        self.states = states
+        self.sections = sections
+        self.integral = set()
+        self.columns = LazyColumns(sections, loader, self.integral)
+        self.totals = {}
+        self.statistics = {}
+        self._state_counts = None
+
+
+    # Build a table out of county dictionaries shaped like the entries of
+    # county_demographics.get_report() after build_data.convert_county, with
+    # any of the EXTRA_SECTIONS given as flat dictionaries (see
+    # build_data.flatten_section).  Only the field labels are read up front;
+    # the values of a section are copied into columns when the section is
+    # first used.
+    # input: the county dictionaries as a list
+    # output: a new CountyTable
+    @classmethod
+    def from_counties(cls, counties: list[dict]) -> 'CountyTable':
+        sections = {section: [] for section in SECTIONS + EXTRA_SECTIONS}
+        for county in counties:
+            for section in sections:
+                labels = sections[section]
+                for label in county.get(section, ()):
+                    if label not in labels:
+                        labels.append(label)
+        sections[HEADCOUNTS] = [column_name(section, label)
+                                for section in SECTIONS
+                                for label in sections[section]
+                                if is_percentage(section, label)]
+
+        def load_section(section):
+            if section == HEADCOUNTS:
+                return table.build_headcounts(), set()
+            columns = {}
+            integral = set()
+            for label in sections[section]:
+                values = [county.get(section, {}).get(label)
+                          for county in counties]
+                name = column_name(section, label)
+                columns[name] = array('d', [float('nan') if value is None
+                                            else value for value in values])
+                if all(type(value) is int
+                       for value in values if value is not None):
+                    integral.add(name)
+            return columns, integral
+
+        table = cls(
+                [sys.intern(county['County']) for county in counties],
+                [sys.intern(county['State']) for county in counties],
+                sections,
+                load_section
+            )
+        return table
+
+
+    # Compute the head-count columns of the percentage fields from their
+    # percentages and the 2014 population, the same way the sub-population
+    # functions do for each county.  A county missing a percentage has no
+    # head count for it.
+    # input: no input
+    # output: a dictionary mapping head-count column name to column
+    def build_headcounts(self) -> dict:
+        populations = self.column(*POPULATION)
+        columns = {}
+        for name in self.labels(HEADCOUNTS):
+            percents = self.columns[name]
+            columns[column_name(HEADCOUNTS, name)] = array('d', map(
+                    operator.mul,
+                    map(operator.truediv, percents, repeat(100)),
+                    populations))
+        return columns
+
+
+    # Get the total of a column over the whole table or over the counties
+    # of one state, added up left to right in row order starting from the
+    # int 0 (counties missing the value are skipped).  The totals of a
+    # column are computed for every state in one pass the first time they
+    # are asked for, and are stored in compiled table files.
+    # input: the dotted column name
+    # input: a two-letter state abbreviation, or None for the whole table
+    # output: the total as a float (0 if no county has a value)
+    def total(self, name: str, state=None):
+        totals = self.totals.get(name)
+        if totals is None:
+            whole = 0
+            by_state = {}
+            for state_name, value in zip(self.states, self.columns[name]):
+                if value == value:
+                    whole += value
+                    by_state[state_name] = by_state.get(state_name, 0) + value
+            totals = self.totals[name] = (whole, by_state)
+        if state is None:
+            return totals[0]
+        return totals[1].get(state, 0)
+
+
+    # Summarize the values of a column, for estimating how many counties a
+    # comparison on it keeps: how many counties have a value, and
+    # QUANTILES + 1 evenly spaced order statistics of the values (the
+    # smallest first and the largest last).  The statistics are computed
+    # the first time they are asked for, and are stored in compiled table
+    # files.
+    # input: the dotted column name
+    # output: (the number of counties with a value, the order statistics
+    #         as a list of floats, empty if no county has a value)
+    def column_statistics(self, name: str) -> tuple:
+        statistics = self.statistics.get(name)
+        if statistics is None:
+            values = sorted(value for value in self.columns[name]
+                            if value == value)
+            points = []
+            if values:
+                points = [values[(len(values) - 1) * i // QUANTILES]
+                          for i in range(QUANTILES + 1)]
+            statistics = self.statistics[name] = (len(values), points)
+        return statistics
+
+
+    # Count the counties of each state.
+    # input: no input
+    # output: a Counter mapping state abbreviation to number of counties
+    def state_counts(self) -> Counter:
+        if self._state_counts is None:
+            self._state_counts = Counter(self.states)
+        return self._state_counts
+
+
+    # Build every section that has not been built yet.
+    # input: no input
+    # output: None
+    def load_all(self):
+        for section in self.sections:
+            self.columns.load(section)
+
+
+    # Report which sections have been materialized so far.
+    # input: no input
+    # output: a Counter mapping section name to the number of loads
+    def materialized_sections(self) -> Counter:
+        return Counter(self.columns.loads)
+
+
+    # The number of counties in the table.
+    def __len__(self):
+        return len(self.states)
+
+
+    # Get a row view for one county.
+    # input: the row number
+    # output: a CountyRow for that row
+    def __getitem__(self, row: int) -> CountyRow:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('county row out of range')
+        return CountyRow(self, row)
+
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield CountyRow(self, row)
+
+
+    # The field labels of a section, in display order.
+    # input: the section name as a string
+    # output: the labels as a list of strings
+    def labels(self, section: str) -> list[str]:
+        return self.sections.get(section, [])
+
+
+    # Get the column for a section and field label.
+    # input: the section name as a string
+    # input: the field label as a string
+    # output: the column as a sequence of floats
+    def column(self, section: str, label: str):
+        return self.columns[column_name(section, label)]
+
+
+    # Check whether a column held only ints in the source data.
+    # input: the section name as a string
+    # input: the field label as a string
+    # output: True if the column's values should be reported as ints
+    def is_integral(self, section: str, label: str) -> bool:
+        self.columns.load(section)
+        return column_name(section, label) in self.integral
+
+
+    # Read a single value out of the table.
+    # input: the section name as a string
+    # input: the field label as a string
+    # input: the row number
+    # output: the value (an int for integral columns), or None if the
+    #         field is unknown or missing for that county
+    def value(self, section: str, label: str, row: int):
+        name = column_name(section, label)
+        if name not in self.columns:
+            return None
+        value = self.columns[name][row]
+        if value != value:
+            return None
+        if name in self.integral:
+            return int(value)
+        return value
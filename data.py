@@ -1,4 +1,71 @@
+from collections.abc import Mapping
+import sys
+
+# The shared layouts of the sections, keyed by the labels of each section.
+# Counties whose sections have the same labels share one layout, so the
+# label strings and the label-to-offset dictionaries exist only once.
+_layouts = {}
+
+
+# Find (or make) the shared layout for some sections.
+# input: the labels of each section, as a tuple of tuples of strings
+# output: tuple holding, for each section, a dictionary mapping its labels to
+#         their offsets in the county's values
+def _layout(labels: tuple) -> tuple:
+    layout = _layouts.get(labels)
+    if layout is None:
+        offsets = []
+        start = 0
+        for section in labels:
+            offsets.append({sys.intern(label): start + i
+                            for i, label in enumerate(section)})
+            start += len(section)
+        layout = _layouts[labels] = tuple(offsets)
+    return layout
+
+
+# A read-only dictionary-style view of one section of a CountyDemographics
+# object.  Its values are read out of the county's values tuple.
+class SectionValues(Mapping):
+    __slots__ = ('_offsets', '_values')
+
+    # Initialize a new SectionValues.
+    # input: the section's dictionary of labels to offsets
+    # input: the county's values as a tuple
+    def __init__(self, offsets: dict[str,int], values: tuple):
+        self._offsets = offsets
+        self._values = values
+
+
+    # Look up a single field of this section.
+    # input: the field label as a string
+    # output: the value
+    def __getitem__(self, label: str):
+        return self._values[self._offsets[label]]
+
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+    def __contains__(self, label) -> bool:
+        return label in self._offsets
+
+
+    # Match the formatting of the dictionary this view replaces.
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class CountyDemographics:
+    # The values of all five sections are kept in a single tuple, in the
+    # order of a layout shared with every county that has the same labels.
+    __slots__ = ('county', 'state', '_layout', '_values')
+
     # Initialize a new CountyDemographics object.
     # input: the county's age demographics data as a dictionary
     # input: the county's name as a string
@@ -15,13 +82,32 @@ class CountyDemographics:
                   income: dict[str,float],
                   population: dict[str,float],
                   state: str):
-        self.age = age
+        sections = (age, education, ethnicities, income, population)
         self.county = county
-        self.education = education
-        self.ethnicities = ethnicities
-        self.income = income
-        self.population = population
         self.state = state
+        self._layout = _layout(tuple(tuple(section) for section in sections))
+        self._values = tuple(value for section in sections
+                             for value in section.values())
+
+    @property
+    def age(self) -> SectionValues:
+        return SectionValues(self._layout[0], self._values)
+
+    @property
+    def education(self) -> SectionValues:
+        return SectionValues(self._layout[1], self._values)
+
+    @property
+    def ethnicities(self) -> SectionValues:
+        return SectionValues(self._layout[2], self._values)
+
+    @property
+    def income(self) -> SectionValues:
+        return SectionValues(self._layout[3], self._values)
+
+    @property
+    def population(self) -> SectionValues:
+        return SectionValues(self._layout[4], self._values)
 
 
     # Provide a developer-friendly string representation of the object.
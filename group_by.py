@@ -0,0 +1,93 @@
+from array import array
+from typing import NamedTuple
+
+import column_engine
+from county_table import CountyTable, POPULATION
+
+# Hash aggregation of counties into groups, for the group-by operation.
+# One pass over the counties sorts them into a dictionary of groups keyed
+# by state, and the population and sub-populations of every group are
+# added up in the same row order a filter-state followed by the same
+# aggregates would use, so the numbers match that exactly.
+#
+# aggregate_table works on a CountyTable: the pass only collects each
+# group's row numbers, and the sums are then taken over whole columns with
+# column_engine.aggregate_fields (from the table's stored per-state totals
+# when the groups are whole states).  aggregate_objects does the same in a
+# single loop over a list of county objects.
+
+# The keys counties can be grouped by.
+GROUP_KEYS = ('State',)
+
+
+# The aggregates of one group of counties.
+class Group(NamedTuple):
+    counties: int
+    population: object
+    sub_populations: dict
+
+
+# Check that counties can be grouped by a key.
+# input: the key as a string
+# output: None; raises ValueError for an unsupported key
+def check_key(key: str):
+    if key not in GROUP_KEYS:
+        raise ValueError(f"cannot group by {key}; the supported keys are "
+                         f"{', '.join(GROUP_KEYS)}")
+
+
+# Group the selected counties of a table by state and aggregate each group.
+# input: the CountyTable
+# input: the row numbers of the selected counties, in table order
+# input: the percentage fields as a list of (section, label) pairs
+# input: an optional table_index.TableIndex of the table
+# output: dictionary mapping each state to its Group, in order of first
+#         appearance
+def aggregate_table(table: CountyTable, rows, fields,
+                    index=None) -> dict[str, Group]:
+    whole = isinstance(rows, range) and rows == range(len(table))
+    if whole and index is not None:
+        members = index.states
+    else:
+        members = {}
+        states = table.states
+        for row in rows:
+            state = states[row]
+            group = members.get(state)
+            if group is None:
+                group = members[state] = array('l')
+            group.append(row)
+
+    groups = {}
+    for state, group in members.items():
+        total, sub_populations = column_engine.aggregate_fields(
+                table, group, fields, state if whole else None)
+        groups[state] = Group(len(group), total, sub_populations)
+    return groups
+
+
+# Group county objects by state and aggregate each group in a single pass.
+# Counties missing a field are skipped for that field.
+# input: the counties as a list of CountyDemographics-like objects
+# input: the percentage fields as a list of (section, label) pairs
+# output: dictionary mapping each state to its Group, in order of first
+#         appearance
+def aggregate_objects(counties, fields) -> dict[str, Group]:
+    fields = list(dict.fromkeys(fields))
+    totals = {}
+    for county in counties:
+        group = totals.get(county.state)
+        if group is None:
+            group = totals[county.state] = [0, 0, [0] * len(fields)]
+        population = county.population[POPULATION[1]]
+        group[0] += 1
+        group[1] += population
+        sub_populations = group[2]
+        for i, (section, label) in enumerate(fields):
+            values = getattr(county, section.lower(), None)
+            if values is not None and label in values:
+                sub_populations[i] += values[label] / 100 * population
+    return {state: Group(counties, population,
+                         dict(zip(fields, sub_populations)))
+            for state, (counties, population, sub_populations)
+            in totals.items()}
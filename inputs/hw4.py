@@ -1,7 +1,16 @@
 import data
 import county_demographics
 import build_data
+import group_by
+import heapq
+import ops_plan
+import os
+import output_writers
+import predicates
+import quantiles
+import query_cache
 import sys
+import tracing
 
 # The following 5 sets of functions are copied from programming assignment 3:
 
@@ -142,9 +151,90 @@ def below_poverty_level_less_than(target_counties: list[county_demographics], po
     return filtered_counties
 
 
-full_data = build_data.get_data()
+# The same functions for any field of the generic sections (see
+# ops_plan.GENERIC_SECTIONS), such as "Age.Percent 65 and Older" or
+# "Employment.Firms.Women-Owned".  Counties without a value for the field
+# are skipped, the way the columnar engine skips them.
+
+# Function to read one field of a county.
+# Parameters:
+# county: A county_demographics object
+# section: The section name (for example "Employment")
+# label: The field label within the section
+# Returns: The value, or None if the county has no value for the field
+def field_value(county, section: str, label: str):
+    values = getattr(county, section.lower(), None)
+    value = None if values is None else values.get(label)
+    if value is None or value != value:
+        return None
+    return value
+
+# Function to check that a filter's field exists, the way the columnar engine
+# does: filtering a non-empty list on a field no county has is a KeyError.
+# Parameters:
+# target_counties: A list of county_demographics objects
+# section: The section name
+# label: The field label within the section
+# Returns: None
+def check_field(target_counties: list[county_demographics], section: str, label: str):
+    if target_counties and all(field_value(county, section, label) is None for county in target_counties):
+        raise KeyError(label)
+
+def field_greater_than(target_counties: list[county_demographics], section: str, label: str, threshold: float) -> list[county_demographics]:
+    check_field(target_counties, section, label)
+    filtered_counties = []
+    for county in target_counties:
+        value = field_value(county, section, label)
+        if value is not None and value > threshold:
+            filtered_counties.append(county)
+    return filtered_counties
+
+def field_less_than(target_counties: list[county_demographics], section: str, label: str, threshold: float) -> list[county_demographics]:
+    check_field(target_counties, section, label)
+    filtered_counties = []
+    for county in target_counties:
+        value = field_value(county, section, label)
+        if value is not None and value < threshold:
+            filtered_counties.append(county)
+    return filtered_counties
+
+def population_by_field(target_counties: list[county_demographics], section: str, label: str) -> float:
+    population_number = 0
+    for county in target_counties:
+        value = field_value(county, section, label)
+        if value is not None:
+            population_number += (value / 100 * county.population['2014 Population'])
+    return population_number
+
+def percent_by_field(target_counties: list[county_demographics], section: str, label: str) -> float:
+    total_population = population_total(target_counties)
+    field_population = population_by_field(target_counties, section, label)
+    if total_population == 0:
+        return 0.0
+    return field_population / total_population * 100
+
+
+# Timing and allocation tracing of the run (see tracing): set HW4_TRACE=1 to
+# print a summary table to stderr, HW4_TRACE_FILE to write a Chrome trace
+# and HW4_TRACE_MEMORY=1 to record allocations too. TRACER is None when
+# tracing is off; main sets it up, so importing this module does no work.
+TRACER = None
+
+# Function to get the county data, loading it the first time it is needed.
+# Parameters:
+#None
+# Returns: The counties as a CountyTable
+def get_full_data():
+    return build_data.get_data(TRACER)
+
+# The counties are also available as hw4.full_data, loaded when first used.
+def __getattr__(name):
+    if name == "full_data":
+        return get_full_data()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Function to get the file name from command-line arguments.
+# A file name of "-" means the operations are read from standard input.
 # Parameters:
 #None
 # Returns: The name of the file provided as a command-line argument (data type str).
@@ -153,6 +243,8 @@ def get_file_name() -> str:
         print("Please provide one file name")
         sys.exit()
     filename = sys.argv[1]
+    if filename == "-":
+        return filename
 
     try:
         with open(filename, 'r'):
@@ -161,52 +253,8 @@ def get_file_name() -> str:
         print("Please provide a valid file name")
         sys.exit()
 
-    print(f"{len(full_data)} counties loaded")
     return filename
 
-# Function to count the number of colons in a given input string
-# Parameters:
-# input_line: The string which colons are to be counted
-# Returns: The count of colons in the string
-def count_colons(input_line: str) -> int:
-    count = 0
-    for char in input_line:
-        if char == ":":
-            count += 1
-    return count
-
-# Function to read and validate lines from an operations file
-# Parameters:
-#filename: The name of the file to read operations from
-# Returns: A list of valid operation lines
-def read_file_lines(filename: str) -> list:
-    valid_ops = ["display","filter-state","filter-gt","filter-lt","population-total","population","percent"]
-    ops_colon_nums = {"display": 0,"filter-state": 1,"filter-gt": 2,"filter-lt": 2,"population-total": 0,"population": 1,"percent": 1}
-    line_num = 1
-    valid_lines = []
-
-    with open(filename, 'r') as file:
-        for line in file:
-            line = line.strip()
-
-            if not line:
-                line_num += 1
-                continue
-            line_split = line.split(":")
-            line_operation = line_split[0]
-            if line_operation in valid_ops:
-                if len(line_split) - 1 == ops_colon_nums[line_operation]:
-                    valid_lines.append(line)
-                else:
-                    print(f"There is an error on line {line_num}, {count_colons(line)} is an incorrect number of colons for {line_operation}")
-                    continue
-            else:
-                print(f"There is an error on line {line_num}: {line_operation} is an invalid operation")
-
-            line_num += 1
-
-    return valid_lines
-
 # Function to display information for a list of counties.
 # Parameters:
 # list_counties: A list of county_demographics objects to display
@@ -220,16 +268,205 @@ def display(list_counties: list[county_demographics]):
         print(f"    Population: {county.population}")
         print()
 
+# Function to select the counties with the largest or smallest values of a field.
+# Parameters:
+# target_counties: A list of county_demographics objects to select from
+# field: The dotted field to rank the counties by (for example "Income.Persons Below Poverty Level")
+# k: How many counties to select
+# largest: True for the largest values, False for the smallest
+# Returns: The selected counties, largest (or smallest) value first; counties without a value are skipped
+def rank_counties(target_counties: list[county_demographics], field: str, k: int, largest: bool) -> list[county_demographics]:
+    section, label = ops_plan.split_field(field)
+    check_field(target_counties, section, label)
+    ranked = [county for county in target_counties if field_value(county, section, label) is not None]
+    select = heapq.nlargest if largest else heapq.nsmallest
+    return select(k, ranked, key=lambda county: field_value(county, section, label))
+
+# Function to select the counties that pass a filter expression (see predicates).
+# Parameters:
+# target_counties: A list of county_demographics objects to filter
+# expression: The expression of a filter-between or filter line
+# Returns: The counties the expression keeps, in their original order; counties without a value fail its comparisons
+def filter_by_expression(target_counties: list[county_demographics], expression) -> list[county_demographics]:
+    for comparison in predicates.comparisons(expression):
+        check_field(target_counties, comparison.section, comparison.label)
+    return list(filter(predicates.object_predicate(expression), target_counties))
+
+# Function to get the values of a field that a list of counties have.
+# Parameters:
+# target_counties: A list of county_demographics objects
+# field: The dotted field (for example "Income.Per Capita Income")
+# Returns: The values, in the order of the counties; counties without a value are skipped
+def field_values(target_counties: list[county_demographics], field: str) -> list:
+    section, label = ops_plan.split_field(field)
+    check_field(target_counties, section, label)
+    values = [field_value(county, section, label) for county in target_counties]
+    return [value for value in values if value is not None]
+
+# Function to find a quantile of a field (see quantiles).
+# Parameters:
+# target_counties: A list of county_demographics objects
+# field: The dotted field
+# q: The quantile, from 0 to 1
+# whole: True if the list holds every county, to find the exact quantile
+# Returns: The value and whether it is exact (only very large lists are estimated), or None if no county has the field
+def field_quantile(target_counties: list[county_demographics], field: str, q: float, whole: bool):
+    values = field_values(target_counties, field)
+    if not values:
+        return None
+    if whole or len(target_counties) <= quantiles.EXACT_COUNTIES:
+        return quantiles.sorted_quantile(sorted(values), q), True
+    sketch = quantiles.KllSketch()
+    sketch.extend(values)
+    return sketch.quantile(q), False
+
+# Function to count the counties in equal-width bins of a field's values.
+# Parameters:
+# target_counties: A list of county_demographics objects
+# field: The dotted field
+# bins: How many bins
+# Returns: The bins' edges and their counts, or None if no county has the field
+def field_histogram(target_counties: list[county_demographics], field: str, bins: int):
+    values = field_values(target_counties, field)
+    if not values:
+        return None
+    edges = quantiles.bin_edges(min(values), max(values), bins)
+    return edges, quantiles.count_bins(edges, values)
+
+# Function to print the aggregates of each group of counties as a table.
+# Parameters:
+# target_counties: A list of county_demographics objects to group
+# key: What to group the counties by (see group_by.GROUP_KEYS)
+# aggregate_lines: The population-total, population and percent lines to compute per group
+# Returns: None
+def display_groups(target_counties: list[county_demographics], key: str, aggregate_lines: list):
+    aggregates = [ops_plan.compile_line(line) for line in aggregate_lines]
+    fields = [(node.section, node.label) for node in aggregates
+              if not isinstance(node, ops_plan.PopulationTotal) and ops_plan.is_supported(node.section, node.label)]
+    groups = group_by.aggregate_objects(target_counties, fields)
+    for line in ops_plan.format_groups(key, groups, aggregates):
+        print(line)
+
+# Which implementation execute_operations uses by default: "columnar" compiles
+# the lines into a plan and runs it over the table's columns (see ops_plan),
+# "objects" runs the functions above on county objects one line at a time.
+# Set HW4_ENGINE to choose.
+ENGINES = ("columnar", "objects")
+ENGINE = os.environ.get("HW4_ENGINE", "columnar")
+
+# Function to check the name of an engine.
+# Parameters:
+# engine: The name to check
+# Returns: None; raises ValueError if it is not one of ENGINES
+def check_engine(engine: str):
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}; choose from {', '.join(ENGINES)}")
+
+# Filter and aggregate results reused between the scripts run in this
+# process. If HW4_CACHE_FILE is set, main loads the cache from that file
+# before running and saves it afterwards.
+QUERY_CACHE = query_cache.QueryCache()
+CACHE_FILE = os.environ.get("HW4_CACHE_FILE")
+
+# The output format of the columnar engine: "text" (the default), "jsonl",
+# "csv" or "binary" (see output_writers). Set HW4_FORMAT to choose.
+OUTPUT_FORMAT = os.environ.get("HW4_FORMAT", "text")
+
+# Approximate mode for the columnar engine: populations, percentages and
+# filter counts are estimated from a population-weighted sample of the
+# counties, stratified by state, and printed with a confidence interval
+# (see sampling). Set HW4_APPROXIMATE=1 to turn it on, HW4_SAMPLE_SIZE and
+# HW4_SAMPLE_SEED to choose the sample (the same size and seed always give
+# the same answers) and HW4_CONFIDENCE for the intervals. Run without it
+# for the exact answers. The numbers are read from the environment by main
+# (see read_number_settings), so a bad value does not break importing.
+APPROXIMATE = os.environ.get("HW4_APPROXIMATE", "") not in ("", "0")
+SAMPLE_SIZE = 1000
+SAMPLE_SEED = 0
+CONFIDENCE = 0.95
+
+# Parallel execution for the columnar engine: set HW4_WORKERS to split the
+# table into that many shards, each filtered by a worker process of its
+# own (see parallel), and HW4_SHARD_BY to "state" to keep runs of counties
+# of one state in the same shard. The output is the same as with one
+# process. It is not used in approximate mode.
+WORKERS = 0
+SHARD_BY = os.environ.get("HW4_SHARD_BY", "rows")
+
+# Function to read a number setting from the environment.
+# Parameters:
+# variable: The name of the environment variable
+# kind: The type of the number, int or float
+# default: The value to use if the variable is not set
+# Returns: The value; raises ValueError (naming the variable) if it is not a valid number
+def number_setting(variable: str, kind, default):
+    value = os.environ.get(variable)
+    if value is None:
+        return default
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"{variable}: {value!r} is not a valid {kind.__name__}") from None
+
+# Function to read the number settings of approximate mode and parallel execution from the environment.
+# Parameters:
+#None
+# Returns: None; raises ValueError if one of them is not a valid number
+def read_number_settings():
+    global SAMPLE_SIZE, SAMPLE_SEED, CONFIDENCE, WORKERS
+    SAMPLE_SIZE = number_setting("HW4_SAMPLE_SIZE", int, SAMPLE_SIZE)
+    SAMPLE_SEED = number_setting("HW4_SAMPLE_SEED", int, SAMPLE_SEED)
+    CONFIDENCE = number_setting("HW4_CONFIDENCE", float, CONFIDENCE)
+    WORKERS = number_setting("HW4_WORKERS", int, WORKERS)
+
 # Function to execute a series of operations based on a list of valid lines.
 # Parameters:
-# valid_lines: A list of validated operations to process
+# valid_lines: The validated operations to process (a list, or a generator
+# such as ops_plan.validate_lines to run them as they are read)
+# engine: "columnar" or "objects" (defaults to ENGINE)
+# out: Where the columnar engine writes its output: an output_writers writer
+# or a stream (defaults to sys.stdout); the objects engine prints its own
+# output and flushes out before every line, so that whatever valid_lines
+# wrote to it comes first
 # Returns: A filtered dataset after applying all operations
-def execute_operations(valid_lines):
+def execute_operations(valid_lines, engine=None, out=None):
+    engine = engine or ENGINE
+    check_engine(engine)
+    full_data = get_full_data()
+    if engine == "columnar":
+        nodes = tracing.iterate(TRACER, map(ops_plan.compile_line, valid_lines),
+                                "read line", "parse")
+        sample = build_data.get_sample(SAMPLE_SIZE, SAMPLE_SEED) if APPROXIMATE else None
+        index = build_data.get_index(TRACER)
+        shards = None
+        if WORKERS > 1 and sample is None:
+            import parallel
+            if parallel.ShardPool.available():
+                shards = parallel.ShardPool(full_data, WORKERS, index, SHARD_BY)
+        try:
+            rows = ops_plan.run_plan(ops_plan.plan_stream(nodes), full_data, out,
+                                     index, QUERY_CACHE, flush=True, sample=sample,
+                                     confidence=CONFIDENCE, tracer=TRACER,
+                                     shards=shards)
+        finally:
+            if shards is not None:
+                shards.close()
+        return [full_data[row] for row in rows]
     filtered_data = full_data
+    grouping = None
 
     for line in valid_lines:
+        if out is not None:
+            out.flush()
         lines_split = line.split(":")
         operation = lines_split[0]
+        # A group-by collects the aggregate lines after it into one table.
+        if grouping is not None:
+            if operation in ("population-total", "population", "percent"):
+                grouping[1].append(line)
+                continue
+            display_groups(filtered_data, *grouping)
+            grouping = None
         try:
             if operation == "filter-state":
                 state = lines_split[1]
@@ -248,6 +485,8 @@ def execute_operations(valid_lines):
                 elif field_parts[0] == "Income":
                     if field_label == "Persons Below Poverty Level":
                         filtered_data = below_poverty_level_greater_than(filtered_data, value)
+                elif ops_plan.is_supported(*ops_plan.split_field(field)):
+                    filtered_data = field_greater_than(filtered_data, *ops_plan.split_field(field), value)
                 print(f"Filter: {field} gt {value} ({len(filtered_data)} entries)")
             elif operation == "filter-lt":
                 field = lines_split[1]
@@ -262,6 +501,8 @@ def execute_operations(valid_lines):
                 elif field_parts[0] == "Income":
                     if field_label == "Persons Below Poverty Level":
                         filtered_data = below_poverty_level_less_than(filtered_data, value)
+                elif ops_plan.is_supported(*ops_plan.split_field(field)):
+                    filtered_data = field_less_than(filtered_data, *ops_plan.split_field(field), value)
                 print(f"Filter: {field} gt {value} ({len(filtered_data)} entries)")
             elif operation == "population":
                   field = lines_split[1]
@@ -278,6 +519,8 @@ def execute_operations(valid_lines):
                       sub_population = population_by_ethnicity(filtered_data, field_label)
                   elif category == "Income" and field_label == "Persons Below Poverty Level":
                           sub_population = population_below_poverty_level(filtered_data)
+                  elif ops_plan.is_supported(*ops_plan.split_field(field)):
+                      sub_population = population_by_field(filtered_data, *ops_plan.split_field(field))
                   else:
                       sub_population = 0
                   print(f"2014 {field} population: {sub_population}")
@@ -294,22 +537,102 @@ def execute_operations(valid_lines):
                     percentage = percent_by_ethnicity(filtered_data, field_label)
                 elif "Income" in field and field_label == "Persons Below Poverty Level":
                     percentage = percent_below_poverty_line(filtered_data)
+                elif ops_plan.is_supported(*ops_plan.split_field(field)):
+                    percentage = percent_by_field(filtered_data, *ops_plan.split_field(field))
                 else:
                     percentage = 0.0
                 print(f"2014 {field} percentage: {percentage}")
             elif operation == "display":
                 display(filtered_data)
+            elif operation == "top" or operation == "bottom":
+                field = lines_split[1]
+                k = int(lines_split[2])
+                if k < 0:
+                    raise ValueError(f"cannot select {k} counties")
+                filtered_data = rank_counties(filtered_data, field, k, operation == "top")
+                print(f"Filter: {operation} {k} by {field} ({len(filtered_data)} entries)")
+            elif operation == "filter-between" or operation == "filter":
+                node = ops_plan.compile_line(line)
+                if isinstance(node, ops_plan.Invalid):
+                    raise node.error
+                filtered_data = filter_by_expression(filtered_data, node.expression)
+                print(f"Filter: {node.description} ({len(filtered_data)} entries)")
+            elif operation in ("quantile", "median", "histogram"):
+                node = ops_plan.compile_line(line)
+                if isinstance(node, ops_plan.Invalid):
+                    raise node.error
+                if isinstance(node, ops_plan.Quantile):
+                    value = field_quantile(filtered_data, node.field, node.q, len(filtered_data) == len(full_data))
+                else:
+                    value = field_histogram(filtered_data, node.field, node.bins)
+                if value is None:
+                    raise ValueError(f"no counties have a value for {node.field}")
+                if isinstance(node, ops_plan.Quantile):
+                    print(f"{node.field} {node.name}: {ops_plan.format_quantile(*value)}")
+                else:
+                    for histogram_line in ops_plan.format_histogram(node.field, *value):
+                        print(histogram_line)
+            elif operation == "group-by":
+                group_by.check_key(lines_split[1])
+                grouping = (lines_split[1], [])
             else:
                 print(f"The operation you provided ({operation}) is not supported")
 
         except Exception as e:
             print(f"There was an error when processing the {line} line. Here are the details: {e}")
 
+    if out is not None:
+        out.flush()
+    if grouping is not None:
+        display_groups(filtered_data, *grouping)
     return filtered_data
 
 def main():
+    global TRACER
+    TRACER = tracing.from_environment()
     filename = get_file_name()
-    valid_lines = read_file_lines(filename)
-    execute_operations(valid_lines)
-
-main()
\ No newline at end of file
+    try:
+        check_engine(ENGINE)
+    except ValueError as e:
+        print(f"Please provide a valid HW4_ENGINE: {e}")
+        sys.exit(1)
+    out = None
+    if ENGINE == "columnar":
+        try:
+            out = output_writers.make_writer(OUTPUT_FORMAT)
+        except ValueError as e:
+            print(f"Please provide a valid HW4_FORMAT: {e}")
+            sys.exit(1)
+    try:
+        read_number_settings()
+    except ValueError as e:
+        print(f"Please provide a valid {e}")
+        sys.exit(1)
+    if CACHE_FILE:
+        if TRACER is None:
+            QUERY_CACHE.load(CACHE_FILE, build_data.data_stamp())
+        else:
+            with TRACER.span("load query cache", "phase"):
+                QUERY_CACHE.load(CACHE_FILE, build_data.data_stamp())
+    # The columnar engine validates and executes the lines as they are read,
+    # so output starts before a long script has been read in full.
+    file = sys.stdin if filename == "-" else open(filename, 'r')
+    try:
+        if ENGINE == "columnar":
+            print(f"{len(get_full_data())} counties loaded", file=out)
+            execute_operations(ops_plan.validate_lines(file, out), out=out)
+        else:
+            print(f"{len(get_full_data())} counties loaded")
+            valid_lines = list(tracing.iterate(TRACER, ops_plan.validate_lines(file),
+                                               "read line", "parse"))
+            execute_operations(valid_lines)
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    if CACHE_FILE:
+        QUERY_CACHE.save(CACHE_FILE, build_data.data_stamp())
+    if TRACER is not None:
+        tracing.report(TRACER)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
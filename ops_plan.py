@@ -0,0 +1,1055 @@
+import sys
+import time
+from typing import NamedTuple
+
+import column_engine
+import county_table
+import group_by
+import output_writers
+import predicates
+import sampling
+import tracing
+from county_table import CountyTable
+
+# Compiles the lines of an .ops file into typed operation nodes, groups the
+# nodes into a plan, and runs the plan against a CountyTable.
+#
+# The planner makes two kinds of groups:
+#   FilterRun     consecutive filter lines.  They are evaluated back to
+#                 back on lists of row numbers, and a filter that is
+#                 implied by an earlier one in the run (the same state
+#                 again, or a looser threshold on the same field) is not
+#                 evaluated at all.  Filters are not reordered: every
+#                 filter prints the number of entries left after it, so
+#                 each one has to see exactly the rows that passed the
+#                 lines before it.  With a TableIndex, each filter is
+#                 answered from the index when that is cheaper than a scan.
+#                 top and bottom lines are filters too: they keep the k
+#                 counties with the largest or smallest values of a field,
+#                 in that order, so a display after them shows the ranking.
+#                 filter-between and filter lines are compiled into a
+#                 predicates expression, which is evaluated in one fused
+#                 pass with its tests in the cheapest order (see
+#                 predicates and column_engine.filter_expression).
+#   AggregateRun  consecutive population-total/population/percent lines.
+#                 They read the same set of counties, so all of their
+#                 fields are computed together with
+#                 column_engine.aggregate_fields in one shared scan.
+#   GroupRun      a group-by line and the aggregate lines right after it.
+#                 The counties are split into groups in one hash pass
+#                 (see group_by) and the aggregates are printed as a
+#                 table with a row per group.
+# quantile, median and histogram lines run on their own, over the counties
+# selected so far.  They are exact, except for the quantiles of very large
+# selections, which are estimated with a bounded memory sketch and printed
+# with a "~" like the estimates of approximate mode (see quantiles).
+#
+# The output is the same, line for line, as hw4.execute_operations, for
+# every operation on the fields hw4 supports.
+#
+# In approximate mode (run_plan with a sampling.StratifiedSample) the
+# filters only look at the sampled counties, the counts they print and
+# every population and percent are estimates with a confidence interval,
+# and display shows the sampled counties.  Rankings and group-by need every
+# county and are reported as errors.  Running without the sample gives the
+# exact answers.
+#
+# With a parallel.ShardPool, run_plan evaluates the filters on every shard
+# of the table at once, in the pool's worker processes, and merges the
+# results into the same output (see parallel).
+
+
+# Sections the filter and aggregate operations support, and the fields of
+# Income that may be used.
+SUPPORTED_SECTIONS = county_table.PERCENT_SECTIONS
+SUPPORTED_INCOME = county_table.PERCENT_INCOME
+
+# Sections whose fields are generic: a field's path is split at the first
+# "." only (so "Employment.Firms.Women-Owned" is the "Firms.Women-Owned"
+# field of Employment), any field can be filtered on, and population and
+# percent treat the field as a percentage of the 2014 population, the way
+# hw4 treats the fields it supports.
+GENERIC_SECTIONS = ("Age", "Population") + county_table.EXTRA_SECTIONS
+
+
+class FilterState(NamedTuple):
+    line: str
+    state: str
+
+
+class FilterCompare(NamedTuple):
+    line: str
+    field: str
+    section: str
+    label: str
+    greater: bool
+    value: float
+
+
+# A filter-between or filter line: description is what its message prints.
+class FilterExpression(NamedTuple):
+    line: str
+    description: str
+    expression: object
+
+
+class Rank(NamedTuple):
+    line: str
+    field: str
+    section: str
+    label: str
+    largest: bool
+    k: int
+
+
+class PopulationTotal(NamedTuple):
+    line: str
+
+
+class Population(NamedTuple):
+    line: str
+    field: str
+    section: str
+    label: str
+
+
+class Percent(NamedTuple):
+    line: str
+    field: str
+    section: str
+    label: str
+
+
+# A quantile or median line: name is what its message calls the value.
+class Quantile(NamedTuple):
+    line: str
+    field: str
+    section: str
+    label: str
+    q: float
+    name: str
+
+
+class Histogram(NamedTuple):
+    line: str
+    field: str
+    section: str
+    label: str
+    bins: int
+
+
+class Display(NamedTuple):
+    line: str
+
+
+class GroupBy(NamedTuple):
+    line: str
+    key: str
+
+
+# A line that failed to compile; running it reports the error.
+class Invalid(NamedTuple):
+    line: str
+    error: Exception
+
+
+class Unsupported(NamedTuple):
+    line: str
+    operation: str
+
+
+FILTERS = (FilterState, FilterCompare, FilterExpression, Rank)
+AGGREGATES = (PopulationTotal, Population, Percent)
+
+
+class FilterRun(NamedTuple):
+    filters: list
+
+
+class AggregateRun(NamedTuple):
+    aggregates: list
+
+
+class GroupRun(NamedTuple):
+    group: GroupBy
+    aggregates: list
+
+
+# The operations an .ops file may use, and the number of colons each
+# takes.
+OPS_COLON_NUMS = {"display": 0, "filter-state": 1, "filter-gt": 2,
+                  "filter-lt": 2, "population-total": 0, "population": 1,
+                  "percent": 1, "group-by": 1, "top": 2, "bottom": 2,
+                  "filter-between": 3, "filter": 1, "quantile": 2,
+                  "median": 1, "histogram": 2}
+
+
+# Validate the lines of an .ops file, reporting bad lines with hw4.py's
+# messages as they are reached.
+# input: the lines (an open file or any iterable of strings)
+# input: the stream to report errors to (defaults to sys.stdout)
+# output: a generator of the valid lines, stripped
+def validate_lines(lines, out=None):
+    out = out or sys.stdout
+    line_num = 1
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            line_num += 1
+            continue
+        line_split = line.split(":")
+        line_operation = line_split[0]
+        if line_operation in OPS_COLON_NUMS:
+            if len(line_split) - 1 == OPS_COLON_NUMS[line_operation]:
+                yield line
+            else:
+                print(f"There is an error on line {line_num}, "
+                      f"{line.count(':')} is an incorrect number of colons "
+                      f"for {line_operation}", file=out)
+                continue
+        else:
+            print(f"There is an error on line {line_num}: {line_operation} "
+                  f"is an invalid operation", file=out)
+
+        line_num += 1
+
+
+# Split a dotted field into its section and label, the same way hw4 does
+# for its own sections and at the first "." for generic ones.
+# input: the field as a string (for example "Education.High School or Higher")
+# output: (section, label)
+def split_field(field: str) -> tuple[str, str]:
+    section, _, label = field.partition(".")
+    if section in GENERIC_SECTIONS:
+        return section, label
+    field_parts = field.split(".")
+    field_label = field_parts[1] if len(field_parts) > 1 else field_parts[0]
+    return field_parts[0], field_label
+
+
+# Check whether filters and aggregates can use a field.
+# input: the section name as a string
+# input: the field label as a string
+# output: True if the field is supported
+def is_supported(section: str, label: str) -> bool:
+    return section in SUPPORTED_SECTIONS or section in GENERIC_SECTIONS or \
+            (section == "Income" and label in SUPPORTED_INCOME)
+
+
+# Check that every field an expression compares can be filtered on.
+# input: the predicates expression
+# output: the expression; raises ValueError for an unsupported field
+def check_expression(expression):
+    for comparison in predicates.comparisons(expression):
+        if not is_supported(comparison.section, comparison.label):
+            raise ValueError(f"{comparison.field} cannot be filtered on")
+    return expression
+
+
+# Compile one validated line of an .ops file into an operation node.
+# input: the line as a string
+# output: the operation node
+def compile_line(line: str):
+    lines_split = line.split(":")
+    operation = lines_split[0]
+    try:
+        if operation == "filter-state":
+            return FilterState(line, lines_split[1])
+        elif operation == "filter-gt" or operation == "filter-lt":
+            field = lines_split[1]
+            value = float(lines_split[2])
+            return FilterCompare(line, field, *split_field(field),
+                                 operation == "filter-gt", value)
+        elif operation == "filter-between":
+            field = lines_split[1]
+            low = float(lines_split[2])
+            high = float(lines_split[3])
+            expression = predicates.between(field, *split_field(field), low,
+                                            high)
+            return FilterExpression(line, f"{field} between {low} and {high}",
+                                    check_expression(expression))
+        elif operation == "filter":
+            expression = predicates.parse(lines_split[1], split_field)
+            return FilterExpression(line, lines_split[1].strip(),
+                                    check_expression(expression))
+        elif operation == "top" or operation == "bottom":
+            field = lines_split[1]
+            k = int(lines_split[2])
+            if k < 0:
+                raise ValueError(f"cannot select {k} counties")
+            return Rank(line, field, *split_field(field), operation == "top",
+                        k)
+        elif operation == "population-total":
+            return PopulationTotal(line)
+        elif operation == "population":
+            return Population(line, lines_split[1],
+                              *split_field(lines_split[1]))
+        elif operation == "percent":
+            return Percent(line, lines_split[1], *split_field(lines_split[1]))
+        elif operation == "quantile":
+            field = lines_split[1]
+            q = float(lines_split[2])
+            if not 0 <= q <= 1:
+                raise ValueError(f"{q} is not a quantile from 0 to 1")
+            return Quantile(line, field, *split_field(field), q,
+                            f"quantile {q}")
+        elif operation == "median":
+            field = lines_split[1]
+            return Quantile(line, field, *split_field(field), 0.5, "median")
+        elif operation == "histogram":
+            field = lines_split[1]
+            bins = int(lines_split[2])
+            if bins < 1:
+                raise ValueError(f"cannot make {bins} bins")
+            return Histogram(line, field, *split_field(field), bins)
+        elif operation == "display":
+            return Display(line)
+        elif operation == "group-by":
+            group_by.check_key(lines_split[1])
+            return GroupBy(line, lines_split[1])
+        return Unsupported(line, operation)
+    except Exception as e:
+        return Invalid(line, e)
+
+
+# Compile the validated lines of an .ops file.
+# input: the lines as a list of strings
+# output: the operation nodes as a list
+def compile_ops(valid_lines) -> list:
+    return [compile_line(line) for line in valid_lines]
+
+
+# The most operations a single filter or aggregate run may hold, so that a
+# streamed script never has to buffer an unbounded number of lines.
+MAX_RUN = 1024
+
+
+# Group a stream of operation nodes into plan steps: filter runs,
+# aggregate runs, group runs and single operations.  Each step is produced
+# as soon as the node after it shows that it is complete, so a streamed
+# script starts running before it has all been read.
+# input: an iterable of operation nodes
+# output: a generator of plan steps
+def plan_stream(nodes):
+    run = None
+    for node in nodes:
+        kind = _run_kind(node)
+        if isinstance(node, GroupBy):
+            if run is not None:
+                yield run
+            run = GroupRun(node, [])
+            continue
+        if kind is AggregateRun and isinstance(run, GroupRun):
+            if len(run.aggregates) >= MAX_RUN:
+                yield run
+                run = GroupRun(run.group, [])
+            run.aggregates.append(node)
+            continue
+        if kind is None:
+            if run is not None:
+                yield run
+                run = None
+            yield node
+            continue
+        if not isinstance(run, kind) or len(run[0]) >= MAX_RUN:
+            if run is not None:
+                yield run
+            run = kind([])
+        run[0].append(node)
+    if run is not None:
+        yield run
+
+
+# Find the kind of run an operation node belongs in.  A line that failed
+# to compile stays in the run of its operation, so its error is reported
+# in the same place the other lines' output is.
+# input: the operation node
+# output: FilterRun, AggregateRun or None
+def _run_kind(node):
+    if isinstance(node, Invalid):
+        operation = node.line.split(":")[0]
+        if operation.startswith("filter") or operation in ("top", "bottom"):
+            return FilterRun
+        if operation.startswith("population") or operation == "percent":
+            return AggregateRun
+        return None
+    if isinstance(node, FILTERS):
+        return FilterRun
+    if isinstance(node, AGGREGATES):
+        return AggregateRun
+    return None
+
+
+# Group operation nodes into a plan of filter runs, aggregate runs and
+# single operations.
+# input: the operation nodes as a list
+# output: the plan as a list of steps
+def plan_ops(nodes) -> list:
+    return list(plan_stream(nodes))
+
+
+# Compile and plan the validated lines of an .ops file.
+# input: the lines as a list of strings
+# output: the plan as a list of steps
+def compile_plan(valid_lines) -> list:
+    return plan_ops(compile_ops(valid_lines))
+
+
+def _report_error(line: str, e: Exception, out):
+    print(f"There was an error when processing the {line} line. "
+          f"Here are the details: {e}", file=out)
+
+
+# The counties an operation works on: their row numbers, and the
+# normalized filters that produced them.  The key is a frozenset because
+# the counties left after a set of filters do not depend on their order;
+# filters that did not change anything (implied or unsupported ones) are
+# left out of it.  After a top or bottom the rows are in ranked order.
+class Selection(NamedTuple):
+    rows: object
+    key: frozenset
+
+
+# The rows of a selection while the shards of a parallel.ShardPool hold
+# them; only how many there are is known.
+class ShardedRows:
+    __slots__ = ('count',)
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+
+# What a plan runs against: the table, its optional index and result
+# cache, the stream to write results to, in approximate mode the
+# sampling.StratifiedSample to estimate from and the confidence level of
+# the estimates' intervals, the tracing.Tracer recording the run, and the
+# parallel.ShardPool while its shards hold the selected counties.
+class Context(NamedTuple):
+    table: CountyTable
+    index: object
+    cache: object
+    out: object
+    sample: object = None
+    confidence: float = 0.95
+    tracer: object = None
+    shards: object = None
+
+
+# Describe how many counties a selection holds: the exact number, or in
+# approximate mode the estimated number of counties the sampled ones
+# stand for.
+# input: the Context
+# input: the Selection
+# output: the count as a string
+def _entries(context: Context, selection: Selection) -> str:
+    if context.sample is None:
+        return str(len(selection.rows))
+    estimate = context.sample.estimate(selection.rows, [],
+                                       context.confidence)
+    return f"~{estimate.counties.value:.0f}"
+
+
+# Apply one filter to a selection, reusing the cached result of the same
+# normalized filters if there is one.  An ordered filter (a ranking) does
+# not commute with the filters before it, so its key holds theirs instead
+# of joining them.
+# input: the Context
+# input: the Selection to filter
+# input: the normalized filter, as a tuple
+# input: a function taking row numbers and returning the filtered ones
+# input: whether the filter depends on the filters before it
+# output: the filtered Selection
+def _apply_filter(context: Context, selection: Selection, predicate: tuple,
+                  apply, ordered: bool = False) -> Selection:
+    key = selection.key | {predicate}
+    if ordered:
+        key = frozenset({predicate + (selection.key,)})
+    if context.cache is not None:
+        rows = context.cache.get(('rows', key))
+        if rows is None:
+            rows = apply(selection.rows)
+            context.cache.put(('rows', key), rows, len(rows))
+        return Selection(rows, key)
+    return Selection(apply(selection.rows), key)
+
+
+# Describe the counties left after a filter, the way hw4 prints it.
+# input: the filter node
+# input: how many counties are left, as a string
+# output: the message as a string
+def _filter_message(node, entries: str) -> str:
+    if isinstance(node, FilterState):
+        return f"Filter: state == {node.state} ({entries} entries)"
+    if isinstance(node, Rank):
+        return (f"Filter: {'top' if node.largest else 'bottom'} {node.k} by "
+                f"{node.field} ({entries} entries)")
+    if isinstance(node, FilterExpression):
+        return f"Filter: {node.description} ({entries} entries)"
+    return f"Filter: {node.field} gt {node.value} ({entries} entries)"
+
+
+# Evaluate a run of filters one at a time, without printing anything.
+# input: the Context
+# input: the Selection the run starts from
+# input: the FilterRun
+# output: a generator of (filter node, the Selection left after it, the
+#         exception it raised or None) for every filter of the run
+def evaluate_filters(context: Context, selection: Selection, run: FilterRun):
+    table, index = context.table, context.index
+    tracer = context.tracer
+    state = None
+    lower = {}
+    upper = {}
+    for node in run.filters:
+        if tracer is not None:
+            span = tracer.start(node.line, "filter",
+                                rows_in=len(selection.rows))
+        error = None
+        try:
+            if isinstance(node, Invalid):
+                raise node.error
+            if isinstance(node, FilterState):
+                if state != node.state:
+                    selection = _apply_filter(
+                            context, selection, ("filter-state", node.state),
+                            lambda rows: column_engine.filter_by_state(
+                                    table, rows, node.state, index))
+                    state = node.state
+            elif isinstance(node, Rank):
+                if context.sample is not None:
+                    raise ValueError("rankings are not available in "
+                                     "approximate mode")
+                selection = _apply_filter(
+                        context, selection,
+                        ("top" if node.largest else "bottom", node.section,
+                         node.label, node.k),
+                        lambda rows: column_engine.top_k(
+                                table, rows, node.section, node.label, node.k,
+                                node.largest, index),
+                        ordered=True)
+            elif isinstance(node, FilterExpression):
+                selection = _apply_filter(
+                        context, selection, ("filter", node.expression),
+                        lambda rows: column_engine.filter_expression(
+                                table, rows, node.expression, index))
+            elif is_supported(node.section, node.label):
+                key = (node.section, node.label)
+                if node.greater:
+                    bound = lower.get(key)
+                    if bound is None or not node.value <= bound:
+                        selection = _apply_filter(
+                                context, selection,
+                                ("filter-gt", *key, node.value),
+                                lambda rows: column_engine.field_greater_than(
+                                        table, rows, *key, node.value, index))
+                        lower[key] = node.value
+                else:
+                    bound = upper.get(key)
+                    if bound is None or not node.value >= bound:
+                        selection = _apply_filter(
+                                context, selection,
+                                ("filter-lt", *key, node.value),
+                                lambda rows: column_engine.field_less_than(
+                                        table, rows, *key, node.value, index))
+                        upper[key] = node.value
+        except Exception as e:
+            error = e
+        if tracer is not None:
+            tracer.finish(span, rows_out=len(selection.rows))
+        yield node, selection, error
+
+
+# Evaluate a run of filters, printing the number of counties left after
+# each one.
+# input: the Context
+# input: the Selection the run starts from
+# input: the FilterRun
+# output: the Selection left after the run
+def _run_filters(context: Context, selection: Selection, run: FilterRun):
+    out = context.out
+    for node, selection, error in evaluate_filters(context, selection, run):
+        if error is not None:
+            _report_error(node.line, error, out)
+        else:
+            print(_filter_message(node, _entries(context, selection)),
+                  file=out)
+    return selection
+
+
+# Bring the counties the shards hold into this process, and go on without
+# the shards.
+# input: the Context
+# input: the Selection (with ShardedRows)
+# output: (the Selection with its row numbers, the Context to go on with)
+def _gather(context: Context, selection: Selection) -> tuple:
+    if len(selection.rows) == len(context.table):
+        rows = column_engine.all_rows(context.table)
+    else:
+        rows = context.shards.rows()
+    return Selection(rows, selection.key), context._replace(shards=None)
+
+
+# Evaluate a run of filters on the shards that hold the selection.  The
+# run is sent to the shards up to and including its first ranking; after
+# a ranking, or once fewer than the pool's gather_rows counties are left,
+# the counties are gathered and the rest of the run is evaluated here.
+# input: the Context
+# input: the Selection the run starts from (with ShardedRows)
+# input: the FilterRun
+# output: (the Selection left after the run, the Context to go on with)
+def _run_sharded_filters(context: Context, selection: Selection,
+                         run: FilterRun) -> tuple:
+    shards, out, tracer = context.shards, context.out, context.tracer
+    filters = run.filters
+    while filters and context.shards is not None:
+        end = next((i + 1 for i, node in enumerate(filters)
+                    if isinstance(node, Rank)), len(filters))
+        if tracer is not None:
+            span = tracer.start("; ".join(node.line for node in filters[:end]),
+                                "filter", rows_in=len(selection.rows))
+        for node, (count, key, error) in zip(
+                filters, shards.filter(FilterRun(filters[:end]))):
+            if error is not None:
+                _report_error(node.line, error, out)
+                continue
+            if isinstance(node, Rank):
+                selection = Selection(shards.ranked(node), key)
+                context = context._replace(shards=None)
+            else:
+                selection = Selection(ShardedRows(count), key)
+            print(_filter_message(node, str(len(selection.rows))), file=out)
+        if tracer is not None:
+            tracer.finish(span, rows_out=len(selection.rows))
+        filters = filters[end:]
+        if context.shards is not None and \
+                len(selection.rows) < shards.gather_rows:
+            selection, context = _gather(context, selection)
+    if filters:
+        selection = _run_filters(context, selection, FilterRun(filters))
+    return selection, context
+
+
+# Find the state a selection is exactly the counties of, if it is one: a
+# single filter-state applied to the whole table.
+# input: the Selection
+# output: the two-letter state abbreviation, or None
+def _selected_state(selection: Selection):
+    if len(selection.key) == 1:
+        (predicate,) = selection.key
+        if predicate[0] == "filter-state":
+            return predicate[1]
+    return None
+
+
+# Compute the total population and the sub-populations of some fields for
+# a selection, taking whatever the cache already has and computing the rest
+# in one shared scan (or from the table's stored totals, for the whole
+# table or a single state).
+# input: the Context
+# input: the Selection
+# input: the fields as a list of (section, label) pairs
+# output: (total population, dictionary of sub-populations by field)
+def _aggregate(context: Context, selection: Selection, fields) -> tuple:
+    cache = context.cache
+    state = _selected_state(selection)
+    if cache is None:
+        return _compute_aggregates(context, selection, fields, state)
+    total = cache.get(('total', selection.key))
+    sub_populations = {}
+    missing = []
+    for field in fields:
+        value = cache.get(('field', selection.key, field))
+        if value is None:
+            missing.append(field)
+        else:
+            sub_populations[field] = value
+    if total is None or missing:
+        total, computed = _compute_aggregates(context, selection, missing,
+                                              state)
+        cache.put(('total', selection.key), total)
+        for field, value in computed.items():
+            cache.put(('field', selection.key, field), value)
+        sub_populations.update(computed)
+    return total, sub_populations
+
+
+# Compute the total population and some sub-populations of a selection
+# with column_engine.aggregate_fields.  The shards only still hold the
+# selection when it is the whole table or a single state, which the
+# table's stored totals answer.
+# input: the Context
+# input: the Selection
+# input: the fields as a list of (section, label) pairs
+# input: the state the selection is exactly the counties of, or None
+# output: (total population, dictionary of sub-populations by field)
+def _compute_aggregates(context: Context, selection: Selection, fields,
+                        state) -> tuple:
+    rows = selection.rows
+    if context.shards is not None:
+        rows = column_engine.all_rows(context.table) if state is None else ()
+    return column_engine.aggregate_fields(context.table, rows, fields, state)
+
+
+# Check whether a step needs the selected counties in this process, so
+# that they have to be gathered from the shards first: every step but a
+# filter run, except for aggregates of the whole table or a single state
+# (answered from the table's stored totals).
+# input: the Context
+# input: the Selection (with ShardedRows)
+# input: the step
+# output: True if the rows have to be gathered
+def _needs_rows(context: Context, selection: Selection, step) -> bool:
+    if isinstance(step, AggregateRun):
+        return len(selection.rows) != len(context.table) and \
+                _selected_state(selection) is None
+    return isinstance(step, (GroupRun, Display, Quantile, Histogram))
+
+
+# The supported fields a list of aggregate nodes reads.
+# input: the aggregate nodes
+# output: the fields as a list of (section, label) pairs
+def _fields(aggregates) -> list:
+    return [(node.section, node.label) for node in aggregates
+            if isinstance(node, (Population, Percent)) and
+            is_supported(node.section, node.label)]
+
+
+# Evaluate a run of aggregates over the same counties.  Every field the
+# run needs is computed in a single shared scan.
+# input: the Context
+# input: the Selection to aggregate over
+# input: the AggregateRun
+# output: None
+def _run_aggregates(context: Context, selection: Selection,
+                    run: AggregateRun):
+    out = context.out
+    fields = _fields(run.aggregates)
+    if context.sample is not None:
+        _estimate_aggregates(context, selection, run, fields)
+        return
+    try:
+        total, sub_populations = _aggregate(context, selection, fields)
+    except Exception as e:
+        for node in run.aggregates:
+            _report_error(node.line, e, out)
+        return
+
+    for node in run.aggregates:
+        if isinstance(node, Invalid):
+            _report_error(node.line, node.error, out)
+        elif isinstance(node, PopulationTotal):
+            print(f"2014 population: {total}", file=out)
+        elif isinstance(node, Population):
+            sub_population = sub_populations.get((node.section, node.label), 0)
+            print(f"2014 {node.field} population: {sub_population}", file=out)
+        else:
+            percentage = column_engine.percent_of(
+                    sub_populations.get((node.section, node.label), 0), total)
+            print(f"2014 {node.field} percentage: {percentage}", file=out)
+
+
+# Format an estimate and its confidence interval.
+# input: the sampling.Estimate
+# input: the number of decimal places to show
+# input: the confidence level of the interval
+# output: the estimate as a string
+def _format_estimate(estimate: sampling.Estimate, places: int,
+                     confidence: float) -> str:
+    return (f"~{estimate.value:.{places}f} ({confidence:.0%} CI "
+            f"{estimate.low:.{places}f} to {estimate.high:.{places}f})")
+
+
+# Evaluate a run of aggregates in approximate mode, estimating every
+# population and percentage from the sample.
+# input: the Context
+# input: the Selection (sampled counties only)
+# input: the AggregateRun
+# input: the supported fields the run reads
+# output: None
+def _estimate_aggregates(context: Context, selection: Selection,
+                         run: AggregateRun, fields):
+    out, confidence = context.out, context.confidence
+    estimates = context.sample.estimate(selection.rows, fields, confidence)
+    for node in run.aggregates:
+        if isinstance(node, Invalid):
+            _report_error(node.line, node.error, out)
+        elif isinstance(node, PopulationTotal):
+            print(f"2014 population: "
+                  f"{_format_estimate(estimates.population, 0, confidence)}",
+                  file=out)
+        elif isinstance(node, Population):
+            estimate = estimates.sub_populations.get((node.section,
+                                                      node.label))
+            value = 0 if estimate is None else \
+                    _format_estimate(estimate, 0, confidence)
+            print(f"2014 {node.field} population: {value}", file=out)
+        else:
+            estimate = estimates.percentages.get((node.section, node.label))
+            value = 0.0 if estimate is None else \
+                    _format_estimate(estimate, 2, confidence)
+            print(f"2014 {node.field} percentage: {value}", file=out)
+
+
+# Format the aggregates of a set of groups as a compact table: a title
+# line, a line of column names (the key, "counties", then each aggregate's
+# line) and a line per group, sorted by key.
+# input: the key the counties were grouped by
+# input: dictionary mapping each group's key value to its group_by.Group
+# input: the aggregate nodes, one per column
+# output: the lines of the table as a list of strings
+def format_groups(key: str, groups: dict, aggregates) -> list[str]:
+    names = [key, "counties"] + [node.line for node in aggregates]
+    rows = []
+    for name in sorted(groups):
+        group = groups[name]
+        row = [name, str(group.counties)]
+        for node in aggregates:
+            if isinstance(node, PopulationTotal):
+                row.append(str(group.population))
+                continue
+            sub_population = group.sub_populations.get(
+                    (node.section, node.label), 0)
+            if isinstance(node, Percent):
+                sub_population = column_engine.percent_of(sub_population,
+                                                          group.population)
+            row.append(str(sub_population))
+        rows.append(row)
+    widths = [max(map(len, column)) for column in zip(names, *rows)]
+    lines = [f"Group by {key} ({len(groups)} groups)"]
+    for row in [names] + rows:
+        lines.append("  ".join(value.ljust(width)
+                               for value, width in zip(row, widths)).rstrip())
+    return lines
+
+
+# Evaluate a group-by and the aggregates after it, printing one table.
+# Lines among the aggregates that failed to compile are reported first.
+# input: the Context
+# input: the Selection to group
+# input: the GroupRun
+# output: None
+def _run_groups(context: Context, selection: Selection, run: GroupRun):
+    out = context.out
+    if context.sample is not None:
+        _report_error(run.group.line, ValueError(
+                "group-by is not available in approximate mode"), out)
+        return
+    aggregates = []
+    for node in run.aggregates:
+        if isinstance(node, Invalid):
+            _report_error(node.line, node.error, out)
+        else:
+            aggregates.append(node)
+    try:
+        groups = group_by.aggregate_table(context.table, selection.rows,
+                                          _fields(aggregates), context.index)
+    except Exception as e:
+        _report_error(run.group.line, e, out)
+        return
+    for line in format_groups(run.group.key, groups, aggregates):
+        print(line, file=out)
+
+
+# Format a histogram: a title line and a line per bin with its range and
+# count.  Every bin but the last leaves out its upper edge.
+# input: the field as a string
+# input: the bins' edges
+# input: the counts of the bins
+# output: the lines as a list of strings
+def format_histogram(field: str, edges: list[float], counts: list[int]):
+    lines = [f"{field} histogram ({sum(counts)} entries)"]
+    for i, count in enumerate(counts):
+        close = "]" if i == len(counts) - 1 else ")"
+        lines.append(f"  [{edges[i]}, {edges[i + 1]}{close}: {count}")
+    return lines
+
+
+# Format a quantile, marking an estimate with a "~".
+# input: the value
+# input: whether it is exact
+# output: the value as a string
+def format_quantile(value, exact: bool) -> str:
+    return str(value) if exact else f"~{value} (sketch estimate)"
+
+
+# Evaluate a quantile, median or histogram line over the selected counties.
+# input: the Context
+# input: the Selection
+# input: the Quantile or Histogram node
+# output: None
+def _run_statistic(context: Context, selection: Selection, node):
+    out = context.out
+    try:
+        if context.sample is not None:
+            raise ValueError("quantiles and histograms are not available in "
+                             "approximate mode")
+        if isinstance(node, Quantile):
+            value = column_engine.field_quantile(
+                    context.table, selection.rows, node.section, node.label,
+                    node.q, context.index)
+        else:
+            value = column_engine.field_histogram(
+                    context.table, selection.rows, node.section, node.label,
+                    node.bins, context.index)
+        if value is None:
+            raise ValueError(f"no counties have a value for {node.field}")
+    except Exception as e:
+        _report_error(node.line, e, out)
+        return
+    if isinstance(node, Quantile):
+        print(f"{node.field} {node.name}: {format_quantile(*value)}",
+              file=out)
+    else:
+        for line in format_histogram(node.field, *value):
+            print(line, file=out)
+
+
+# Wrap a plain stream in a text OutputWriter; writers are used as they are.
+# input: the stream or OutputWriter (None means sys.stdout)
+# output: an OutputWriter
+def as_writer(out) -> output_writers.OutputWriter:
+    if isinstance(out, output_writers.OutputWriter):
+        return out
+    return output_writers.TextWriter(out or sys.stdout)
+
+
+# Get the lines of an .ops script a plan step runs.
+# input: the plan step
+# output: the lines as a list of strings
+def step_lines(step) -> list[str]:
+    if isinstance(step, FilterRun):
+        return [node.line for node in step.filters]
+    if isinstance(step, AggregateRun):
+        return [node.line for node in step.aggregates]
+    if isinstance(step, GroupRun):
+        return [step.group.line] + [node.line for node in step.aggregates]
+    return [step.line]
+
+
+# Write out the output collected so far, tracing it if the run is traced.
+def _flush(context: Context):
+    if context.tracer is None:
+        context.out.flush()
+    else:
+        with context.tracer.span("flush output", "print"):
+            context.out.flush()
+
+
+# Run a plan against a table.
+# input: the plan as a list of steps
+# input: the CountyTable
+# input: the output_writers.OutputWriter or stream to write to (defaults to
+#        sys.stdout); output is buffered and written at the end, or after
+#        every step when flush is set
+# input: a table_index.TableIndex of the table for the filters to use
+# input: a query_cache.QueryCache to reuse filter and aggregate results
+#        from (it must only ever be used with this table)
+# input: whether to flush the stream after every step
+# input: a sampling.StratifiedSample of the table to run in approximate
+#        mode: the filters then only look at the sampled counties, counts
+#        and aggregates are estimated from them, and the cache is not used
+# input: the confidence level of the estimates' intervals
+# input: a function to call after every step with the step, the seconds it
+#        took, and the number of counties before and after it
+# input: a tracing.Tracer to record every step, filter line and flush in
+# input: a parallel.ShardPool of the table to evaluate filters with, shard
+#        by shard (not used in approximate mode)
+# output: the row numbers left after all the filters
+def run_plan(steps, table: CountyTable, out=None, index=None, cache=None,
+             flush=False, sample=None, confidence=0.95, observer=None,
+             tracer=None, shards=None):
+    if sample is None:
+        context = Context(table, index, cache, as_writer(out), tracer=tracer,
+                          shards=shards)
+        selection = Selection(column_engine.all_rows(table), frozenset())
+        if shards is not None:
+            shards.reset()
+            selection = Selection(ShardedRows(len(table)), frozenset())
+    else:
+        context = Context(table, index, None, as_writer(out), sample,
+                          confidence, tracer)
+        selection = Selection(sample.rows, frozenset())
+    span = None
+    if flush:
+        _flush(context)
+    for step in steps:
+        if observer is not None:
+            start = time.perf_counter()
+            rows_in = len(selection.rows)
+        if tracer is not None and not isinstance(step, FilterRun):
+            span = tracer.start("; ".join(step_lines(step)),
+                                "print" if isinstance(step, Display)
+                                else "op", rows_in=len(selection.rows))
+        if context.shards is not None and \
+                _needs_rows(context, selection, step):
+            selection, context = _gather(context, selection)
+        if isinstance(step, FilterRun):
+            if context.shards is not None:
+                selection, context = _run_sharded_filters(context, selection,
+                                                          step)
+            else:
+                selection = _run_filters(context, selection, step)
+        elif isinstance(step, AggregateRun):
+            _run_aggregates(context, selection, step)
+        elif isinstance(step, GroupRun):
+            _run_groups(context, selection, step)
+        elif isinstance(step, (Quantile, Histogram)):
+            _run_statistic(context, selection, step)
+        elif isinstance(step, Display):
+            context.out.display(table, selection.rows)
+        elif isinstance(step, Invalid):
+            _report_error(step.line, step.error, context.out)
+        else:
+            print(f"The operation you provided ({step.operation}) is not "
+                  f"supported", file=context.out)
+        if observer is not None:
+            observer(step, time.perf_counter() - start, rows_in,
+                     len(selection.rows))
+        if span is not None:
+            tracer.finish(span, rows_out=len(selection.rows))
+            span = None
+        # Write the step's output before the next step is read.
+        if flush:
+            _flush(context)
+    if context.shards is not None:
+        selection, context = _gather(context, selection)
+    _flush(context)
+    return selection.rows
+
+
+# Validate, compile and run the lines of an .ops script as they arrive,
+# flushing the output after every step.  Bad lines are reported (see
+# validate_lines) when they are reached.
+# input: the lines (an open file, sys.stdin or any iterable of strings)
+# input: the CountyTable
+# input: the OutputWriter or stream to write to (defaults to sys.stdout)
+# input: a table_index.TableIndex of the table, or None
+# input: a query_cache.QueryCache for the table, or None
+# input: a tracing.Tracer to record the run in, or None
+# output: the row numbers left after all the filters
+def run_stream(lines, table: CountyTable, out=None, index=None, cache=None,
+               tracer=None):
+    out = as_writer(out)
+    nodes = map(compile_line, validate_lines(lines, out))
+    return run_plan(plan_stream(tracing.iterate(tracer, nodes, "read line",
+                                                "parse")),
+                    table, out, index, cache, flush=True, tracer=tracer)
+
+
+# Validate, compile and run the text of an .ops script, writing the same
+# output hw4.py would (starting with the number of counties loaded).
+# input: the script as a string
+# input: the CountyTable
+# input: the OutputWriter or stream to write to (defaults to sys.stdout)
+# input: a table_index.TableIndex of the table, or None
+# input: a query_cache.QueryCache for the table, or None
+# output: the row numbers left after all the filters
+def run_script(text: str, table: CountyTable, out=None, index=None,
+               cache=None):
+    out = as_writer(out)
+    print(f"{len(table)} counties loaded", file=out)
+    return run_stream(text.splitlines(), table, out, index, cache)
@@ -0,0 +1,253 @@
+import csv
+import io
+import json
+import struct
+import sys
+
+from county_table import CountyTable
+
+# Output formats for running .ops scripts.  A writer is a file-like object
+# (ops_plan prints its messages to it) that collects everything in a large
+# buffer and writes it to the underlying stream in bulk, plus a display
+# method that writes a set of counties straight from the table's columns.
+#
+#   text    the same text hw4.py prints
+#   jsonl   one JSON object per line: {"County": ..., "State": ...,
+#           "Education": {...}, ...} for every displayed county and
+#           {"message": ...} for every other line of output
+#   csv     a header row and one row per county for every display, with a
+#           column per field ("Education.High School or Higher", ...);
+#           other output lines are written as "# ..." comment lines
+#   binary  a sequence of records, each a type byte and a 4-byte
+#           little-endian payload length:
+#             b'M'  a UTF-8 output line
+#             b'D'  a display: a 4-byte length and a JSON header (row
+#                   count, column names, integral columns), the county
+#                   names and states as newline-separated UTF-8 (each
+#                   preceded by its 4-byte length), then every column's
+#                   values as row-count little-endian doubles
+
+# The sections display shows, in order.
+DISPLAY_SECTIONS = ('Education', 'Ethnicities', 'Income', 'Population')
+
+_LENGTH = struct.Struct('<I')
+
+
+# Get the values of a column at the given rows.
+def _gather(column, rows) -> list:
+    return list(map(column.__getitem__, rows))
+
+
+class OutputWriter:
+    # Initialize a new OutputWriter.
+    # input: the stream to write to
+    # input: how many characters (or bytes) to collect before writing
+    def __init__(self, stream, buffer_size: int = 1 << 16):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        self._line = []
+
+
+    # Collect output, passing each complete line to message.
+    def write(self, text: str) -> int:
+        parts = text.split('\n')
+        for part in parts[:-1]:
+            self._line.append(part)
+            self.message(''.join(self._line))
+            self._line = []
+        if parts[-1]:
+            self._line.append(parts[-1])
+        return len(text)
+
+
+    # Add something to the buffer, writing the buffer out when it is full.
+    def _emit(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+
+    def _write_buffer(self):
+        if self._buffer:
+            self.stream.write(self._join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+
+    def _join(self, parts):
+        return ''.join(parts)
+
+
+    # Write out everything collected so far.
+    def flush(self):
+        self._write_buffer()
+        self.stream.flush()
+
+
+    # Write one line of output that is not part of a display.
+    # input: the line, without its newline
+    def message(self, line: str):
+        raise NotImplementedError
+
+
+    # Write a set of counties.
+    # input: the CountyTable
+    # input: the row numbers of the counties to write
+    def display(self, table: CountyTable, rows):
+        raise NotImplementedError
+
+
+class TextWriter(OutputWriter):
+    # Text needs no line splitting; buffer it as it comes.
+    def write(self, text: str) -> int:
+        self._emit(text)
+        return len(text)
+
+
+    def message(self, line: str):
+        self._emit(line + '\n')
+
+
+    # Write counties in the same format as hw4.display, building each
+    # section the way a dictionary's repr would without building the
+    # dictionary.
+    def display(self, table: CountyTable, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        sections = []
+        for section in DISPLAY_SECTIONS:
+            fields = []
+            for label in table.labels(section):
+                values = _gather(table.column(section, label), rows)
+                if table.is_integral(section, label):
+                    values = [value if value != value else int(value)
+                              for value in values]
+                fields.append((repr(label) + ': ', values))
+            sections.append((f'    {section}: {{', fields))
+
+        counties = table.counties
+        states = table.states
+        for i, row in enumerate(rows):
+            parts = [f'County: {counties[row]}, State: {states[row]}\n']
+            for prefix, fields in sections:
+                parts.append(prefix)
+                parts.append(', '.join([name + repr(values[i])
+                                        for name, values in fields
+                                        if values[i] == values[i]]))
+                parts.append('}\n')
+            parts.append('\n')
+            self._emit(''.join(parts))
+
+
+class JsonLinesWriter(OutputWriter):
+    def message(self, line: str):
+        self._emit(json.dumps({'message': line}) + '\n')
+
+
+    def display(self, table: CountyTable, rows):
+        rows = list(rows)
+        sections = []
+        for section in DISPLAY_SECTIONS:
+            fields = []
+            for label in table.labels(section):
+                values = _gather(table.column(section, label), rows)
+                if table.is_integral(section, label):
+                    values = [value if value != value else int(value)
+                              for value in values]
+                fields.append((label, values))
+            sections.append((section, fields))
+        for i, row in enumerate(rows):
+            record = {'County': table.counties[row], 'State': table.states[row]}
+            for section, fields in sections:
+                record[section] = {label: values[i] for label, values in fields
+                                   if values[i] == values[i]}
+            self._emit(json.dumps(record) + '\n')
+
+
+class CsvWriter(OutputWriter):
+    def message(self, line: str):
+        self._emit('# ' + line + '\n')
+
+
+    def display(self, table: CountyTable, rows):
+        rows = list(rows)
+        names = ['County', 'State']
+        columns = [_gather(table.counties, rows), _gather(table.states, rows)]
+        for section in DISPLAY_SECTIONS:
+            for label in table.labels(section):
+                values = _gather(table.column(section, label), rows)
+                if table.is_integral(section, label):
+                    values = [value if value != value else int(value)
+                              for value in values]
+                names.append(section + '.' + label)
+                columns.append(['' if value != value else value
+                                for value in values])
+        text = io.StringIO()
+        writer = csv.writer(text, lineterminator='\n')
+        writer.writerow(names)
+        writer.writerows(zip(*columns))
+        self._emit(text.getvalue())
+
+
+class BinaryWriter(OutputWriter):
+    def _join(self, parts):
+        return b''.join(parts)
+
+
+    def _record(self, kind: bytes, payload: bytes):
+        self._emit(kind + _LENGTH.pack(len(payload)) + payload)
+
+
+    def message(self, line: str):
+        self._record(b'M', line.encode('utf-8'))
+
+
+    def display(self, table: CountyTable, rows):
+        rows = list(rows)
+        names = []
+        integral = []
+        blocks = []
+        for section in DISPLAY_SECTIONS:
+            for label in table.labels(section):
+                names.append(section + '.' + label)
+                if table.is_integral(section, label):
+                    integral.append(names[-1])
+                values = struct.pack(f'<{len(rows)}d',
+                                     *_gather(table.column(section, label),
+                                              rows))
+                blocks.append(values)
+        header = json.dumps({'rows': len(rows), 'columns': names,
+                             'integral': integral}).encode('utf-8')
+        parts = [_LENGTH.pack(len(header)), header]
+        for strings in (table.counties, table.states):
+            text = '\n'.join(_gather(strings, rows)).encode('utf-8')
+            parts.append(_LENGTH.pack(len(text)))
+            parts.append(text)
+        self._record(b'D', b''.join(parts + blocks))
+
+
+WRITERS = {
+        'text': TextWriter,
+        'jsonl': JsonLinesWriter,
+        'csv': CsvWriter,
+        'binary': BinaryWriter
+    }
+
+
+# Make a writer for one of the output formats.
+# input: the format name ("text", "jsonl", "csv" or "binary")
+# input: the text stream to write to (defaults to sys.stdout); the binary
+#        format writes to its underlying byte stream
+# output: the OutputWriter
+def make_writer(format: str = 'text', stream=None) -> OutputWriter:
+    if format not in WRITERS:
+        raise ValueError(f'unknown output format {format!r}; choose from '
+                         f'{", ".join(WRITERS)}')
+    stream = stream or sys.stdout
+    if format == 'binary':
+        stream = getattr(stream, 'buffer', stream)
+    return WRITERS[format](stream)
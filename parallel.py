@@ -0,0 +1,219 @@
+from array import array
+from itertools import chain
+import multiprocessing
+import sys
+
+import column_engine
+import ops_plan
+from county_table import CountyTable
+
+# Data-parallel execution of an .ops plan over shards of a CountyTable.
+#
+# The table is split into shards of consecutive rows, and each shard gets a
+# worker process of its own that keeps the shard's part of the selection
+# between steps.  run_plan (given a ShardPool) sends every filter run to all
+# of the shards at once and merges what comes back:
+#   filters      each shard filters its own rows; the counts are added up.
+#                A filter only fails on a shard that has rows left, the
+#                same way it fails on the whole table, so errors and cache
+#                keys are taken from the first shard that still had rows.
+#   top/bottom   each shard keeps its own k best counties, and the k best
+#                of those (ties still broken in table order) are the k
+#                best of the whole selection.
+#   gathering    the shards send their row numbers, which are put back
+#                together in shard order (that is, table order).
+# Aggregates are not sharded: a sub-population is a floating-point sum,
+# which only matches the single process result bit for bit when it is
+# added up in one pass in row order (per-shard partial sums would round
+# differently), so there is no exact partial result to merge.  The whole
+# table and single states are answered from the table's stored totals
+# without the shards; any other aggregate, a ranking, a group-by, a
+# display, a quantile, median or histogram, or a selection with few enough
+# counties left gathers the rows, and the rest of the plan runs in this
+# process as usual.  The output is the same, line for line,
+# as without the pool.
+#
+# Workers are started with fork, so they share the table (and its index)
+# with this process instead of loading it again; where fork is not
+# available, ShardPool.available() is False and plans run in one process.
+
+
+# By default, gather the rows into this process once a filter run leaves
+# fewer than this many, since the shards would then cost more than they
+# save.
+GATHER_ROWS = 10000
+
+
+# Split a table into shards of consecutive rows.
+# input: the CountyTable
+# input: how many shards to make
+# input: "rows" for shards of (nearly) equal size, or "state" to move every
+#        cut forward to where the state changes, so that no run of counties
+#        of one state is split
+# output: the shards as a list of ranges of row numbers, in table order
+def shard_ranges(table: CountyTable, shards: int, by: str = "rows") -> list:
+    if by not in ("rows", "state"):
+        raise ValueError(f"cannot shard by {by}; use rows or state")
+    rows = len(table)
+    cuts = [rows * i // shards for i in range(shards + 1)]
+    if by == "state":
+        states = table.states
+        for i in range(1, shards):
+            cut = max(cuts[i], cuts[i - 1])
+            while 0 < cut < rows and states[cut] == states[cut - 1]:
+                cut += 1
+            cuts[i] = cut
+    ranges = [range(start, stop) for start, stop in zip(cuts, cuts[1:])
+              if stop > start]
+    return ranges or [range(0)]
+
+
+class ShardPool:
+    # Start a worker process for every shard of a table.  Use the pool in
+    # a with statement (or call close) to stop the workers.
+    # input: the CountyTable
+    # input: how many shards (and worker processes) to use
+    # input: a table_index.TableIndex of the table for the filters to use
+    # input: how to cut the shards, "rows" or "state" (see shard_ranges)
+    # input: gather the rows into this process once fewer than this many
+    #        are left
+    def __init__(self, table: CountyTable, workers: int, index=None,
+                 by: str = "rows", gather_rows: int = GATHER_ROWS):
+        self.table = table
+        self.gather_rows = gather_rows
+        self.shards = shard_ranges(table, workers, by)
+        self._counts = [len(rows) for rows in self.shards]
+        self._connections = []
+        self._processes = []
+        # A forked worker would write out anything still buffered here a
+        # second time when it exits.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        context = multiprocessing.get_context("fork")
+        for rows in self.shards:
+            connection, child = context.Pipe()
+            process = context.Process(target=_serve,
+                                      args=(child, table, index, rows),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+
+    # Check whether worker processes can be forked on this platform.
+    # output: True if a ShardPool can be started
+    @staticmethod
+    def available() -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+
+    # Send a request to every shard and wait for all of their replies.
+    # input: the request as a tuple of (operation, argument)
+    # output: the replies as a list, in shard order
+    def _ask(self, request: tuple) -> list:
+        for connection in self._connections:
+            connection.send(request)
+        replies = [connection.recv() for connection in self._connections]
+        for reply in replies:
+            if isinstance(reply, BaseException):
+                raise reply
+        return replies
+
+
+    # Start every shard over from all of its rows.
+    def reset(self):
+        self._ask(("reset", None))
+        self._counts = [len(rows) for rows in self.shards]
+
+
+    # Evaluate a run of filters on every shard.
+    # input: the ops_plan.FilterRun
+    # output: a list with, for every filter of the run, the number of
+    #         counties left after it, the key of the selection after it and
+    #         the exception it raised or None
+    def filter(self, run: ops_plan.FilterRun) -> list:
+        replies = self._ask(("filter", run))
+        results = []
+        for i in range(len(run.filters)):
+            first = next((shard for shard, count in enumerate(self._counts)
+                          if count > 0), 0)
+            _, key, error = replies[first][i]
+            self._counts = [reply[i][0] for reply in replies]
+            results.append((sum(self._counts), key, error))
+        return results
+
+
+    # Collect the shards' selected counties.
+    # output: their row numbers, in table order
+    def rows(self) -> array:
+        rows = array("q")
+        for part in self._ask(("rows", None)):
+            rows.extend(part)
+        return rows
+
+
+    # Merge the k best counties of each shard, after a top or bottom has
+    # run on every shard, into the k best of the whole selection.
+    # input: the ops_plan.Rank
+    # output: the row numbers of the selected counties, best first
+    def ranked(self, node: ops_plan.Rank) -> list[int]:
+        candidates = sorted(chain.from_iterable(self._ask(("rows", None))))
+        return column_engine.top_k(self.table, candidates, node.section,
+                                   node.label, node.k, node.largest)
+
+
+    # Stop the worker processes.
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+# Answer the requests for one shard until told to stop.  The shard's
+# selection is kept between requests.
+# input: the worker's end of the pipe
+# input: the CountyTable
+# input: a table_index.TableIndex of the table, or None
+# input: the shard's rows as a range
+# output: None
+def _serve(connection, table: CountyTable, index, rows: range):
+    context = ops_plan.Context(table, index, None, None)
+    start = ops_plan.Selection(rows, frozenset())
+    selection = start
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        operation, argument = request
+        try:
+            if operation == "filter":
+                reply = []
+                for _, selection, error in ops_plan.evaluate_filters(
+                        context, selection, argument):
+                    reply.append((len(selection.rows), selection.key, error))
+            elif operation == "rows":
+                reply = array("q", selection.rows)
+            else:
+                selection = start
+                reply = None
+        except Exception as e:
+            reply = e
+        connection.send(reply)
+    connection.close()
@@ -0,0 +1,400 @@
+from bisect import bisect_left, bisect_right
+import math
+import re
+from typing import NamedTuple
+
+from county_table import CountyTable, column_name
+
+# Boolean filter expressions for the filter and filter-between operations.
+#
+# An expression compares fields with numbers and tests the state, and
+# combines the tests with and, or, not and parentheses.  Fields are
+# written in square brackets, since their names contain spaces:
+#   filter:30 < [Education.Bachelor's Degree or Higher] < 60 and
+#          [Ethnicities.Hispanic or Latino] > 40 and state in (CA, TX)
+# (on one line).  The comparisons are <, >, <=, >=, == and !=, and a field
+# may sit between two numbers for a range.  The state tests are
+# "state == CA", "state != CA", "state in (CA, TX)" and "state not in (...)".
+#
+# A county missing a field fails every comparison on that field, even
+# under not: not is pushed down into the comparisons when the expression
+# is parsed (so "not [x] > 5" is "[x] <= 5"), and a parsed expression is
+# made only of Comparison, StateIn, AllOf and AnyOf nodes.
+#
+# To evaluate an expression, its tests are ordered for the table by how
+# likely each one is to decide the outcome (see order) and it is compiled
+# into a single Python function that checks one county with Python's own
+# short-circuiting and/or, so each county is looked at once and the first
+# failing (or passing) test ends its evaluation.
+
+
+class Comparison(NamedTuple):
+    field: str
+    section: str
+    label: str
+    op: str
+    value: float
+
+
+class StateIn(NamedTuple):
+    states: tuple
+    negated: bool
+
+
+class AllOf(NamedTuple):
+    operands: tuple
+
+
+class AnyOf(NamedTuple):
+    operands: tuple
+
+
+# The comparisons, each one's negation, and each one with its sides
+# swapped.
+NEGATED = {'<': '>=', '>': '<=', '<=': '>', '>=': '<', '==': '!=', '!=': '=='}
+SWAPPED = {'<': '>', '>': '<', '<=': '>=', '>=': '<=', '==': '==', '!=': '!='}
+
+_TOKEN = re.compile(r"""\s*(?:
+        (?P<field>\[[^\]]*\])
+      | (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<op><=|>=|==|!=|<|>)
+      | (?P<punct>[(),])
+      | (?P<word>[A-Za-z_][A-Za-z_0-9]*)
+    )""", re.VERBOSE)
+
+
+# Split an expression into tokens.
+# input: the expression as a string
+# output: the tokens as a list of (kind, text) pairs
+def _tokens(text: str) -> list[tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"cannot read the expression at "
+                             f"{text[position:].strip()!r}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    # input: the expression as a string
+    # input: a function splitting a dotted field into (section, label)
+    def __init__(self, text: str, split):
+        self.tokens = _tokens(text)
+        self.position = 0
+        self.split = split
+
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+
+    def take(self, kind=None, text=None) -> str:
+        token_kind, token_text = self.peek()
+        if token_kind is None or (kind is not None and token_kind != kind) \
+                or (text is not None and token_text != text):
+            expected = text or kind or 'more'
+            found = token_text if token_text is not None else 'the end'
+            raise ValueError(f"expected {expected} but found {found}")
+        self.position += 1
+        return token_text
+
+
+    def is_word(self, word: str) -> bool:
+        return self.peek() == ('word', word)
+
+
+    def expression(self, negated: bool = False):
+        operands = [self.conjunction(negated)]
+        while self.is_word('or'):
+            self.take()
+            operands.append(self.conjunction(negated))
+        # not (a or b) is (not a) and (not b)
+        return _combine(AllOf if negated else AnyOf, operands)
+
+
+    def conjunction(self, negated: bool):
+        operands = [self.negation(negated)]
+        while self.is_word('and'):
+            self.take()
+            operands.append(self.negation(negated))
+        return _combine(AnyOf if negated else AllOf, operands)
+
+
+    def negation(self, negated: bool):
+        if self.is_word('not'):
+            self.take()
+            return self.negation(not negated)
+        return self.primary(negated)
+
+
+    def primary(self, negated: bool):
+        kind, text = self.peek()
+        if kind == 'punct' and text == '(':
+            self.take()
+            expression = self.expression(negated)
+            self.take('punct', ')')
+            return expression
+        if self.is_word('state'):
+            return self.state_test(negated)
+        return self.comparison(negated)
+
+
+    def state_test(self, negated: bool) -> StateIn:
+        self.take()
+        kind, text = self.peek()
+        if kind == 'op' and text in ('==', '!='):
+            self.take()
+            return StateIn((self.take('word'),), negated != (text == '!='))
+        if self.is_word('not'):
+            self.take()
+            negated = not negated
+        self.take('word', 'in')
+        self.take('punct', '(')
+        states = [self.take('word')]
+        while self.peek() == ('punct', ','):
+            self.take()
+            states.append(self.take('word'))
+        self.take('punct', ')')
+        return StateIn(tuple(sorted(set(states))), negated)
+
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'field':
+            self.take()
+            field = text[1:-1].strip()
+            return (field, *self.split(field))
+        if kind == 'number':
+            self.take()
+            return float(text)
+        raise ValueError(f"expected a [field] or a number but found "
+                         f"{text if text is not None else 'the end'}")
+
+
+    def comparison(self, negated: bool):
+        left = self.operand()
+        op = self.take('op')
+        right = self.operand()
+        if isinstance(left, float) and isinstance(right, float):
+            raise ValueError(f"{left} {op} {right} does not compare a field")
+        if isinstance(left, tuple) and isinstance(right, tuple):
+            raise ValueError("cannot compare two fields")
+        if isinstance(left, float):
+            comparisons = [Comparison(*right, SWAPPED[op], left)]
+            if self.peek()[0] == 'op':
+                # a range, such as 30 < [field] < 60
+                second = self.take()
+                value = self.operand()
+                if not isinstance(value, float):
+                    raise ValueError("cannot compare two fields")
+                comparisons.append(Comparison(*right, second, value))
+        else:
+            comparisons = [Comparison(*left, op, right)]
+        if negated:
+            comparisons = [comparison._replace(op=NEGATED[comparison.op])
+                           for comparison in comparisons]
+            return _combine(AnyOf, comparisons)
+        return _combine(AllOf, comparisons)
+
+
+# Join operands with and (AllOf) or or (AnyOf), flattening nested nodes of
+# the same kind.
+def _combine(kind, operands):
+    flat = []
+    for operand in operands:
+        flat.extend(operand.operands if isinstance(operand, kind)
+                    else (operand,))
+    return flat[0] if len(flat) == 1 else kind(tuple(flat))
+
+
+# Parse a filter expression.
+# input: the expression as a string
+# input: a function splitting a dotted field into (section, label), such
+#        as ops_plan.split_field
+# output: the expression as Comparison, StateIn, AllOf and AnyOf nodes;
+#         raises ValueError if it cannot be parsed
+def parse(text: str, split):
+    parser = _Parser(text, split)
+    expression = parser.expression()
+    if parser.peek()[0] is not None:
+        raise ValueError(f"unexpected {parser.peek()[1]} in the expression")
+    return expression
+
+
+# Build the expression of a filter-between: the field strictly between two
+# values.
+# input: the field, its section and its label as strings
+# input: the lower and upper bounds as floats
+# output: the expression
+def between(field: str, section: str, label: str, low: float, high: float):
+    return AllOf((Comparison(field, section, label, '>', low),
+                  Comparison(field, section, label, '<', high)))
+
+
+# Find every field an expression compares.
+# input: the expression
+# output: the Comparison nodes, in the order they are written
+def comparisons(expression) -> list[Comparison]:
+    if isinstance(expression, Comparison):
+        return [expression]
+    if isinstance(expression, StateIn):
+        return []
+    return [comparison for operand in expression.operands
+            for comparison in comparisons(operand)]
+
+
+# Estimate the share of a table's counties an expression keeps, from the
+# column statistics of the table, assuming that tests on different fields
+# are independent.
+# input: the expression
+# input: the CountyTable
+# output: the estimated share, between 0 and 1
+def selectivity(expression, table: CountyTable) -> float:
+    if isinstance(expression, AllOf):
+        return math.prod(selectivity(operand, table)
+                         for operand in expression.operands)
+    if isinstance(expression, AnyOf):
+        return 1 - math.prod(1 - selectivity(operand, table)
+                             for operand in expression.operands)
+    rows = len(table)
+    if rows == 0:
+        return 0.0
+    if isinstance(expression, StateIn):
+        counts = table.state_counts()
+        share = sum(counts.get(state, 0) for state in expression.states) / rows
+        return 1 - share if expression.negated else share
+    present, quantiles = table.column_statistics(
+            column_name(expression.section, expression.label))
+    if not quantiles:
+        return 0.0
+    value, points = expression.value, len(quantiles)
+    below = bisect_left(quantiles, value) / points
+    above = (points - bisect_right(quantiles, value)) / points
+    equal = max(1 - below - above, 1 / present)
+    share = {'<': below, '>': above, '<=': 1 - above, '>=': 1 - below,
+             '==': equal, '!=': 1 - equal}[expression.op]
+    return share * present / rows
+
+
+# Estimate the number of tests it takes to evaluate an expression for one
+# county, with its operands in their current order.
+# input: the expression
+# input: the CountyTable
+# output: the expected number of tests
+def cost(expression, table: CountyTable) -> float:
+    if isinstance(expression, (Comparison, StateIn)):
+        return 1.0
+    total = 0.0
+    reached = 1.0
+    for operand in expression.operands:
+        total += reached * cost(operand, table)
+        share = selectivity(operand, table)
+        reached *= share if isinstance(expression, AllOf) else 1 - share
+    return total
+
+
+# Order the operands of every and and or so that the tests most likely to
+# settle the outcome cheaply come first: for and, the ones that fail most
+# often for their cost, and for or, the ones that pass most often.  Ties
+# keep the order the expression was written in.
+# input: the expression
+# input: the CountyTable whose statistics to use
+# output: the reordered expression (it keeps the same counties)
+def order(expression, table: CountyTable):
+    if isinstance(expression, (Comparison, StateIn)):
+        return expression
+    operands = [order(operand, table) for operand in expression.operands]
+
+    def rank(operand):
+        share = selectivity(operand, table)
+        if isinstance(expression, AllOf):
+            share = 1 - share
+        return cost(operand, table) / share if share > 0 else math.inf
+
+    return type(expression)(tuple(sorted(operands, key=rank)))
+
+
+# Write an expression as Python source.
+# input: the expression
+# input: a function giving the source of a Comparison's value for a county
+# input: the source of a county's state
+# input: a function binding a constant to a name, returning the name
+# output: the source as a string
+def _source(expression, value_of, state_of: str, bind) -> str:
+    if isinstance(expression, AllOf):
+        return '(' + ' and '.join(_source(operand, value_of, state_of, bind)
+                                  for operand in expression.operands) + ')'
+    if isinstance(expression, AnyOf):
+        return '(' + ' or '.join(_source(operand, value_of, state_of, bind)
+                                 for operand in expression.operands) + ')'
+    if isinstance(expression, StateIn):
+        if len(expression.states) == 1:
+            op = '!=' if expression.negated else '=='
+            return f'{state_of} {op} {bind(expression.states[0])}'
+        op = 'not in' if expression.negated else 'in'
+        return f'{state_of} {op} {bind(frozenset(expression.states))}'
+    value = value_of(expression)
+    constant = bind(expression.value)
+    if expression.op == '!=':
+        # a missing value (NaN) is != everything, but fails here too
+        return f'({value} == {value} and {value} != {constant})'
+    return f'{value} {expression.op} {constant}'
+
+
+# Compile source into a function of one argument.
+def _compile(argument: str, source: str, names: dict):
+    return eval(compile(f'lambda {argument}: {source}', '<filter>', 'eval'),
+                {'__builtins__': {}, **names})
+
+
+# Compile an expression into a function that tests one row of a table.
+# input: the expression (in the order to evaluate it)
+# input: the CountyTable; every field the expression compares must have a
+#        column
+# output: a function taking a row number and returning True or False
+def row_predicate(expression, table: CountyTable):
+    names = {'states': table.states}
+    columns = {}
+
+    def bind(constant) -> str:
+        name = f'v{len(names)}'
+        names[name] = constant
+        return name
+
+    def value_of(comparison: Comparison) -> str:
+        column = column_name(comparison.section, comparison.label)
+        if column not in columns:
+            columns[column] = f'c{len(columns)}'
+            names[columns[column]] = table.columns[column]
+        return f'{columns[column]}[row]'
+
+    return _compile('row', _source(expression, value_of, 'states[row]', bind),
+                    names)
+
+
+# Compile an expression into a function that tests one county object (a
+# CountyDemographics or a CountyTable row view).  A county missing a field
+# fails every comparison on it.
+# input: the expression
+# output: a function taking a county and returning True or False
+def object_predicate(expression):
+    names = {'nan': math.nan}
+
+    def bind(constant) -> str:
+        name = f'v{len(names)}'
+        names[name] = constant
+        return name
+
+    def value_of(comparison: Comparison) -> str:
+        return (f'county.{comparison.section.lower()}.get('
+                f'{bind(comparison.label)}, nan)')
+
+    return _compile('county', _source(expression, value_of, 'county.state',
+                                      bind), names)
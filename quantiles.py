@@ -0,0 +1,215 @@
+from bisect import bisect_left, bisect_right
+from itertools import islice
+import math
+
+# Quantiles and histograms of a field over a set of counties.
+#
+# The q-quantile of n values is the value at position ceil(q * n) (counting
+# from 1) in sorted order, or the smallest value for q = 0: the smallest
+# value that at least a fraction q of the values are less than or equal
+# to.  The median is the 0.5-quantile, so with an even number of values it
+# is the lower of the two middle ones.  Counties without a value for the
+# field are left out.
+#
+# Over the whole table, quantiles are read straight out of the field's
+# sorted values (the TableIndex ordering), and over a selection of at most
+# EXACT_COUNTIES counties the selected values are sorted, so both are
+# exact.  Only a larger selection (of a scaled data set) streams its values
+# through a KllSketch, which keeps a bounded number of them no matter how
+# many there are, and its quantiles are printed marked as estimates:
+#   - the sketch is exact while it has seen fewer than k values (k = 200
+#     by default);
+#   - past that, the rank of the value it returns is within about 1.7% of
+#     the count of the requested rank, 99% of the time (the error of the
+#     KLL sketch of Karnin, Lang and Liberty with k = 200), and it keeps
+#     about 3k values.  The smallest and largest values are always exact.
+# The sketch's coin flips come from a fixed seed, so the same values in
+# the same order always give the same answer.  benchmark.py's quantiles
+# command measures the error against exact answers (on the 10x synthetic
+# data set: at most 0.97% over 350 quantiles, 0.16% for the median one).
+#
+# Histograms are always exact: the values are split into equal-width bins
+# between the smallest and the largest, and counted.
+
+
+# How many values a KllSketch keeps at its top level by default.
+SKETCH_K = 200
+
+# The most counties a selection may have for its quantiles to be found by
+# sorting its values; sorting this many doubles takes a fraction of a
+# second, and larger selections use a KllSketch.
+EXACT_COUNTIES = 250000
+
+
+# Find the position of the q-quantile among some sorted values.
+# input: how many values there are (at least 1)
+# input: the quantile as a float from 0 to 1
+# output: the position, counting from 0
+def quantile_position(count: int, q: float) -> int:
+    return max(math.ceil(q * count) - 1, 0)
+
+
+# Find the q-quantile of some sorted values.
+# input: the values, sorted (a list or array, not empty)
+# input: the quantile as a float from 0 to 1
+# output: the value
+def sorted_quantile(values, q: float):
+    return values[quantile_position(len(values), q)]
+
+
+class KllSketch:
+    __slots__ = ('k', 'count', 'low', 'high', '_levels', '_capacities',
+                 '_size', '_limit', '_random')
+
+    # Initialize a new, empty KllSketch.
+    # input: how many values to keep at the top level; the error shrinks
+    #        in proportion to 1 / k
+    # input: the seed of the coin flips
+    def __init__(self, k: int = SKETCH_K, seed: int = 0):
+        import random
+        self.k = k
+        self.count = 0
+        self.low = None
+        self.high = None
+        self._levels = [[]]
+        self._capacities = [k]
+        self._size = 0
+        self._limit = k
+        self._random = random.Random(seed)
+
+
+    # Add a level on top.  The levels may hold k values at the top, and
+    # 2/3 as many at every level below it (but at least 8) before they are
+    # compacted.
+    def _grow(self):
+        self._levels.append([])
+        height = len(self._levels)
+        self._capacities = [max(math.ceil(self.k * (2 / 3) ** depth), 8)
+                            for depth in range(height - 1, -1, -1)]
+        self._limit = sum(self._capacities)
+
+
+    # Add a value to the sketch.
+    # input: the value (a number, not NaN)
+    # output: None
+    def update(self, value):
+        if self.count == 0:
+            self.low = self.high = value
+        elif value < self.low:
+            self.low = value
+        elif value > self.high:
+            self.high = value
+        self.count += 1
+        self._levels[0].append(value)
+        self._size += 1
+        if self._size >= self._limit:
+            self._compress()
+
+
+    # Add every value of an iterable to the sketch, the same as calling
+    # update for each, but a block at a time: as many values as fit before
+    # the next compaction.
+    # input: the values
+    # output: None
+    def extend(self, values):
+        values = iter(values)
+        while True:
+            block = list(islice(values, self._limit - self._size))
+            if not block:
+                break
+            low, high = min(block), max(block)
+            if self.count == 0 or low < self.low:
+                self.low = low
+            if self.count == 0 or high > self.high:
+                self.high = high
+            self.count += len(block)
+            self._levels[0].extend(block)
+            self._size += len(block)
+            if self._size >= self._limit:
+                self._compress()
+
+
+    # Compact the lowest levels that are over capacity: sort a level, and
+    # move every other value of it (starting from the first or the second,
+    # by a coin flip) up a level, where each value stands for twice as
+    # many.  An odd value out stays where it is.
+    def _compress(self):
+        for level in range(len(self._levels)):
+            values = self._levels[level]
+            if len(values) < self._capacities[level]:
+                continue
+            if level + 1 == len(self._levels):
+                self._grow()
+            values.sort()
+            kept = [values.pop()] if len(values) % 2 else []
+            offset = self._random.getrandbits(1)
+            self._levels[level + 1].extend(values[offset::2])
+            self._levels[level] = kept
+            self._size -= len(values) // 2
+            if self._size < self._limit:
+                break
+
+
+    # Estimate the q-quantile of the values added so far (exact while
+    # fewer than k values have been added).
+    # input: the quantile as a float from 0 to 1
+    # output: the value, or None if the sketch is empty
+    def quantile(self, q: float):
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.low
+        if q >= 1:
+            return self.high
+        weighted = sorted((value, 1 << level)
+                          for level, values in enumerate(self._levels)
+                          for value in values)
+        target = quantile_position(self.count, q) + 1
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return value
+        return self.high
+
+
+# Split the range of some values into equal-width bins.  Each bin holds
+# the values from its lower edge up to (but not including) the next edge;
+# the last one also holds the largest value.
+# input: the smallest and largest value
+# input: how many bins (at least 1)
+# output: the bins' edges as a list of bins + 1 floats, from the smallest
+#         value to the largest
+def bin_edges(low, high, bins: int) -> list[float]:
+    low = float(low)
+    width = float(high) - low
+    return [low + width * i / bins for i in range(bins)] + [float(high)]
+
+
+# Find the bin a value falls in.
+# input: the bins' edges
+# input: the value (between the first and the last edge)
+# output: the bin's position, counting from 0
+def bin_of(edges: list[float], value) -> int:
+    return min(max(bisect_right(edges, value) - 1, 0), len(edges) - 2)
+
+
+# Count the values in each bin, streaming over them.
+# input: the bins' edges
+# input: the values (an iterable of numbers)
+# output: the counts as a list of ints
+def count_bins(edges: list[float], values) -> list[int]:
+    counts = [0] * (len(edges) - 1)
+    for value in values:
+        counts[bin_of(edges, value)] += 1
+    return counts
+
+
+# Count the values in each bin, out of all of the values sorted.
+# input: the bins' edges
+# input: the values, sorted (a list or array)
+# output: the counts as a list of ints
+def count_sorted_bins(edges: list[float], values) -> list[int]:
+    starts = [bisect_left(values, edge) for edge in edges[1:-1]]
+    return [stop - start for start, stop
+            in zip([0] + starts, starts + [len(values)])]
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+import os
+import pickle
+
+# A bounded, least-recently-used cache of query results for ops_plan.
+# Keys are built from the normalized set of filters that produced a set of
+# counties, so scripts that share a filter prefix (or apply the same
+# filters in another order) reuse each other's row sets and aggregates.
+#
+# Every entry has a size (the number of row numbers it holds, or 1 for a
+# single number); once the total size goes over the budget, the least
+# recently used entries are evicted.  The cache can be saved to and loaded
+# from a file so that repeated batch runs start warm.
+
+FORMAT = 1
+
+
+class QueryCache:
+    # Initialize a new, empty QueryCache.
+    # input: the total size the entries may take up
+    def __init__(self, max_size: int = 1_000_000):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    # Look up an entry, marking it as recently used.
+    # input: the key
+    # output: the cached value, or None if there is none
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+
+    # Add or replace an entry, evicting old entries to stay in budget.
+    # Entries bigger than the whole budget are not stored.
+    # input: the key
+    # input: the value
+    # input: the size of the value
+    # output: None
+    def put(self, key, value, size: int = 1):
+        size = max(size, 1)
+        if size > self.max_size:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+
+    # Remove every entry (the counters are kept).
+    # input: no input
+    # output: None
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+
+    # Summarize how well the cache has worked.
+    # input: no input
+    # output: a dictionary of the entry count, size and counters
+    def stats(self) -> dict:
+        return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+    # Save the entries to a file.
+    # input: the path of the file as a string
+    # input: a value identifying the data the results were computed from;
+    #        load only accepts the file back with an equal stamp
+    # output: None
+    def save(self, path: str, stamp):
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            pickle.dump((FORMAT, stamp, [(key, value, size) for key,
+                        (value, size) in self._entries.items()]), file)
+        os.replace(temporary, path)
+
+
+    # Load entries saved by save, if the file exists and was saved for the
+    # same data.  Loaded entries count as the least recently used.
+    # input: the path of the file as a string
+    # input: the stamp of the current data
+    # output: True if the entries were loaded
+    def load(self, path: str, stamp) -> bool:
+        try:
+            with open(path, 'rb') as file:
+                version, saved_stamp, entries = pickle.load(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+        if version != FORMAT or saved_stamp != stamp:
+            return False
+        for key, value, size in reversed(entries):
+            if key not in self._entries and self.size + size <= self.max_size:
+                self._entries[key] = (value, size)
+                self._entries.move_to_end(key, last=False)
+                self.size += size
+        return True
@@ -0,0 +1,46 @@
+import asyncio
+import sys
+
+import query_server
+
+# A thin client for query_server.py that keeps the hw4.py command line:
+#   python query_client.py <file>
+# runs the .ops file on the server and prints the same output hw4.py would.
+# The server's socket is taken from HW4_SOCKET (see query_server).
+
+
+# Function to get the file name from command-line arguments.
+# Parameters:
+# None
+# Returns: The name of the file provided as a command-line argument (data type str).
+def get_file_name() -> str:
+    if len(sys.argv) != 2:
+        print("Please provide one file name")
+        sys.exit()
+    filename = sys.argv[1]
+
+    try:
+        with open(filename, 'r'):
+            pass
+    except IOError:
+        print("Please provide a valid file name")
+        sys.exit()
+
+    return filename
+
+
+def main():
+    filename = get_file_name()
+    with open(filename, 'r') as file:
+        text = file.read()
+    path = query_server.default_socket_path()
+    try:
+        asyncio.run(query_server.send_script(text, sys.stdout, path))
+    except (ConnectionError, FileNotFoundError):
+        print(f"Could not connect to the query server on {path}; "
+              f"start it with: python query_server.py")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import socket
+import stat
+import struct
+import sys
+
+import build_data
+import ops_plan
+import query_cache
+
+# A long-running server that loads the county data set once and runs .ops
+# scripts sent to it over a Unix socket, so each script does not pay for
+# loading the data in a fresh process.
+#
+# Protocol: the client sends one frame holding the script's text and the
+# server answers with frames holding the script's output as it is
+# produced, then an empty frame.  A frame is a 4-byte big-endian length
+# followed by that many bytes of UTF-8.
+#
+# Clients are served concurrently by asyncio; the scripts themselves run
+# one at a time on a single worker thread, since they share the table,
+# its index and the result cache.
+#
+# Usage:
+#   python query_server.py [socket path]          start the server
+#   python query_client.py <file>                 run a script on it
+
+_FRAME = struct.Struct('>I')
+
+
+# The socket the server listens on unless told otherwise.
+# input: no input
+# output: the path as a string
+def default_socket_path() -> str:
+    return os.environ.get('HW4_SOCKET',
+                          f'/tmp/hw4-{os.getuid()}.sock')
+
+
+# Read one frame from a stream.
+# input: an asyncio.StreamReader
+# output: the frame's bytes, or None if the stream ended first
+async def read_frame(reader: asyncio.StreamReader):
+    try:
+        header = await reader.readexactly(_FRAME.size)
+        return await reader.readexactly(_FRAME.unpack(header)[0])
+    except asyncio.IncompleteReadError:
+        return None
+
+
+# Build a frame.
+# input: the bytes to send
+# output: the framed bytes
+def frame(data: bytes) -> bytes:
+    return _FRAME.pack(len(data)) + data
+
+
+# A file-like object that forwards everything written to it to a client,
+# from the worker thread, as frames on the event loop.
+class FrameWriter:
+    # Initialize a new FrameWriter.
+    # input: the event loop the client's StreamWriter belongs to
+    # input: the client's asyncio.StreamWriter
+    def __init__(self, loop, writer: asyncio.StreamWriter):
+        self._loop = loop
+        self._writer = writer
+        self._pending = []
+
+
+    def write(self, text: str) -> int:
+        self._pending.append(text)
+        if text.endswith('\n') and len(self._pending) >= 64:
+            self.flush()
+        return len(text)
+
+
+    def flush(self):
+        if self._pending:
+            data = frame(''.join(self._pending).encode('utf-8'))
+            self._pending = []
+            self._loop.call_soon_threadsafe(self._writer.write, data)
+
+
+# Make way for a server on a socket path: a socket left behind by a server
+# that is no longer running is removed, but a live server (or anything that
+# is not a socket) is left alone.
+# input: the path of the Unix socket
+# output: None; throws FileExistsError if the path cannot be used
+async def remove_stale_socket(path: str):
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except ConnectionRefusedError:
+        os.remove(path)
+        return
+    writer.close()
+    raise FileExistsError(f"a query server is already listening on {path}")
+
+
+class QueryServer:
+    # Initialize a new QueryServer and load the data set.
+    # input: the path of the Unix socket to listen on
+    def __init__(self, path: str):
+        self.path = path
+        self.cache = query_cache.QueryCache()
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        build_data.get_index()
+
+
+    # Run one client's script on the worker thread.
+    # input: the script as UTF-8 bytes
+    # input: the FrameWriter for the client
+    # output: None
+    def run(self, request: bytes, out: FrameWriter):
+        try:
+            ops_plan.run_script(request.decode('utf-8'), build_data.get_data(),
+                                out, build_data.get_index(), self.cache)
+        except Exception as e:
+            print(f"The server could not run the script: {e}", file=out)
+        out.flush()
+
+
+    # Serve one client connection.
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            request = await read_frame(reader)
+            if request is not None:
+                out = FrameWriter(loop, writer)
+                await loop.run_in_executor(self._worker, self.run, request,
+                                           out)
+                writer.write(frame(b''))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    # Listen for clients until cancelled.  Throws FileExistsError if
+    # another server is already listening on the socket.
+    async def serve_forever(self):
+        await remove_stale_socket(self.path)
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        print(f"Serving {len(build_data.get_data())} counties on {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+# Send a script to a running server and stream its output.
+# input: the script as a string
+# input: the stream to write the output to
+# input: the path of the server's socket
+# output: None
+async def send_script(text: str, out, path: str):
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write(frame(text.encode('utf-8')))
+        await writer.drain()
+        while True:
+            data = await read_frame(reader)
+            if not data:
+                break
+            out.write(data.decode('utf-8'))
+            out.flush()
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else default_socket_path()
+    try:
+        asyncio.run(QueryServer(path).serve_forever())
+    except FileExistsError as e:
+        print(f"Could not start the query server: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,166 @@
+from itertools import accumulate
+from typing import NamedTuple
+
+from county_table import CountyTable, POPULATION, column_name
+
+# A population-weighted sample of the counties, stratified by state, for
+# answering population and percent queries approximately.
+#
+# The sample is allocated to the states in proportion to their 2014
+# population (at least two draws each, so every state has a variance
+# estimate), and within a state counties are drawn with replacement with
+# probability proportional to their population.  Every draw carries the
+# expansion factor 1 / (draws in its state * its probability), so a total
+# over any set of counties is estimated by adding up factor * value over
+# the draws in the set (the Hansen-Hurwitz estimator), and its variance
+# from how much those terms spread within each state.  Percentages are
+# ratios of two estimated totals, and their variance is estimated by
+# linearization.  Intervals use the normal approximation.
+#
+# For a sub-population, factor * value is the state's population times the
+# county's percentage / 100, so the estimate only needs the percentages of
+# the sampled counties; states with a single county are always exact.
+#
+# random and statistics are imported when a sample is first drawn or used,
+# so exact runs never pay for them.
+
+
+# An estimated value and the ends of its confidence interval.
+class Estimate(NamedTuple):
+    value: float
+    low: float
+    high: float
+
+
+# Totals estimated from the sample for one set of counties.
+class Estimates(NamedTuple):
+    counties: Estimate
+    population: Estimate
+    sub_populations: dict
+    percentages: dict
+
+
+class StratifiedSample:
+    # Draw a new StratifiedSample.  The same table, size and seed always
+    # give the same sample.
+    # input: the CountyTable to sample
+    # input: how many draws to make in total (states get at least two)
+    # input: the seed for the random draws
+    # input: an optional table_index.TableIndex of the table, for its
+    #        state index
+    def __init__(self, table: CountyTable, size: int = 1000, seed: int = 0,
+                 index=None):
+        import random
+
+        self.table = table
+        self.size = size
+        self.seed = seed
+        if index is not None:
+            strata = index.states
+        else:
+            strata = {}
+            for row, state in enumerate(table.states):
+                strata.setdefault(state, []).append(row)
+
+        populations = table.column(*POPULATION)
+        total = table.total(column_name(*POPULATION))
+        generator = random.Random(seed)
+        self.strata = {}
+        for state, rows in strata.items():
+            weights = [populations[row] if populations[row] > 0 else 0
+                       for row in rows]
+            state_total = sum(weights)
+            if state_total <= 0:
+                continue
+            draws = max(2, round(size * state_total / total))
+            drawn = generator.choices(rows, cum_weights=list(
+                    accumulate(weights)), k=draws)
+            self.strata[state] = (drawn, [state_total /
+                                          (draws * populations[row])
+                                          for row in drawn])
+        self.rows = sorted({row for drawn, _ in self.strata.values()
+                            for row in drawn})
+
+
+    # Estimate the number of counties, their total population and the
+    # sub-populations and percentages of some fields for a set of counties.
+    # Only the sampled counties in the set matter; counties missing a
+    # field count as 0 for it.
+    # input: the row numbers of the counties (any subset of self.rows)
+    # input: the percentage fields as a list of (section, label) pairs
+    # input: the confidence level of the intervals (between 0 and 1)
+    # output: the Estimates
+    def estimate(self, rows, fields, confidence: float = 0.95) -> Estimates:
+        from statistics import NormalDist
+
+        table = self.table
+        selected = set(rows)
+        populations = table.column(*POPULATION)
+        columns = [table.column(*field) if column_name(*field) in
+                   table.columns else None for field in fields]
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        # For each quantity, a list per state of the draws' terms.
+        counts = []
+        totals = []
+        subs = [[] for _ in fields]
+        for drawn, factors in self.strata.values():
+            count_terms = []
+            population_terms = []
+            sub_terms = [[] for _ in fields]
+            for row, factor in zip(drawn, factors):
+                if row not in selected:
+                    factor = 0.0
+                count_terms.append(factor)
+                population_terms.append(factor * populations[row])
+                for terms, column in zip(sub_terms, columns):
+                    value = column[row] if column is not None else 0.0
+                    if value != value:
+                        value = 0.0
+                    terms.append(factor * value / 100 * populations[row])
+            counts.append(count_terms)
+            totals.append(population_terms)
+            for strata, terms in zip(subs, sub_terms):
+                strata.append(terms)
+
+        population = _total(totals, z)
+        sub_populations = {}
+        percentages = {}
+        for field, strata in zip(fields, subs):
+            sub_populations[field] = _total(strata, z)
+            percentages[field] = _ratio(strata, totals,
+                                        population.value, z)
+        return Estimates(_total(counts, z), population, sub_populations,
+                         percentages)
+
+
+# The estimated variance of a total, from the terms of each state.
+def _variance(strata) -> float:
+    variance = 0.0
+    for terms in strata:
+        draws = len(terms)
+        mean = sum(terms) / draws
+        variance += draws / (draws - 1) * sum((term - mean) ** 2
+                                               for term in terms)
+    return variance
+
+
+# Estimate a total and its interval from the terms of each state.
+def _total(strata, z: float) -> Estimate:
+    value = sum(sum(terms) for terms in strata)
+    margin = z * _variance(strata) ** 0.5
+    return Estimate(value, value - margin, value + margin)
+
+
+# Estimate a percentage (a ratio of two totals) and its interval from the
+# terms of each state.
+def _ratio(numerators, denominators, denominator: float,
+           z: float) -> Estimate:
+    if denominator == 0:
+        return Estimate(0.0, 0.0, 0.0)
+    ratio = sum(sum(terms) for terms in numerators) / denominator
+    residuals = [[top - ratio * bottom for top, bottom in zip(tops, bottoms)]
+                 for tops, bottoms in zip(numerators, denominators)]
+    margin = z * _variance(residuals) ** 0.5 / denominator
+    return Estimate(ratio * 100, (ratio - margin) * 100,
+                    (ratio + margin) * 100)
@@ -0,0 +1,291 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from county_table import CountyTable, HEADCOUNTS, POPULATION, column_name
+
+# A compiled, binary copy of a CountyTable, so that loading the data set
+# does not have to unpickle and convert the whole report every time.
+#
+# File layout (all integers little-endian, every block 8-byte aligned):
+#   header    magic, format version, byte order of the doubles, mtime,
+#             size and SHA-256 of the source .data file, length and CRC-32
+#             of the metadata block
+#   metadata  JSON describing the sections, integral columns and the
+#             offset and CRC-32 of every block below, plus the whole-table
+#             and per-state totals of the population and head-count
+#             columns (see CountyTable.total) and the statistics of every
+#             other column (see CountyTable.column_statistics)
+#   columns   one block of row-count native doubles per numeric column
+#   strings   for the county and state names: a block of row-count + 1
+#             uint32 offsets followed by the UTF-8 text they index into
+#
+# Column blocks are used in place (through memoryview.cast), so loading
+# a compiled file does no per-value decoding.  load_table maps the file
+# read-only, so the columns are never copied into the process at all and
+# every process that loads the same file shares its page-cache pages.
+# Every column's checksum is verified when the file is loaded (about a
+# millisecond for the whole data set), so a damaged file is rejected, and
+# rebuilt, before any query runs rather than partway through one; the
+# columns of a section are only cast to doubles when the table first
+# materializes that section.
+
+MAGIC = b'CNTYTBL\0'
+VERSION = 4
+
+_HEADER = struct.Struct('<8sI4sqq32sII')
+
+# Where the source's mtime sits in the header.
+_MTIME = struct.Struct('<q')
+_MTIME_OFFSET = 16
+
+
+class CacheError(Exception):
+    ''' Thrown when a compiled table file is damaged or unusable.'''
+
+
+# Compute the SHA-256 digest of a file.  hashlib is only imported here,
+# since a fresh table is loaded without hashing anything.
+# input: the path of the file as a string
+# output: the digest as bytes
+def file_digest(path: str) -> bytes:
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+# Describe the source file a compiled table was built from.
+# input: the path of the source .data file, or None
+# output: (mtime in nanoseconds, size in bytes, SHA-256 digest)
+def _source_stamp(source_path):
+    if source_path is None or not os.path.exists(source_path):
+        return 0, 0, bytes(32)
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size, file_digest(source_path)
+
+
+def _pad(length: int) -> bytes:
+    return bytes(-length % 8)
+
+
+# Write a CountyTable out as a compiled table file.  The file is written
+# next to its final name and then renamed, so readers never see half of it.
+# input: the CountyTable to write
+# input: the path of the compiled file as a string
+# input: the path of the source .data file it was built from, or None
+# output: None
+def write_table(table: CountyTable, path: str, source_path=None):
+    rows = len(table)
+    blocks = []
+    offset = 0
+
+    def add_block(data: bytes) -> int:
+        nonlocal offset
+        start = offset
+        blocks.append(data)
+        blocks.append(_pad(len(data)))
+        offset += len(data) + len(blocks[-1])
+        return start
+
+    table.load_all()
+    columns = {}
+    for name, column in table.columns.items():
+        if len(column) != rows:
+            raise CacheError(f'column {name} has {len(column)} values, '
+                             f'expected {rows}')
+        data = bytes(column)
+        columns[name] = [add_block(data), zlib.crc32(data)]
+
+    totals = {}
+    for name in [column_name(*POPULATION)] + \
+            [column_name(HEADCOUNTS, label)
+             for label in table.labels(HEADCOUNTS)]:
+        table.total(name)
+        totals[name] = table.totals[name]
+
+    statistics = {name: table.column_statistics(name)
+                  for name in table.columns
+                  if not name.startswith(HEADCOUNTS + '.')}
+
+    strings = {}
+    for name in ('counties', 'states'):
+        encoded = [value.encode('utf-8') for value in getattr(table, name)]
+        ends = [0]
+        for value in encoded:
+            ends.append(ends[-1] + len(value))
+        strings[name] = [add_block(struct.pack(f'<{rows + 1}I', *ends)),
+                         add_block(b''.join(encoded))]
+
+    metadata = json.dumps({
+            'rows': rows,
+            'sections': table.sections,
+            'integral': sorted(table.integral),
+            'columns': columns,
+            'totals': totals,
+            'statistics': statistics,
+            'strings': strings
+        }).encode('utf-8')
+    metadata += b' ' * (-len(metadata) % 8)
+    mtime, size, digest = _source_stamp(source_path)
+    header = _HEADER.pack(MAGIC, VERSION, sys.byteorder[:4].encode('ascii'),
+                          mtime, size, digest, len(metadata),
+                          zlib.crc32(metadata))
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(header)
+            file.write(metadata)
+            for block in blocks:
+                file.write(block)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+# Check whether a compiled header still matches its source file.  The
+# cheap mtime and size check is tried first; the source is only hashed
+# when they differ (and load_table then records the new mtime, so the
+# next load is back to the cheap check).
+# input: the mtime, size and digest recorded in the header
+# input: the path of the source .data file, or None
+# output: True if the compiled file is still current
+def _is_current(mtime: int, size: int, digest: bytes, source_path) -> bool:
+    if source_path is None or not os.path.exists(source_path):
+        return True
+    stat = os.stat(source_path)
+    if stat.st_mtime_ns == mtime and stat.st_size == size:
+        return True
+    return stat.st_size == size and file_digest(source_path) == digest
+
+
+# Decode one of the string columns of a compiled table.
+def _read_strings(view: memoryview, base: int, rows: int, offsets: int,
+                  text: int) -> list[str]:
+    ends = view[base + offsets:base + offsets + 4 * (rows + 1)].cast('I')
+    raw = bytes(view[base + text:base + text + ends[rows]])
+    return [sys.intern(raw[ends[i]:ends[i + 1]].decode('utf-8'))
+            for i in range(rows)]
+
+
+# Build a CountyTable over the bytes of a compiled table file.  Numeric
+# columns are views into the buffer, not copies, and are only created when
+# their section is first used.
+# input: the contents of the file (any buffer)
+# input: the path of the source .data file, or None to skip the check
+# output: the CountyTable, or None if the file is out of date
+def table_from_buffer(buffer, source_path=None):
+    view = memoryview(buffer)
+    if len(view) < _HEADER.size:
+        raise CacheError('compiled table is truncated')
+    magic, version, byteorder, mtime, size, digest, metadata_length, crc = \
+            _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise CacheError('not a compiled county table')
+    if version != VERSION or byteorder != sys.byteorder[:4].encode('ascii'):
+        return None
+    if not _is_current(mtime, size, digest, source_path):
+        return None
+    base = _HEADER.size
+    metadata = view[base:base + metadata_length]
+    if zlib.crc32(metadata) != crc:
+        raise CacheError('compiled table is corrupt (checksum mismatch)')
+
+    metadata = json.loads(bytes(metadata))
+    rows = metadata['rows']
+    base += metadata_length
+    integral = set(metadata['integral'])
+    blocks = {}
+    for name, (start, crc) in metadata['columns'].items():
+        block = view[base + start:base + start + 8 * rows]
+        if len(block) != 8 * rows:
+            raise CacheError('compiled table is truncated')
+        if zlib.crc32(block) != crc:
+            raise CacheError(f'compiled table is corrupt (checksum '
+                             f'mismatch in {name})')
+        blocks[name] = block
+
+    def load_section(section):
+        columns = {}
+        for label in metadata['sections'][section]:
+            name = section + '.' + label
+            columns[name] = blocks[name].cast('d')
+        return columns, integral.intersection(columns)
+
+    strings = {name: _read_strings(view, base, rows, *blocks)
+               for name, blocks in metadata['strings'].items()}
+    table = CountyTable(
+            strings['counties'],
+            strings['states'],
+            metadata['sections'],
+            load_section
+        )
+    for name, (whole, by_state) in metadata['totals'].items():
+        table.totals[name] = (whole, by_state)
+    for name, (present, points) in metadata['statistics'].items():
+        table.statistics[name] = (present, points)
+    return table
+
+
+# Record the source's current mtime in a compiled file's header, after its
+# contents were found to be unchanged (say, after a touch or a checkout).
+# The file is left as it is if it cannot be written.
+# input: the path of the compiled file as a string
+# input: the header's bytes
+# input: the path of the source .data file, or None
+# output: None
+def _refresh_stamp(path: str, header, source_path):
+    if source_path is None or not os.path.exists(source_path):
+        return
+    mtime = _HEADER.unpack_from(header)[3]
+    current = os.stat(source_path).st_mtime_ns
+    if current == mtime:
+        return
+    try:
+        with open(path, 'r+b') as file:
+            file.seek(_MTIME_OFFSET)
+            file.write(_MTIME.pack(current))
+    except OSError:
+        pass
+
+
+# Map a compiled table file read-only into memory.
+# input: the path of the compiled file as a string
+# output: the mmap object, or None if the file cannot be mapped
+def map_file(path: str):
+    try:
+        with open(path, 'rb') as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+# Load a compiled table file if it exists and is current.  The numeric
+# columns of the returned table are views into a shared, read-only memory
+# map of the file.
+# input: the path of the compiled file as a string
+# input: the path of the source .data file, or None to skip the check
+# output: the CountyTable, or None if there is no usable compiled file
+def load_table(path: str, source_path=None):
+    buffer = map_file(path)
+    if buffer is None:
+        return None
+    try:
+        table = table_from_buffer(buffer, source_path)
+    except (CacheError, ValueError, KeyError, struct.error):
+        table = None
+    if table is None:
+        try:
+            buffer.close()
+        except BufferError:
+            pass
+    else:
+        _refresh_stamp(path, buffer[:_HEADER.size], source_path)
+    return table
@@ -0,0 +1,93 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+from county_table import CountyTable
+
+# Indexes over a CountyTable for answering filters without scanning it:
+#   a hash index from state abbreviation to the row numbers of its
+#   counties, built when the TableIndex is created, and
+#   for each numeric field, the row numbers sorted by the field's value
+#   (missing values left out) together with the sorted values, so a
+#   threshold filter is a bisect.  These are built the first time a field
+#   is filtered on (or ranked by), so fields (and sections) nobody filters
+#   on are never touched.
+
+
+class TableIndex:
+    # Initialize a new TableIndex and build its state index.
+    # input: the CountyTable to index
+    def __init__(self, table: CountyTable):
+        self.table = table
+        self.states = {}
+        for row, state in enumerate(table.states):
+            rows = self.states.get(state)
+            if rows is None:
+                rows = self.states[state] = array('l')
+            rows.append(row)
+        self._orders = {}
+
+
+    # Get the row numbers of the counties in a state.
+    # input: the two-letter state abbreviation
+    # output: the row numbers, in table order (do not modify)
+    def state_rows(self, state: str):
+        return self.states.get(state, ())
+
+
+    # Get the sorted ordering of a numeric field, building it if needed.
+    # input: the section name as a string
+    # input: the field label as a string
+    # output: (row numbers sorted by value, the sorted values)
+    def field_order(self, section: str, label: str) -> tuple:
+        key = (section, label)
+        order = self._orders.get(key)
+        if order is None:
+            column = self.table.column(section, label)
+            rows = sorted((row for row in range(len(column))
+                           if column[row] == column[row]),
+                          key=column.__getitem__)
+            order = (array('l', rows), array('d', map(column.__getitem__, rows)))
+            self._orders[key] = order
+        return order
+
+
+    # Get the counties whose field value is strictly greater than a
+    # threshold.
+    # input: the section name as a string
+    # input: the field label as a string
+    # input: the threshold as a float
+    # output: the row numbers, in order of increasing value
+    def greater_than(self, section: str, label: str, threshold: float):
+        rows, values = self.field_order(section, label)
+        if threshold != threshold:
+            return rows[:0]
+        return rows[bisect_right(values, threshold):]
+
+
+    # Get the counties whose field value is strictly less than a threshold.
+    # input: the section name as a string
+    # input: the field label as a string
+    # input: the threshold as a float
+    # output: the row numbers, in order of increasing value
+    def less_than(self, section: str, label: str, threshold: float):
+        rows, values = self.field_order(section, label)
+        if threshold != threshold:
+            return rows[:0]
+        return rows[:bisect_left(values, threshold)]
+
+
+    # Get the counties whose field value is among the k largest (or
+    # smallest), together with every county tied with the last of them.
+    # input: the section name as a string
+    # input: the field label as a string
+    # input: how many values to take
+    # input: True for the largest values, False for the smallest
+    # output: the row numbers, in table order
+    def extremes(self, section: str, label: str, k: int, largest: bool):
+        rows, values = self.field_order(section, label)
+        k = min(k, len(values))
+        if k <= 0:
+            return []
+        if largest:
+            return sorted(rows[bisect_left(values, values[-k]):])
+        return sorted(rows[:bisect_right(values, values[k - 1])])
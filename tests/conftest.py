@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'inputs'))
+
+from county_table import CountyTable
+
+
+# Run hw4.py on a script.
+# output: the finished subprocess.CompletedProcess
+def run_hw4(tmp_path, text: str, **environment):
+    script = tmp_path / 'script.ops'
+    script.write_text(text)
+    return subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'inputs', 'hw4.py'),
+             str(script)],
+            env=dict(os.environ, PYTHONPATH=ROOT, **environment),
+            capture_output=True, text=True)
+
+
+# Make a county dictionary shaped like the entries of get_report().
+def make_county(name: str, state: str, population: int, bachelors: float,
+                hispanic: float, poverty: float, income, older,
+                firms: float) -> dict:
+    county = {
+        'County': name,
+        'State': state,
+        'Age': {'Percent 65 and Older': older},
+        'Education': {"Bachelor's Degree or Higher": bachelors,
+                      'High School or Higher': 100 - bachelors / 2},
+        'Employment': {'Firms.Women-Owned': firms},
+        'Ethnicities': {'Hispanic or Latino': hispanic,
+                        'White Alone': 100 - hispanic},
+        'Income': {'Per Capita Income': income,
+                   'Persons Below Poverty Level': poverty,
+                   'Median Household Income': 2 * (income or 25000)},
+        'Population': {'2010 Population': population - 100,
+                       '2014 Population': population},
+    }
+    if income is None:
+        del county['Income']['Per Capita Income']
+    if older is None:
+        del county['Age']['Percent 65 and Older']
+    return county
+
+
+# A handful of counties over three states, one of them missing its
+# Per Capita Income and Percent 65 and Older.
+@pytest.fixture
+def counties() -> list[dict]:
+    return [
+        make_county('Alpha County', 'CA', 120000, 31.5, 40.2, 12.5, 31000,
+                    14.1, 28.0),
+        make_county('Beta County', 'CA', 45000, 18.0, 22.7, 19.1, 24000,
+                    19.8, 31.5),
+        make_county('Gamma County', 'TX', 300000, 27.3, 55.1, 16.4, None,
+                    None, 25.0),
+        make_county('Delta County', 'TX', 8000, 12.9, 71.0, 28.3, 19000,
+                    17.5, 22.2),
+        make_county('Epsilon County', 'VT', 21000, 38.8, 1.9, 9.6, 35000,
+                    21.3, 35.9),
+        make_county('Zeta County', 'VT', 6500, 24.4, 1.1, 13.0, 27000,
+                    23.0, 30.1),
+    ]
+
+
+@pytest.fixture
+def table(counties) -> CountyTable:
+    return CountyTable.from_counties(counties)
+
+
+# The real data set, loaded once for the tests that compare against it.
+@pytest.fixture(scope='session')
+def real_table() -> CountyTable:
+    import build_data
+    return build_data.get_data()
@@ -0,0 +1,100 @@
+import io
+
+import hw4
+import ops_plan
+import quantiles
+import table_index
+
+
+# Run a script with both engines of hw4 over the same table.
+# output: (the columnar engine's lines, the objects engine's lines)
+def run_both(table, text: str, monkeypatch, capsys) -> tuple:
+    out = io.StringIO()
+    ops_plan.run_script(text, table, out, table_index.TableIndex(table))
+    columnar = out.getvalue().splitlines()[1:]
+    monkeypatch.setattr(hw4, 'get_full_data', lambda: table)
+    capsys.readouterr()
+    hw4.execute_operations(list(ops_plan.validate_lines(text.splitlines())),
+                           engine='objects')
+    return columnar, capsys.readouterr().out.splitlines()
+
+
+def test_generic_fields_match(table, monkeypatch, capsys):
+    script = '\n'.join([
+            'filter-gt:Age.Percent 65 and Older:12',
+            'population:Employment.Firms.Women-Owned',
+            'percent:Age.Percent 65 and Older',
+            'filter-lt:Employment.Firms.Women-Owned:33',
+            'population-total',
+            'percent:Employment.Firms.Women-Owned',
+            'filter-gt:Age.Bogus:3',
+            'display'])
+    columnar, objects = run_both(table, script, monkeypatch, capsys)
+    assert columnar == objects
+    assert 'Filter: Age.Percent 65 and Older gt 12.0 (5 entries)' in objects
+    assert 'Filter: Employment.Firms.Women-Owned gt 33.0 (4 entries)' \
+            in objects
+
+
+def test_rankings_skip_missing_values(table, monkeypatch, capsys):
+    script = '\n'.join([
+            'top:Income.Per Capita Income:3',
+            'display',
+            'bottom:Income.Per Capita Income:10',
+            'population-total',
+            'top:Income.Bogus:2'])
+    columnar, objects = run_both(table, script, monkeypatch, capsys)
+    assert columnar == objects
+    assert 'Filter: top 3 by Income.Per Capita Income (3 entries)' \
+            in objects
+    assert 'Filter: bottom 10 by Income.Per Capita Income (3 entries)' \
+            in objects
+
+
+def test_statistics_skip_missing_values(table, monkeypatch, capsys):
+    script = '\n'.join([
+            'median:Income.Per Capita Income',
+            'quantile:Income.Per Capita Income:0.9',
+            'histogram:Income.Per Capita Income:2',
+            'filter-state:TX',
+            'median:Income.Per Capita Income',
+            'histogram:Income.Per Capita Income:3',
+            'median:Income.Bogus'])
+    columnar, objects = run_both(table, script, monkeypatch, capsys)
+    assert columnar == objects
+    assert 'Income.Per Capita Income median: 27000' in objects
+    assert 'Income.Per Capita Income histogram (1 entries)' in objects
+
+
+def test_only_large_selections_are_estimated(table, monkeypatch, capsys):
+    script = '\n'.join([
+            'median:Income.Per Capita Income',
+            'filter-state:VT',
+            'median:Income.Per Capita Income',
+            'display',
+            'filter-lt:Income.Per Capita Income:100000',
+            'quantile:Income.Per Capita Income:0.5'])
+    columnar, objects = run_both(table, script, monkeypatch, capsys)
+    assert columnar == objects
+    assert not any('~' in line for line in objects)
+    monkeypatch.setattr(quantiles, 'EXACT_COUNTIES', 1)
+    columnar, objects = run_both(table, script, monkeypatch, capsys)
+    assert columnar == objects
+    assert 'Income.Per Capita Income median: 27000' in objects
+    assert 'Income.Per Capita Income median: ~27000 (sketch estimate)' \
+            in objects
+
+
+def test_expressions_skip_missing_values(table, monkeypatch, capsys):
+    script = '\n'.join([
+            'filter-state:TX',
+            'filter:[Age.Percent 65 and Older] > 10 or state == CA',
+            'population-total',
+            'filter:[Age.Bogus] > 3',
+            'filter-between:Age.Percent 65 and Older:0:17'])
+    columnar, objects = run_both(table, script, monkeypatch, capsys)
+    assert columnar == objects
+    assert 'Filter: [Age.Percent 65 and Older] > 10 or state == CA ' \
+           '(1 entries)' in objects
+    assert 'Filter: Age.Percent 65 and Older between 0.0 and 17.0 ' \
+           '(0 entries)' in objects
@@ -0,0 +1,51 @@
+import io
+import re
+
+import pytest
+
+import hw4
+import ops_plan
+
+AGGREGATES = ['population-total',
+              'population:Ethnicities.Hispanic or Latino',
+              'percent:Income.Persons Below Poverty Level',
+              "percent:Education.Bachelor's Degree or Higher"]
+
+
+# Run a script on a table with the columnar engine.
+# output: its output lines after the first
+def run(table, lines: list) -> list:
+    out = io.StringIO()
+    ops_plan.run_script('\n'.join(lines), table, out)
+    return out.getvalue().splitlines()[1:]
+
+
+# Read the table a group-by prints.
+# output: dictionary of each group's values (as printed) by column name
+def read_groups(lines: list) -> dict:
+    header, *rows = [re.split(r'\s{2,}', line) for line in lines[1:]]
+    return {row[0]: dict(zip(header, row)) for row in rows}
+
+
+@pytest.mark.parametrize('filters', [
+        [], ['filter-gt:Education.High School or Higher:80']])
+def test_groups_match_filtered_states(real_table, filters):
+    groups = read_groups(run(real_table, filters + ['group-by:State'] +
+                             AGGREGATES)[len(filters):])
+    assert len(groups) > 30
+    for state, group in groups.items():
+        lines = run(real_table, filters + [f'filter-state:{state}'] +
+                    AGGREGATES)[len(filters):]
+        assert lines[0].endswith(f'({group["counties"]} entries)')
+        assert [line.split(': ')[1] for line in lines[1:]] == \
+               [group[aggregate] for aggregate in AGGREGATES]
+
+
+def test_objects_engine_groups_the_same(real_table, monkeypatch, capsys):
+    lines = ['filter-lt:Ethnicities.White Alone:90', 'group-by:State'] + \
+            AGGREGATES
+    columnar = run(real_table, lines)
+    monkeypatch.setattr(hw4, 'get_full_data', lambda: real_table)
+    capsys.readouterr()
+    hw4.execute_operations(lines, engine='objects')
+    assert capsys.readouterr().out.splitlines() == columnar
@@ -0,0 +1,110 @@
+import io
+import os
+import select
+import subprocess
+import sys
+
+import pytest
+
+import hw4
+import ops_plan
+import output_writers
+from conftest import ROOT, run_hw4
+
+
+def test_unknown_output_format_is_reported(tmp_path):
+    result = run_hw4(tmp_path, 'population-total\n', HW4_FORMAT='yaml')
+    assert result.returncode == 1
+    assert result.stderr == ''
+    assert result.stdout.splitlines() == [
+            "Please provide a valid HW4_FORMAT: unknown output format "
+            "'yaml'; choose from text, jsonl, csv, binary"]
+
+
+def test_unknown_engine_is_reported(tmp_path):
+    result = run_hw4(tmp_path, 'population-total\n', HW4_ENGINE='Objects')
+    assert result.returncode == 1
+    assert result.stderr == ''
+    assert result.stdout.splitlines() == [
+            "Please provide a valid HW4_ENGINE: unknown engine 'Objects'; "
+            "choose from columnar, objects"]
+
+
+def test_objects_engine_flushes_the_writer(table, monkeypatch, capsys):
+    monkeypatch.setattr(hw4, 'get_full_data', lambda: table)
+    stream = io.StringIO()
+    out = output_writers.TextWriter(stream)
+    monkeypatch.setattr(sys, 'stdout', stream)
+    lines = ['filter-state:CA', 'frobnicate', 'population-total',
+             'filter-gt:1']
+    hw4.execute_operations(ops_plan.validate_lines(lines, out),
+                           engine='objects', out=out)
+    assert stream.getvalue().splitlines() == [
+            'Filter: state == CA (2 entries)',
+            'There is an error on line 2: frobnicate is an invalid '
+            'operation',
+            '2014 population: 165000',
+            'There is an error on line 4, 1 is an incorrect number of '
+            'colons for filter-gt']
+
+
+def test_bad_number_settings_are_reported(tmp_path):
+    environment = dict(os.environ, HW4_WORKERS='two', PYTHONPATH=ROOT)
+    imported = subprocess.run(
+            [sys.executable, '-c',
+             'import sys; sys.path.insert(0, sys.argv[1]); import hw4',
+             os.path.join(ROOT, 'inputs')],
+            env=environment, capture_output=True, text=True)
+    assert imported.returncode == 0
+    result = run_hw4(tmp_path, 'population-total\n', HW4_WORKERS='two')
+    assert result.returncode == 1
+    assert result.stderr == ''
+    assert result.stdout.splitlines() == [
+            "Please provide a valid HW4_WORKERS: 'two' is not a valid int"]
+
+
+SCRIPT = '\n'.join(['filter-state:CA', 'frobnicate:1', 'population-total',
+                    'filter-gt:Education.High School or Higher', '',
+                    'percent:Income.Persons Below Poverty Level',
+                    'top:Income.Per Capita Income:x', 'display:now',
+                    'median:Income.Per Capita Income', 'bogus']) + '\n'
+
+
+@pytest.mark.parametrize('engine', ['columnar', 'objects'])
+def test_standard_input_matches_a_file(tmp_path, engine):
+    from_file = run_hw4(tmp_path, SCRIPT, HW4_ENGINE=engine)
+    streamed = subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'inputs', 'hw4.py'), '-'],
+            input=SCRIPT, env=dict(os.environ, PYTHONPATH=ROOT,
+                                   HW4_ENGINE=engine),
+            capture_output=True, text=True)
+    assert streamed.returncode == from_file.returncode == 0
+    assert streamed.stdout == from_file.stdout
+    errors = [line for line in streamed.stdout.splitlines()
+              if line.startswith('There ')]
+    assert len(errors) == 5
+
+
+def test_standard_input_is_streamed():
+    process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'inputs', 'hw4.py'), '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0,
+            env=dict(os.environ, PYTHONPATH=ROOT))
+    try:
+        # The population-total run ends when the next line arrives.
+        process.stdin.write(b'population-total\nfrobnicate\nfilter-state:CA\n')
+        lines = []
+        for _ in range(3):
+            ready, _, _ = select.select([process.stdout], [], [], 30)
+            assert ready, 'no output before the end of the input'
+            lines.append(process.stdout.readline().decode().rstrip('\n'))
+        assert lines[0] == '3143 counties loaded'
+        assert lines[1] == ('There is an error on line 2: frobnicate is an '
+                            'invalid operation')
+        assert lines[2].startswith('2014 population: ')
+        process.stdin.close()
+        assert process.stdout.read().decode() == \
+                'Filter: state == CA (156 entries)\n'
+    finally:
+        process.kill()
+        process.wait()
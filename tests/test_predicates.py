@@ -0,0 +1,138 @@
+import io
+import operator
+
+import pytest
+
+import ops_plan
+import predicates
+import table_index
+from predicates import AllOf, AnyOf, Comparison, StateIn
+
+INCOME = ('Income.Per Capita Income', 'Income', 'Per Capita Income')
+OPERATORS = {'<': operator.lt, '>': operator.gt, '<=': operator.le,
+             '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+
+def parse(text: str):
+    return predicates.parse(text, ops_plan.split_field)
+
+
+def field(name: str, op: str, value: float) -> Comparison:
+    return Comparison(name, *ops_plan.split_field(name), op, value)
+
+
+def test_and_binds_tighter_than_or():
+    first = field('Age.Percent 65 and Older', '>', 20.0)
+    second = field('Income.Per Capita Income', '<', 30000.0)
+    state = StateIn(('CA',), False)
+    assert parse('[Age.Percent 65 and Older] > 20 or '
+                 '[Income.Per Capita Income] < 30000 and state == CA') == \
+            AnyOf((first, AllOf((second, state))))
+    assert parse('([Age.Percent 65 and Older] > 20 or '
+                 '[Income.Per Capita Income] < 30000) and state == CA') == \
+            AllOf((AnyOf((first, second)), state))
+
+
+def test_ranges_and_swapped_sides():
+    assert parse('30 < [Age.Percent 65 and Older] <= 60') == \
+            AllOf((field('Age.Percent 65 and Older', '>', 30.0),
+                   field('Age.Percent 65 and Older', '<=', 60.0)))
+    assert parse('5 >= [Age.Percent 65 and Older]') == \
+            field('Age.Percent 65 and Older', '<=', 5.0)
+
+
+def test_not_is_pushed_into_the_tests():
+    older = 'Age.Percent 65 and Older'
+    assert parse(f'not [{older}] > 5') == field(older, '<=', 5.0)
+    assert parse(f'not not [{older}] > 5') == field(older, '>', 5.0)
+    assert parse(f'not ([{older}] == 5 and state in (TX, CA))') == \
+            AnyOf((field(older, '!=', 5.0), StateIn(('CA', 'TX'), True)))
+    assert parse(f'not ([{older}] != 5 or state not in (VT))') == \
+            AllOf((field(older, '==', 5.0), StateIn(('VT',), False)))
+    assert parse(f'not 30 < [{older}] < 60') == \
+            AnyOf((field(older, '<=', 30.0), field(older, '>=', 60.0)))
+
+
+@pytest.mark.parametrize('op', sorted(OPERATORS))
+def test_comparisons_skip_missing_values(table, op):
+    values = table.column('Income', 'Per Capita Income')
+    present = [row for row in range(len(table)) if values[row] == values[row]]
+    assert len(present) < len(table)
+    expected = [row for row in present if OPERATORS[op](values[row], 27000)]
+    negated = [row for row in present if row not in expected]
+    for text, rows in ((f'[{INCOME[0]}] {op} 27000', expected),
+                       (f'not [{INCOME[0]}] {op} 27000', negated)):
+        expression = parse(text)
+        test_row = predicates.row_predicate(expression, table)
+        test_county = predicates.object_predicate(expression)
+        assert [row for row in range(len(table)) if test_row(row)] == rows
+        assert [row for row in range(len(table))
+                if test_county(table[row])] == rows
+
+
+@pytest.mark.parametrize('text, message', [
+        ('[Age.Percent 65 and Older] >',
+         'expected a [field] or a number but found the end'),
+        ('[Age.Percent 65 and Older] > 5 and',
+         'expected a [field] or a number but found the end'),
+        ('[Age.Percent 65 and Older] > 5)', 'unexpected ) in the expression'),
+        ('([Age.Percent 65 and Older] > 5', 'expected ) but found the end'),
+        ('[Age.Percent 65 and Older] ~ 5', "cannot read the expression at "
+                                           "'~ 5'"),
+        ('5 > 3', '5.0 > 3.0 does not compare a field'),
+        ('[Age.Percent 65 and Older] < [Income.Per Capita Income]',
+         'cannot compare two fields'),
+        ('state in CA', 'expected ( but found CA')])
+def test_syntax_errors(text, message):
+    with pytest.raises(ValueError) as error:
+        parse(text)
+    assert str(error.value) == message
+
+
+def test_unknown_fields_are_reported(table):
+    out = io.StringIO()
+    ops_plan.run_script('filter:[Bogus.X] > 3\n'
+                        'filter:[Age.Bogus] > 3 or state == CA\n'
+                        'population-total\n', table, out)
+    assert out.getvalue().splitlines()[1:] == [
+            'There was an error when processing the filter:[Bogus.X] > 3 '
+            'line. Here are the details: Bogus.X cannot be filtered on',
+            'There was an error when processing the filter:[Age.Bogus] > 3 '
+            "or state == CA line. Here are the details: 'Bogus'",
+            '2014 population: 500500']
+
+
+# Run a script, with and without an index of the table.
+# output: (its output lines after the first, the rows left)
+def run(table, text: str) -> tuple:
+    results = []
+    for index in (None, table_index.TableIndex(table)):
+        out = io.StringIO()
+        rows = ops_plan.run_script(text, table, out, index)
+        results.append((out.getvalue().splitlines()[1:], list(rows)))
+    assert results[0] == results[1]
+    return results[0]
+
+
+@pytest.mark.parametrize('expression, chain', [
+        ("[Education.Bachelor's Degree or Higher] > 30 and "
+         "[Ethnicities.Hispanic or Latino] < 10",
+         ["filter-gt:Education.Bachelor's Degree or Higher:30",
+          'filter-lt:Ethnicities.Hispanic or Latino:10']),
+        ('20 < [Income.Persons Below Poverty Level] < 25',
+         ['filter-gt:Income.Persons Below Poverty Level:20',
+          'filter-lt:Income.Persons Below Poverty Level:25']),
+        ('not ([Education.High School or Higher] <= 75 or '
+         '[Age.Percent 65 and Older] >= 18) and state == CA',
+         ['filter-state:CA', 'filter-gt:Education.High School or Higher:75',
+          'filter-lt:Age.Percent 65 and Older:18'])])
+def test_expressions_match_chained_filters(real_table, expression, chain):
+    aggregates = ['population-total',
+                  'percent:Income.Persons Below Poverty Level']
+    lines, rows = run(real_table, '\n'.join([f'filter:{expression}'] +
+                                            aggregates))
+    chained_lines, chained_rows = run(real_table,
+                                      '\n'.join(chain + aggregates))
+    assert rows == chained_rows
+    assert 0 < len(rows) < len(real_table)
+    assert lines[-2:] == chained_lines[-2:]
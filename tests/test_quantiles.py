@@ -0,0 +1,75 @@
+from bisect import bisect_left, bisect_right
+import io
+import random
+
+import column_engine
+import ops_plan
+import quantiles
+
+# The rank error quantiles documents for the default k (99% of the time),
+# and the quantiles benchmark.py checks.
+BOUND = 0.017
+POINTS = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+# How far the rank of a value is from the rank of the q-quantile, as a
+# fraction of the number of values.
+def rank_error(ordered: list, value, q: float) -> float:
+    target = quantiles.quantile_position(len(ordered), q)
+    first = bisect_left(ordered, value)
+    last = bisect_right(ordered, value) - 1
+    if first <= target <= last:
+        return 0.0
+    return min(abs(first - target), abs(target - last)) / len(ordered)
+
+
+def test_sketch_is_exact_below_k():
+    values = [random.Random(1).uniform(0, 100)
+              for _ in range(quantiles.SKETCH_K - 1)]
+    ordered = sorted(values)
+    streamed = quantiles.KllSketch()
+    for value in values:
+        streamed.update(value)
+    blocked = quantiles.KllSketch()
+    blocked.extend(values)
+    for q in (0, 0.01, 0.25, 0.5, 0.5001, 0.9, 1):
+        assert streamed.quantile(q) == quantiles.sorted_quantile(ordered, q)
+        assert blocked.quantile(q) == quantiles.sorted_quantile(ordered, q)
+
+
+def test_sketch_error_is_within_bound():
+    draw = random.Random(7)
+    values = [draw.lognormvariate(10, 1) for _ in range(50000)]
+    sketch = quantiles.KllSketch(seed=3)
+    sketch.extend(values)
+    ordered = sorted(values)
+    assert sketch.count == len(values)
+    assert sketch.quantile(0) == ordered[0]
+    assert sketch.quantile(1) == ordered[-1]
+    for q in POINTS:
+        assert rank_error(ordered, sketch.quantile(q), q) <= BOUND
+    again = quantiles.KllSketch(seed=3)
+    again.extend(values)
+    assert [again.quantile(q) for q in POINTS] == \
+            [sketch.quantile(q) for q in POINTS]
+
+
+def test_small_selections_are_exact(real_table):
+    column = real_table.column('Income', 'Per Capita Income')
+    rows = [row for row in range(len(real_table)) if row % 3]
+    assert quantiles.SKETCH_K < len(rows) <= quantiles.EXACT_COUNTIES
+    ordered = sorted(column[row] for row in rows)
+    for q in POINTS:
+        value, exact = column_engine.field_quantile(
+                real_table, rows, 'Income', 'Per Capita Income', q)
+        assert exact
+        assert value == quantiles.sorted_quantile(ordered, q)
+    schooling = real_table.column('Education', 'High School or Higher')
+    median = quantiles.sorted_quantile(
+            sorted(column[row] for row in range(len(real_table))
+                   if schooling[row] > 20), 0.5)
+    out = io.StringIO()
+    ops_plan.run_script('filter-gt:Education.High School or Higher:20\n'
+                        'median:Income.Per Capita Income\n', real_table, out)
+    lines = out.getvalue().splitlines()
+    assert lines[-1] == f'Income.Per Capita Income median: {int(median)}'
@@ -0,0 +1,93 @@
+import io
+import os
+import pickle
+
+import build_data
+import ops_plan
+import query_cache
+import table_cache
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = query_cache.QueryCache(max_size=5)
+    cache.put('a', 1)
+    cache.put('b', [1, 2], size=2)
+    cache.put('c', 3)
+    assert cache.get('a') == 1
+    cache.put('d', [4, 5], size=2)
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == [1, 3, [4, 5]]
+    cache.put('e', list(range(6)), size=6)
+    assert cache.get('e') is None
+    cache.put('a', [1, 1, 1], size=3)
+    assert cache.get('c') is None
+    assert cache.stats() == {'entries': 2, 'size': 5, 'hits': 4,
+                             'misses': 3, 'evictions': 2}
+
+
+def test_script_runs_count_hits(table):
+    cache = query_cache.QueryCache()
+    script = ('filter-state:CA\n'
+              'filter-gt:Education.High School or Higher:80\n'
+              'population-total\n')
+    outputs = []
+    for _ in range(2):
+        out = io.StringIO()
+        ops_plan.run_script(script, table, out, cache=cache)
+        outputs.append(out.getvalue())
+    assert outputs[0] == outputs[1]
+    first_misses = cache.misses
+    assert cache.hits > 0 and first_misses > 0
+    out = io.StringIO()
+    ops_plan.run_script(script, table, out, cache=cache)
+    assert cache.misses == first_misses
+
+
+def test_saved_entries_load_back(tmp_path):
+    path = str(tmp_path / 'queries.cache')
+    cache = query_cache.QueryCache()
+    cache.put('old', 1)
+    cache.put('rows', [1, 2, 3], size=3)
+    cache.save(path, ('stamp', 1))
+    loaded = query_cache.QueryCache(max_size=4)
+    assert loaded.load(path, ('stamp', 1))
+    assert len(loaded) == 2 and loaded.size == 4
+    loaded.put('new', 2)
+    assert loaded.get('old') is None
+    assert loaded.get('rows') == [1, 2, 3]
+
+
+def test_stale_or_broken_files_are_not_loaded(tmp_path):
+    path = str(tmp_path / 'queries.cache')
+    cache = query_cache.QueryCache()
+    cache.put('key', 1)
+    cache.save(path, ('stamp', 1))
+    fresh = query_cache.QueryCache()
+    assert not fresh.load(path, ('stamp', 2))
+    assert not fresh.load(str(tmp_path / 'missing.cache'), ('stamp', 1))
+    with open(path, 'wb') as file:
+        pickle.dump((query_cache.FORMAT + 1, ('stamp', 1), []), file)
+    assert not fresh.load(path, ('stamp', 1))
+    with open(path, 'wb') as file:
+        file.write(b'not a pickle')
+    assert not fresh.load(path, ('stamp', 1))
+    assert len(fresh) == 0
+
+
+def test_data_stamp_follows_the_source(table, tmp_path, monkeypatch):
+    source = tmp_path / 'counties.data'
+    source.write_bytes(pickle.dumps('source'))
+    compiled = str(tmp_path / 'counties.table')
+    table_cache.write_table(table, compiled, str(source))
+    monkeypatch.setattr(build_data, 'SOURCE_PATH', str(source))
+    monkeypatch.setattr(build_data, 'COMPILED_PATH', compiled)
+    monkeypatch.setattr(build_data, 'get_data', lambda: table)
+    monkeypatch.setattr(build_data, '_stamp', None, raising=False)
+    stamp = build_data.data_stamp()
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert table_cache.load_table(compiled, str(source)) is not None
+    table_cache.write_table(table, compiled, str(source))
+    assert build_data.data_stamp() == stamp
+    source.write_bytes(pickle.dumps('other'))
+    assert build_data.data_stamp() != stamp
@@ -0,0 +1,69 @@
+import asyncio
+import io
+import os
+import socket
+
+import pytest
+
+import query_server
+
+
+# Start a server on a path and wait until it accepts connections.
+# output: the server's asyncio.Task
+async def start_server(path: str) -> asyncio.Task:
+    task = asyncio.create_task(query_server.QueryServer(path).serve_forever())
+    while True:
+        await asyncio.sleep(0.01)
+        try:
+            writer = (await asyncio.open_unix_connection(path))[1]
+        except (ConnectionRefusedError, FileNotFoundError):
+            continue
+        writer.close()
+        return task
+
+
+def test_live_server_is_left_alone(tmp_path):
+    path = str(tmp_path / 'hw4.sock')
+
+    async def check():
+        task = await start_server(path)
+        try:
+            with pytest.raises(FileExistsError):
+                await asyncio.wait_for(
+                        query_server.QueryServer(path).serve_forever(), 5)
+            out = io.StringIO()
+            await query_server.send_script('population-total\n', out, path)
+            assert out.getvalue().splitlines()[-1].startswith(
+                    '2014 population: ')
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(check())
+    assert not os.path.exists(path)
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / 'hw4.sock')
+    with socket.socket(socket.AF_UNIX) as stale:
+        stale.bind(path)
+
+    async def check():
+        task = await start_server(path)
+        try:
+            out = io.StringIO()
+            await query_server.send_script('population-total\n', out, path)
+            assert '2014 population: ' in out.getvalue()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(check())
+
+
+def test_other_files_are_not_removed(tmp_path):
+    path = tmp_path / 'hw4.sock'
+    path.write_text('keep me')
+    with pytest.raises(FileExistsError):
+        asyncio.run(query_server.remove_stale_socket(str(path)))
+    assert path.read_text() == 'keep me'
@@ -0,0 +1,57 @@
+import pytest
+
+import sampling
+from conftest import run_hw4
+from county_table import POPULATION, column_name
+
+FIELDS = [('Income', 'Persons Below Poverty Level'),
+          ('Education', 'High School or Higher')]
+
+
+def test_same_seed_gives_the_same_sample(real_table):
+    first = sampling.StratifiedSample(real_table, 400, seed=5)
+    second = sampling.StratifiedSample(real_table, 400, seed=5)
+    other = sampling.StratifiedSample(real_table, 400, seed=6)
+    assert first.strata == second.strata
+    assert first.rows == second.rows
+    assert first.rows != other.rows
+    rows = [row for row in first.rows if real_table.states[row] < 'M']
+    assert first.estimate(rows, FIELDS, 0.9) == \
+            second.estimate(rows, FIELDS, 0.9)
+
+
+def test_same_seed_gives_the_same_output(tmp_path):
+    script = ('filter-gt:Education.High School or Higher:80\n'
+              'population-total\n'
+              'percent:Income.Persons Below Poverty Level\n')
+    runs = [run_hw4(tmp_path, script, HW4_APPROXIMATE='1',
+                    HW4_SAMPLE_SIZE='300', HW4_SAMPLE_SEED=seed)
+            for seed in ('11', '11', '12')]
+    assert all(run.returncode == 0 and run.stderr == '' for run in runs)
+    assert runs[0].stdout == runs[1].stdout
+    assert runs[0].stdout != runs[2].stdout
+    assert '~' in runs[0].stdout
+
+
+def test_every_state_is_sampled(real_table):
+    sample = sampling.StratifiedSample(real_table, 100, seed=1)
+    populations = real_table.column(*POPULATION)
+    states = {state for state, population
+              in zip(real_table.states, populations) if population > 0}
+    assert set(sample.strata) == states
+    for state, (drawn, factors) in sample.strata.items():
+        assert len(drawn) == len(factors) >= 2
+        assert {real_table.states[row] for row in drawn} == {state}
+
+
+def test_full_sample_estimates_the_exact_population(real_table):
+    sample = sampling.StratifiedSample(real_table, len(real_table), seed=2)
+    total = real_table.total(column_name(*POPULATION))
+    estimates = sample.estimate(sample.rows, FIELDS)
+    assert estimates.population.value == pytest.approx(total, rel=1e-12)
+    assert estimates.population.high - estimates.population.low == \
+            pytest.approx(0, abs=1e-6 * total)
+    state = real_table.states[0]
+    rows = [row for row in sample.rows if real_table.states[row] == state]
+    assert sample.estimate(rows, []).population.value == pytest.approx(
+            real_table.total(column_name(*POPULATION), state), rel=1e-12)
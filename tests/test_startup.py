@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+import benchmark
+
+# Modules that only loading, hashing or sampling the data (or tracing and
+# parallel runs) need, none of which importing hw4 may pull in.
+DATA_ONLY_MODULES = {'hashlib', 'random', 'statistics', 'tracemalloc',
+                     'multiprocessing', 'parallel'}
+
+
+def test_importing_hw4_stays_within_its_budget():
+    environ = benchmark.startup_environment()
+    times = min((benchmark.import_times(environ) for _ in range(5)),
+                key=lambda times: times['hw4'])
+    assert not DATA_ONLY_MODULES & set(times)
+    assert times['hw4'] <= benchmark.IMPORT_BUDGET
+
+
+def test_importing_hw4_opens_no_data():
+    code = ('import sys; sys.path.insert(0, sys.argv[1]); opened = []; '
+            'sys.addaudithook(lambda event, args: event == "open" and '
+            'opened.append(str(args[0]))); '
+            'import hw4, build_data; print(*opened, sep="\\n"); '
+            'print(build_data._converted is None)')
+    result = subprocess.run([sys.executable, '-c', code, benchmark.INPUTS],
+                            env=benchmark.startup_environment(), check=True,
+                            capture_output=True, text=True)
+    *opened, unloaded = result.stdout.splitlines()
+    assert unloaded == 'True'
+    assert not [path for path in opened
+                if path.endswith(('.data', '.table'))]
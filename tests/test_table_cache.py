@@ -0,0 +1,85 @@
+import json
+import os
+import pickle
+
+import pytest
+
+import build_data
+import table_cache
+
+
+def _write(table, tmp_path):
+    source = tmp_path / 'counties.data'
+    source.write_bytes(pickle.dumps('source'))
+    path = tmp_path / 'counties.table'
+    table_cache.write_table(table, str(path), str(source))
+    return str(path), str(source)
+
+
+def test_written_table_loads_back(table, tmp_path):
+    path, source = _write(table, tmp_path)
+    loaded = table_cache.load_table(path, source)
+    assert loaded is not None
+    assert loaded.counties == table.counties
+    assert loaded.states == table.states
+    for name in table.columns:
+        assert bytes(loaded.columns[name]) == bytes(table.columns[name])
+    assert sorted(loaded.integral) == sorted(table.integral)
+
+
+def test_touched_source_is_hashed_once(table, tmp_path, monkeypatch):
+    path, source = _write(table, tmp_path)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    hashed = []
+    digest = table_cache.file_digest
+    monkeypatch.setattr(table_cache, 'file_digest',
+                        lambda name: hashed.append(name) or digest(name))
+    assert table_cache.load_table(path, source) is not None
+    assert table_cache.load_table(path, source) is not None
+    assert hashed == [source]
+
+
+def test_changed_source_is_not_loaded(table, tmp_path):
+    path, source = _write(table, tmp_path)
+    with open(source, 'r+b') as file:
+        file.write(b'X')
+    assert table_cache.load_table(path, source) is None
+
+
+# Flip a byte in the middle of one column of a compiled table file.
+def _damage_column(path: str, name: str):
+    with open(path, 'r+b') as file:
+        header = table_cache._HEADER.unpack(
+                file.read(table_cache._HEADER.size))
+        metadata = json.loads(file.read(header[6]))
+        start = metadata['columns'][name][0]
+        file.seek(table_cache._HEADER.size + header[6] + start +
+                  4 * metadata['rows'])
+        byte = file.read(1)[0]
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte ^ 0xFF]))
+
+
+def test_damaged_column_is_caught_on_load(table, tmp_path):
+    path, source = _write(table, tmp_path)
+    _damage_column(path, 'Income.Per Capita Income')
+    with open(path, 'rb') as file:
+        with pytest.raises(table_cache.CacheError) as error:
+            table_cache.table_from_buffer(file.read(), source)
+    assert 'Income.Per Capita Income' in str(error.value)
+    assert table_cache.load_table(path, source) is None
+
+
+def test_damaged_table_is_rebuilt(table, tmp_path, monkeypatch):
+    path, source = _write(table, tmp_path)
+    _damage_column(path, 'Population.2014 Population')
+    monkeypatch.setattr(build_data, 'SOURCE_PATH', source)
+    monkeypatch.setattr(build_data, 'COMPILED_PATH', path)
+    monkeypatch.setattr(build_data, 'build_table', lambda tracer=None: table)
+    monkeypatch.setattr(build_data, '_converted', None)
+    assert build_data.get_data() is table
+    rebuilt = table_cache.load_table(path, source)
+    assert rebuilt is not None
+    assert rebuilt.total('Population.2014 Population') == \
+            table.total('Population.2014 Population')
@@ -0,0 +1,228 @@
+import json
+import os
+import sys
+import time
+
+# Timing and allocation tracing for running .ops scripts.
+#
+# A Tracer records spans: a name (the op line, or the phase), a category
+# ("phase", "parse", "op", "filter" or "print"), when it started, how long
+# it took, and details such as the number of rows going into and coming
+# out of a filter.  With memory tracing on, every span also records how
+# many bytes were allocated (net of frees) while it ran, using tracemalloc.
+# The spans can be summarized as a table or exported in the Chrome trace
+# event format (open it in chrome://tracing or https://ui.perfetto.dev).
+#
+# Code that can be traced takes a tracer argument that defaults to None
+# and only touches it behind an "is not None" check, so tracing costs
+# nothing measurable when it is off.  tracemalloc is only imported when a
+# tracer records memory.
+#
+# hw4.py turns tracing on from the environment:
+#   HW4_TRACE=1            print a summary to stderr when the script ends
+#   HW4_TRACE_FILE=<path>  write a Chrome trace of the run to the file
+#   HW4_TRACE_MEMORY=1     record allocations too (slows the run down)
+
+
+class Span:
+    __slots__ = ('name', 'category', 'start', 'seconds', 'memory', 'args')
+
+    # Initialize a new Span.
+    # input: the name as a string
+    # input: the category as a string
+    # input: the perf_counter time it started at
+    # input: the traced memory when it started, or None
+    # input: details to record with it, as a dictionary
+    def __init__(self, name: str, category: str, start: float, memory,
+                 args: dict):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.seconds = None
+        self.memory = memory
+        self.args = args
+
+
+class Tracer:
+    # Initialize a new Tracer.
+    # input: whether to record allocations with tracemalloc
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._traced_memory = None
+        if memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._traced_memory = tracemalloc.get_traced_memory
+
+
+    # Start a span.
+    # input: the name as a string
+    # input: the category as a string
+    # input: details to record with the span
+    # output: the Span, to pass to finish
+    def start(self, name: str, category: str, **args) -> Span:
+        memory = self._traced_memory()[0] if self.memory else None
+        return Span(name, category, time.perf_counter(), memory, args)
+
+
+    # Finish a span and record it.
+    # input: the Span from start
+    # input: more details to record with the span
+    # output: None
+    def finish(self, span: Span, **args):
+        span.seconds = time.perf_counter() - span.start
+        if span.memory is not None:
+            span.args['alloc_bytes'] = \
+                    self._traced_memory()[0] - span.memory
+        span.args.update(args)
+        self.spans.append(span)
+
+
+    # Record a span around a block of code:
+    #   with tracer.span("load data", "phase"): ...
+    def span(self, name: str, category: str, **args):
+        return _SpanContext(self, name, category, args)
+
+
+    # Summarize the spans as a table with a line per distinct (category,
+    # name), in order of first appearance: how many times it ran, its total
+    # and mean time, the rows into and out of its last run (for filters and
+    # plan steps) and the bytes it allocated.
+    # input: no input
+    # output: the lines of the table as a list of strings
+    def summary(self) -> list[str]:
+        totals = {}
+        for span in self.spans:
+            key = (span.category, span.name)
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = [0, 0.0, '', '', 0]
+            total[0] += 1
+            total[1] += span.seconds
+            total[2] = str(span.args.get('rows_in', total[2]))
+            total[3] = str(span.args.get('rows_out', total[3]))
+            total[4] += span.args.get('alloc_bytes', 0)
+
+        names = ['category', 'name', 'calls', 'total ms', 'mean ms',
+                 'rows in', 'rows out']
+        if self.memory:
+            names.append('alloc KB')
+        rows = []
+        for (category, name), (calls, seconds, rows_in, rows_out,
+                               allocated) in totals.items():
+            row = [category, name if len(name) <= 48 else name[:45] + '...',
+                   str(calls), f'{seconds * 1000:.3f}',
+                   f'{seconds * 1000 / calls:.3f}', rows_in, rows_out]
+            if self.memory:
+                row.append(f'{allocated / 1024:.1f}')
+            rows.append(row)
+        widths = [max(map(len, column)) for column in zip(names, *rows)]
+        elapsed = time.perf_counter() - self.origin
+        lines = [f"Trace summary ({len(self.spans)} spans over "
+                 f"{elapsed * 1000:.3f} ms)"]
+        for row in [names] + rows:
+            lines.append('  '.join(value.ljust(width) for value, width
+                                   in zip(row, widths)).rstrip())
+        if self.memory:
+            current, peak = self._traced_memory()
+            lines.append(f"Traced memory: {current / 1024:.1f} KB now, "
+                         f"{peak / 1024:.1f} KB at peak")
+        return lines
+
+
+    # Build a Chrome trace of the spans: one complete ("X") event per span,
+    # with times in microseconds from when the tracer was created.
+    # input: no input
+    # output: the trace as a dictionary, ready for json.dump
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        return {'traceEvents': [
+                    {'name': span.name, 'cat': span.category, 'ph': 'X',
+                     'ts': (span.start - self.origin) * 1e6,
+                     'dur': span.seconds * 1e6, 'pid': pid, 'tid': 0,
+                     'args': span.args}
+                    for span in self.spans],
+                'displayTimeUnit': 'ms'}
+
+
+    # Write the Chrome trace of the spans to a file.
+    # input: the path of the file as a string
+    # output: None
+    def write_chrome_trace(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+
+class _SpanContext:
+    __slots__ = ('_tracer', '_name', '_category', '_args', '_span')
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: dict):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+        self._span = None
+
+
+    def __enter__(self) -> Span:
+        self._span = self._tracer.start(self._name, self._category,
+                                        **self._args)
+        return self._span
+
+
+    def __exit__(self, *exc_info):
+        self._tracer.finish(self._span)
+        return False
+
+
+# Record a span around each item an iterator produces, such as the lines
+# of a script being read and compiled as they are needed.
+# input: the Tracer, or None to leave the iterable as it is
+# input: the iterable
+# input: the name and category of the spans
+# output: an iterator over the same items
+def iterate(tracer, iterable, name: str, category: str):
+    if tracer is None:
+        return iter(iterable)
+    return _traced_iterator(tracer, iter(iterable), name, category)
+
+
+def _traced_iterator(tracer: Tracer, iterator, name: str, category: str):
+    while True:
+        span = tracer.start(name, category)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        tracer.finish(span)
+        yield item
+
+
+# Make a Tracer if the environment asks for tracing.
+# input: the environment variables (defaults to os.environ)
+# output: a Tracer, or None when tracing is off
+def from_environment(environ=None):
+    environ = os.environ if environ is None else environ
+    enabled = environ.get('HW4_TRACE', '') not in ('', '0')
+    if not (enabled or environ.get('HW4_TRACE_FILE')):
+        return None
+    return Tracer(memory=environ.get('HW4_TRACE_MEMORY', '') not in ('', '0'))
+
+
+# Report a traced run the way the environment asks: print the summary to
+# stderr if HW4_TRACE is set, and write the Chrome trace to HW4_TRACE_FILE
+# if that is set.
+# input: the Tracer
+# input: the environment variables (defaults to os.environ)
+# input: the stream to print the summary to (defaults to sys.stderr)
+# output: None
+def report(tracer: Tracer, environ=None, stream=None):
+    environ = os.environ if environ is None else environ
+    if environ.get('HW4_TRACE', '') not in ('', '0'):
+        for line in tracer.summary():
+            print(line, file=stream or sys.stderr)
+    if environ.get('HW4_TRACE_FILE'):
+        tracer.write_chrome_trace(environ['HW4_TRACE_FILE'])